@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de inferencia Donut.
+
+--compare batch (por defecto): un generate por documento contra generate por
+lotes. Carga el modelo una vez, renderiza las entradas (o genera páginas
+sintéticas si no se pasan --inputs) y mide documentos/s del camino individual
+(run_inference) y del camino por lotes (run_batch_inference) para cada tamaño
+de --batch-sizes, contando los reportes que difieren del individual.
+
+--compare cpu-mode: modelo fp32 sin corte anticipado (línea base) contra
+--cpu-mode (decoder int8 + corte al cerrar el JSON). Reporta latencia por
+documento y, como precisión, la concordancia de campos con la línea base y,
+si se pasa --labels ({"archivo": {campo: valor}}), contra los valores esperados.
+
+Uso:
+  python donut_benchmark.py --docs 16 --batch-sizes 2,4,8
+  python donut_benchmark.py --inputs storage/invoices/*.pdf --model ./models/donut
+  python donut_benchmark.py --compare cpu-mode --inputs samples/*.pdf --labels labels.json --threads 4
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+from PIL import Image, ImageDraw
+
+from donut_inference import load_image
+from donut_model import configure_threads, load_model, run_batch_inference, run_inference
+
+
+def synthetic_pages(count: int) -> List[Image.Image]:
+  """Páginas A4 en blanco con unas líneas de texto, suficientes para ejercitar el encoder."""
+  pages = []
+  for number in range(count):
+    page = Image.new('RGB', (1240, 1754), 'white')
+    draw = ImageDraw.Draw(page)
+    draw.text((80, 80), 'FACTURA ELECTRONICA', fill='black')
+    draw.text((80, 120), f'F001-{number + 1:08d}', fill='black')
+    for line in range(20):
+      draw.text((80, 200 + line * 40), f'{line + 1:02d} producto {number * 7 + line} 2 x 15.00', fill='black')
+    draw.text((80, 1100), f'Importe Total: S/ {100 + number * 3:.2f}', fill='black')
+    pages.append(page)
+  return pages
+
+
+def run_single(processor, model, device, images, max_length):
+  started = time.perf_counter()
+  reports = [run_inference(processor, model, device, image, max_length=max_length) for image in images]
+  return reports, time.perf_counter() - started
+
+
+def run_batched(processor, model, device, images, batch_size, max_length):
+  started = time.perf_counter()
+  reports = []
+  for offset in range(0, len(images), batch_size):
+    chunk = images[offset:offset + batch_size]
+    reports.extend(run_batch_inference(processor, model, device, chunk, max_length=max_length))
+  return reports, time.perf_counter() - started
+
+
+def latency_summary(latencies: List[float]) -> dict:
+  ordered = sorted(latencies)
+  return {
+    'meanMs': round(sum(ordered) / len(ordered), 1),
+    'p50Ms': round(ordered[len(ordered) // 2], 1),
+    'p95Ms': round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 1),
+    'docsPerSec': round(len(ordered) / (sum(ordered) / 1000), 2),
+  }
+
+
+def run_mode(processor, model, device, images, max_length, stop_at_json):
+  reports, latencies = [], []
+  for image in images:
+    started = time.perf_counter()
+    reports.append(run_inference(processor, model, device, image, max_length=max_length, stop_at_json=stop_at_json))
+    latencies.append((time.perf_counter() - started) * 1000)
+  return reports, latencies
+
+
+def field_agreement(reports: List[Optional[dict]], expected: List[Optional[Dict[str, str]]]) -> Optional[float]:
+  """Fracción de campos esperados que el reporte reproduce exactamente."""
+  total = matched = 0
+  for report, fields in zip(reports, expected):
+    if not fields:
+      continue
+    got = (report or {}).get('fields') or {}
+    total += len(fields)
+    matched += sum(1 for name, value in fields.items() if got.get(name) == value)
+  return round(matched / total, 4) if total else None
+
+
+def compare_cpu_mode(args, images, names) -> dict:
+  configure_threads(args.threads, args.interop_threads)
+  processor, model, device = load_model(args.model)
+  print(f'{len(images)} documentos, línea base fp32...', file=sys.stderr)
+  baseline, baseline_latencies = run_mode(processor, model, device, images, args.max_length, False)
+  del model
+
+  processor, model, device = load_model(args.model, cpu_mode=True)
+  print('cpu-mode...', file=sys.stderr)
+  reports, latencies = run_mode(processor, model, device, images, args.max_length, True)
+
+  report = {
+    'docs': len(images),
+    'device': str(device),
+    'threads': torch.get_num_threads(),
+    'maxLength': args.max_length,
+    'baseline': latency_summary(baseline_latencies),
+    'cpuMode': latency_summary(latencies),
+    'parsed': {
+      'baseline': sum(1 for item in baseline if item),
+      'cpuMode': sum(1 for item in reports if item),
+    },
+    'exactMatch': round(sum(1 for a, b in zip(baseline, reports) if a == b) / len(images), 4),
+    'fieldAgreementWithBaseline': field_agreement(reports, [(item or {}).get('fields') for item in baseline]),
+  }
+  report['speedup'] = round(report['baseline']['meanMs'] / report['cpuMode']['meanMs'], 2)
+  if args.labels:
+    with open(args.labels, 'r', encoding='utf-8') as fh:
+      labels = json.load(fh)
+    expected = [labels.get(name) for name in names]
+    report['labelAccuracy'] = {
+      'baseline': field_agreement(baseline, expected),
+      'cpuMode': field_agreement(reports, expected),
+    }
+  return report
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark de inferencia Donut (lotes o cpu-mode)')
+  parser.add_argument('--model', default='naver-clova-ix/donut-base-finetuned-rvlcdip')
+  parser.add_argument('--inputs', nargs='*', default=None, help='PDFs/imágenes (por defecto páginas sintéticas)')
+  parser.add_argument('--docs', type=int, default=8, help='Páginas sintéticas si no hay --inputs')
+  parser.add_argument('--batch-sizes', default='2,4,8', help='Tamaños de lote a probar, separados por coma')
+  parser.add_argument('--max-length', type=int, default=1024, help='max_length de generate')
+  parser.add_argument('--threads', type=int, default=0, help='Hilos intra-op de torch (0 = por defecto)')
+  parser.add_argument('--interop-threads', type=int, default=0, help='Hilos inter-op de torch (0 = por defecto)')
+  parser.add_argument('--compare', choices=['batch', 'cpu-mode'], default='batch')
+  parser.add_argument('--labels', default=None, help='JSON {nombre de archivo: {campo: valor}} (cpu-mode)')
+  args = parser.parse_args()
+
+  if args.inputs:
+    images = [load_image(Path(item)) for item in args.inputs]
+    names = [Path(item).name for item in args.inputs]
+  else:
+    images = synthetic_pages(args.docs)
+    names = [f'synthetic-{number}' for number in range(len(images))]
+
+  if args.compare == 'cpu-mode':
+    print(json.dumps(compare_cpu_mode(args, images, names), indent=2))
+    return
+
+  configure_threads(args.threads, args.interop_threads)
+
+  processor, model, device = load_model(args.model)
+  print(f'{len(images)} documentos en {device}, modo individual...', file=sys.stderr)
+  baseline, single_seconds = run_single(processor, model, device, images, args.max_length)
+
+  report = {
+    'docs': len(images),
+    'device': str(device),
+    'threads': torch.get_num_threads(),
+    'maxLength': args.max_length,
+    'single': {
+      'seconds': round(single_seconds, 2),
+      'docsPerSec': round(len(images) / single_seconds, 2),
+    },
+    'batched': [],
+  }
+  for batch_size in [int(size) for size in args.batch_sizes.split(',') if size.strip()]:
+    print(f'batch={batch_size}...', file=sys.stderr)
+    reports, seconds = run_batched(processor, model, device, images, batch_size, args.max_length)
+    report['batched'].append({
+      'batchSize': batch_size,
+      'seconds': round(seconds, 2),
+      'docsPerSec': round(len(images) / seconds, 2),
+      'speedup': round(single_seconds / seconds, 2) if seconds else None,
+      'mismatches': sum(1 for a, b in zip(baseline, reports) if a != b),
+    })
+  print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+  main()
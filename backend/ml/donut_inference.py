@@ -2,93 +2,435 @@
 # -*- coding: utf-8 -*-
 """
 Simple CLI wrapper that runs Donut inference on a PDF/image and returns structured fields.
+
+Con --server el proceso queda residente: carga el modelo una vez, hace un
+warm-up y atiende comandos JSON por línea en stdin (ver server_mode).
+
+Con --cpu-mode (hosts sin GPU) las capas Linear del decoder se cuantizan a int8
+(quantize_dynamic), los hilos de torch se fijan con --threads/--interop-threads
+y la generación se corta en cuanto se cierra el JSON de salida.
+
+Los reportes COMPLETED se guardan en la cache compartida de resultados
+(result_cache.py) por hash del archivo + modelo y opciones de generación;
+--no-cache la desactiva. Fuera de --server la cache se consulta antes de
+importar torch: si todas las entradas están, no se carga el modelo (el modelo
+y la inferencia viven en donut_model.py).
 """
 
 import argparse
 import json
 import os
+import sys
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
-import torch
-from pdf2image import convert_from_path
 from PIL import Image
-from transformers import DonutProcessor, VisionEncoderDecoderModel
-
-
-def load_image(file_path: Path, dpi: int = 300) -> Image.Image:
-  if file_path.suffix.lower() == '.pdf':
-    pages = convert_from_path(str(file_path), dpi=dpi, first_page=1, last_page=1)
-    return pages[0]
-  image = Image.open(str(file_path))
-  return image.convert('RGB')
-
-
-def load_model(model_name: str):
-  processor = DonutProcessor.from_pretrained(model_name, use_fast=True)
-  model = VisionEncoderDecoderModel.from_pretrained(model_name)
-  device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-  model.to(device)
-  model.eval()
-  return processor, model, device
-
-
-def run_inference(
-  processor: DonutProcessor,
-  model: VisionEncoderDecoderModel,
-  device: torch.device,
-  image: Image.Image,
-) -> Optional[dict]:
-  pixel_values = processor(image, return_tensors='pt').pixel_values.to(device)
-  generated_ids = model.generate(
-    pixel_values,
-    max_length=1024,
-    pad_token_id=processor.tokenizer.pad_token_id,
-    eos_token_id=processor.tokenizer.sep_token_id,
-  )
-  decoded = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-  start = decoded.find('{')
-  end = decoded.rfind('}')
-  if start == -1 or end == -1:
+
+from donut_pages import (
+  DEFAULT_PAGE_CACHE_DIR,
+  DEFAULT_PAGE_CACHE_MB,
+  first_page_image,
+  iter_pages,
+  set_page_cache,
+  target_size,
+)
+from result_cache import ResultCache, default_cache, file_hash
+
+
+def load_image(file_path: Path, target=None, dpi: int = 300) -> Image.Image:
+  """Primera página; con target (ver donut_pages.target_size) se rasteriza a ese tamaño."""
+  return first_page_image(file_path, target, dpi)
+
+
+_result_cache: Dict[str, object] = {'cache': None, 'version': ''}
+
+
+def set_result_cache(cache: Optional[ResultCache], version: str = ''):
+  """version identifica todo lo que cambia la salida (modelo, cpu-mode, max_length...)."""
+  _result_cache['cache'] = cache
+  _result_cache['version'] = version
+
+
+def _cache_key(file_path: Path, all_pages: bool) -> Optional[str]:
+  cache = _result_cache['cache']
+  if cache is None:
     return None
-  payload = decoded[start:end + 1]
-  try:
-    data = json.loads(payload)
-  except json.JSONDecodeError:
+  pages = 'all' if all_pages else 'first'
+  return cache.key(file_hash(file_path), f"donut:{_result_cache['version']}:pages={pages}")
+
+
+def _cached_report(key: Optional[str], started: float) -> Optional[dict]:
+  if key is None:
     return None
-  document = data.get('document', {})
+  report = _result_cache['cache'].get(key)
+  if report is not None:
+    report['cached'] = True
+    report['timings'] = {'total': round((time.perf_counter() - started) * 1000, 1)}
+  return report
+
+
+def _store_report(key: Optional[str], report: dict):
+  # Solo resultados completos: un FAILED se reintenta en la siguiente petición
+  if key is not None and report.get('status') == 'COMPLETED':
+    _result_cache['cache'].put(key, {name: value for name, value in report.items() if name not in ('timings', 'batchSize')})
+
+
+def cached_reports(file_paths: List[Path], all_pages: bool = False) -> List[Optional[dict]]:
+  """Reportes de la cache de resultados (None si falta) sin tocar el modelo."""
+  started = time.perf_counter()
+  return [_cached_report(_cache_key(file_path, all_pages), started) for file_path in file_paths]
+
+
+def print_reports(reports: List[dict], load_ms: float, elapsed: float):
+  """Salida del CLI: un reporte suelto para una entrada, una lista para varias."""
+  if len(reports) > 1:
+    print(
+      f'timings: load={load_ms}ms; {len(reports)} documents in {elapsed:.2f}s ({len(reports) / elapsed:.2f} docs/s)',
+      file=sys.stderr,
+    )
+    print(json.dumps(reports, ensure_ascii=False))
+    return
+  report = reports[0]
+  timings = report.pop('timings')
+  print(f'timings: load={load_ms}ms ' + ' '.join(f'{k}={v}ms' for k, v in timings.items()), file=sys.stderr)
+  print(json.dumps(report, ensure_ascii=False))
+
+
+def process_files(processor, model, device, file_paths: List[Path], model_name: str, max_batch: int = 4) -> List[dict]:
+  """
+  Procesa varios archivos en grupos de max_batch imágenes por generate. Cada
+  reporte lleva los 'timings' de su grupo y 'batchSize'. Los archivos que ya
+  están en la cache de resultados no entran en ningún grupo.
+  """
+  from donut_model import run_batch_inference
+
+  reports: List[Optional[dict]] = [None] * len(file_paths)
+  keys = [_cache_key(file_path, False) for file_path in file_paths]
+  pending = []
+  for position, key in enumerate(keys):
+    reports[position] = _cached_report(key, time.perf_counter())
+    if reports[position] is None:
+      pending.append(position)
+
+  max_batch = max(max_batch, 1)
+  for offset in range(0, len(pending), max_batch):
+    chunk = pending[offset:offset + max_batch]
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    images = [load_image(file_paths[position], target_size(processor)) for position in chunk]
+    timings['render'] = round((time.perf_counter() - started) * 1000, 1)
+    results = run_batch_inference(processor, model, device, images, timings)
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+    for position, report in zip(chunk, results):
+      report = report or {'status': 'FAILED', 'modelVersion': model_name}
+      _store_report(keys[position], report)
+      report['timings'] = dict(timings)
+      report['batchSize'] = len(chunk)
+      reports[position] = report
+  return reports
+
+
+def merge_page_reports(page_reports: List[dict], model_name: str) -> dict:
+  """Campos de la primera página que los trae; confidence la mayor entre páginas."""
+  fields: Dict[str, object] = {}
+  confidences = []
+  for page_report in page_reports:
+    for name, value in (page_report.get('fields') or {}).items():
+      if name not in fields and value not in (None, ''):
+        fields[name] = value
+    if page_report.get('confidence') is not None:
+      confidences.append(page_report['confidence'])
+  completed = any(page_report.get('status') == 'COMPLETED' for page_report in page_reports)
   return {
-    'status': 'COMPLETED',
-    'modelVersion': model.config.name_or_path,
-    'fields': document.get('fields', {}),
-    'confidence': document.get('confidence'),
+    'status': 'COMPLETED' if completed else 'FAILED',
+    'modelVersion': model_name,
+    'fields': fields,
+    'confidence': max(confidences) if confidences else None,
   }
 
 
+def process_pages(processor, model, device, file_path: Path, model_name: str, max_batch: int = 4) -> dict:
+  """
+  Todas las páginas de un PDF, en grupos de max_batch por generate. Las páginas
+  llegan de a una desde iter_pages, así que en memoria hay como mucho un grupo.
+  """
+  from donut_model import run_batch_inference
+
+  timings = {'render': 0.0, 'preprocess': 0.0, 'generate': 0.0, 'decode': 0.0}
+  started = time.perf_counter()
+  page_reports: List[dict] = []
+  chunk: List[Image.Image] = []
+  numbers: List[int] = []
+
+  def flush():
+    chunk_timings: Dict[str, float] = {}
+    results = run_batch_inference(processor, model, device, chunk, chunk_timings)
+    for stage, value in chunk_timings.items():
+      timings[stage] = round(timings[stage] + value, 1)
+    for number, result in zip(numbers, results):
+      page_report = result or {'status': 'FAILED', 'modelVersion': model_name}
+      page_report['page'] = number
+      page_reports.append(page_report)
+    chunk.clear()
+    numbers.clear()
+
+  pages = iter_pages(file_path, target_size(processor))
+  while True:
+    render_started = time.perf_counter()
+    page = next(pages, None)
+    timings['render'] = round(timings['render'] + (time.perf_counter() - render_started) * 1000, 1)
+    if page is None:
+      break
+    numbers.append(page[0])
+    chunk.append(page[1])
+    if len(chunk) >= max(max_batch, 1):
+      flush()
+  if chunk:
+    flush()
+
+  report = merge_page_reports(page_reports, model_name)
+  report['pages'] = page_reports
+  timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+  report['timings'] = timings
+  return report
+
+
+def process_file(
+  processor,
+  model,
+  device,
+  file_path: Path,
+  model_name: str,
+  all_pages: bool = False,
+  max_batch: int = 4,
+) -> dict:
+  """
+  Render + inferencia de un archivo; el reporte incluye 'timings' (ms por etapa).
+  Si el archivo ya está en la cache de resultados se devuelve con 'cached'.
+  """
+  started = time.perf_counter()
+  key = _cache_key(file_path, all_pages)
+  report = _cached_report(key, started)
+  if report is not None:
+    return report
+  from donut_model import run_inference
+
+  if all_pages:
+    report = process_pages(processor, model, device, file_path, model_name, max_batch)
+    _store_report(key, report)
+    return report
+
+  timings: Dict[str, float] = {}
+  image = load_image(file_path, target_size(processor))
+  timings['render'] = round((time.perf_counter() - started) * 1000, 1)
+  report = run_inference(processor, model, device, image, timings)
+  if not report:
+    report = {'status': 'FAILED', 'modelVersion': model_name}
+  _store_report(key, report)
+  timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+  report['timings'] = timings
+  return report
+
+
+def server_mode(
+  processor,
+  model,
+  device,
+  model_name: str,
+  load_ms: float,
+  max_batch: int = 4,
+  cpu_mode: bool = False,
+  default_all_pages: bool = False,
+):
+  """
+  Modo servidor: mantiene el procesador y el modelo en memoria.
+
+  Formato de comando (una línea JSON por comando):
+  {"id": "uuid", "command": "infer", "params": {"input": "/ruta/factura.pdf", "allPages": false}}
+  {"id": "uuid", "command": "infer-batch", "params": {"inputs": ["/ruta/a.pdf", "/ruta/b.pdf"], "allPages": false}}
+  {"id": "uuid", "command": "ping"}
+  infer-batch genera en grupos de max_batch documentos y devuelve una lista de
+  reportes en el mismo orden (cada uno con batchSize). Con allPages (en infer o
+  infer-batch) se procesan todas las páginas de cada archivo (en grupos de
+  max_batch) y el reporte trae 'pages' con el resultado de cada una y los
+  campos combinados.
+
+  Formato de respuesta (una línea JSON por respuesta):
+  {"id": "uuid", "result": {status, modelVersion, fields, confidence,
+                            timings: {render, preprocess, generate, decode, total}}}
+  {"id": "uuid", "error": "mensaje de error"}
+  """
+  import torch
+
+  from donut_model import generation_settings, warm_up
+
+  warmup_ms = warm_up(processor, model, device)
+  generation = generation_settings()
+  print(
+    json.dumps({
+      'status': 'ready',
+      'modelLoaded': True,
+      'modelVersion': model_name,
+      'device': str(device),
+      'loadMs': load_ms,
+      'warmupMs': warmup_ms,
+      'cpuMode': cpu_mode,
+      'threads': torch.get_num_threads(),
+      'maxLength': generation['max_length'],
+      'stopAtJson': generation['stop_at_json'],
+      'renderSize': target_size(processor),
+    }),
+    flush=True,
+  )
+
+  for line in sys.stdin:
+    line = line.strip()
+    if not line:
+      continue
+
+    request_id = 'unknown'
+    try:
+      request = json.loads(line)
+      request_id = request.get('id', 'unknown')
+      command = request.get('command')
+      params = request.get('params') or {}
+
+      if command == 'infer':
+        file_path = Path(params.get('input') or '')
+        if not file_path.is_file():
+          raise ValueError(f'File not found: {file_path}')
+        all_pages = bool(params.get('allPages', default_all_pages))
+        result = process_file(processor, model, device, file_path, model_name, all_pages, max_batch)
+      elif command == 'infer-batch':
+        inputs = params.get('inputs') or []
+        if not isinstance(inputs, list):
+          raise ValueError('inputs debe ser una lista')
+        file_paths = [Path(item) for item in inputs]
+        missing = [str(file_path) for file_path in file_paths if not file_path.is_file()]
+        if missing:
+          raise ValueError(f'File not found: {", ".join(missing)}')
+        batch = int(params.get('maxBatch') or max_batch)
+        if params.get('allPages', default_all_pages):
+          result = [
+            process_file(processor, model, device, file_path, model_name, True, batch)
+            for file_path in file_paths
+          ]
+        else:
+          result = process_files(processor, model, device, file_paths, model_name, batch)
+      elif command == 'ping':
+        result = {'status': 'ok'}
+      else:
+        raise ValueError(f'Unknown command: {command}')
+      response = {'id': request_id, 'result': result}
+    except json.JSONDecodeError as exc:
+      response = {'id': request_id, 'error': f'JSON parse error: {exc}'}
+    except Exception as exc:
+      response = {'id': request_id, 'error': str(exc)}
+
+    print(json.dumps(response, ensure_ascii=False), flush=True)
+
 
 def main():
   parser = argparse.ArgumentParser(description='Run Donut inference over invoices.')
-  parser.add_argument('--input', '-i', required=True, help='Path to PDF or image.')
+  parser.add_argument(
+    '--input',
+    '-i',
+    nargs='+',
+    help='Path to PDF or image (several paths are processed in batches of --max-batch; with --all-pages, file by file).',
+  )
+  parser.add_argument(
+    '--server',
+    action='store_true',
+    help='Keep the model loaded and read JSON-lines commands from stdin.',
+  )
+  parser.add_argument(
+    '--max-batch',
+    type=int,
+    default=4,
+    help='Documents per batched generate call (multiple --input paths or infer-batch).',
+  )
   parser.add_argument(
     '--model',
     default='naver-clova-ix/donut-base-finetuned-rvlcdip',
     help='HuggingFace Donut model identifier.',
   )
+  parser.add_argument(
+    '--cpu-mode',
+    action='store_true',
+    help='CPU performance mode: int8 dynamic quantization of the decoder and early stop at the closing }.',
+  )
+  parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads (0 = torch default).')
+  parser.add_argument('--interop-threads', type=int, default=0, help='torch inter-op threads (0 = torch default).')
+  parser.add_argument('--max-length', type=int, default=1024, help='Maximum generated tokens per document.')
+  parser.add_argument(
+    '--stop-at-json',
+    action=argparse.BooleanOptionalAction,
+    default=None,
+    help='Stop generating once the output JSON is closed (default: on with --cpu-mode).',
+  )
+  parser.add_argument('--all-pages', action='store_true', help='Process every PDF page, not only the first one.')
+  parser.add_argument(
+    '--page-cache',
+    default=str(DEFAULT_PAGE_CACHE_DIR),
+    help='Directory for rendered pages keyed by PDF hash (empty string disables it).',
+  )
+  parser.add_argument('--page-cache-mb', type=int, default=DEFAULT_PAGE_CACHE_MB, help='Page cache size limit (MB).')
+  parser.add_argument(
+    '--no-cache',
+    action='store_true',
+    help='Do not read or write the shared result cache (ML_RESULT_CACHE_DIR).',
+  )
   args = parser.parse_args()
 
-  file_path = Path(args.input)
-  if not file_path.exists():
-    raise SystemExit(f'File not found: {file_path}')
+  if not args.server and not args.input:
+    parser.error('--input is required unless --server is used')
+  file_paths = [Path(item) for item in args.input or []]
+  for file_path in file_paths:
+    if not file_path.exists():
+      raise SystemExit(f'File not found: {file_path}')
 
   os.environ.setdefault('USE_FAST', '1')
   os.environ.setdefault('HF_HUB_ENABLE_SYMLINKS', '0')
 
-  processor, model, device = load_model(args.model)
-  image = load_image(file_path)
-  report = run_inference(processor, model, device, image)
-  if not report:
-    report = {'status': 'FAILED', 'modelVersion': args.model}
-  print(json.dumps(report, ensure_ascii=False))
+  set_page_cache(args.page_cache or None, args.page_cache_mb)
+  stop_at_json = args.cpu_mode if args.stop_at_json is None else args.stop_at_json
+  set_result_cache(
+    default_cache(enabled=not args.no_cache),
+    f'{args.model}:cpu={int(args.cpu_mode)}:max={args.max_length}:stop={int(stop_at_json)}',
+  )
+
+  if not args.server:
+    started = time.perf_counter()
+    reports = cached_reports(file_paths, args.all_pages)
+    if all(report is not None for report in reports):
+      # Todo en cache: ni torch ni el modelo
+      print_reports(reports, 0.0, time.perf_counter() - started)
+      return
+
+  from donut_model import configure_threads, load_model, set_generation
+
+  configure_threads(args.threads, args.interop_threads)
+  set_generation(max_length=args.max_length, stop_at_json=stop_at_json)
+
+  started = time.perf_counter()
+  processor, model, device = load_model(args.model, cpu_mode=args.cpu_mode)
+  load_ms = round((time.perf_counter() - started) * 1000, 1)
+
+  if args.server:
+    server_mode(processor, model, device, args.model, load_ms, args.max_batch, args.cpu_mode, args.all_pages)
+    return
+
+  started = time.perf_counter()
+  if len(file_paths) > 1 and not args.all_pages:
+    reports = process_files(processor, model, device, file_paths, args.model, args.max_batch)
+  else:
+    # Con --all-pages cada archivo agrupa sus propias páginas en lotes de --max-batch
+    reports = [
+      process_file(processor, model, device, file_path, args.model, args.all_pages, args.max_batch)
+      for file_path in file_paths
+    ]
+  print_reports(reports, load_ms, time.perf_counter() - started)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Modelo Donut para donut_inference.py: carga (con --cpu-mode el decoder se
+cuantiza a int8), configuración de hilos y de generación, y la inferencia en sí
+(individual o por lotes).
+
+Es el único módulo del pipeline que importa torch/transformers: donut_inference.py
+lo importa solo si alguna entrada no está en la cache de resultados, así un hit
+no paga la importación ni la carga del modelo.
+"""
+
+import json
+import sys
+import time
+from typing import Dict, List, Optional
+
+import torch
+from PIL import Image
+from transformers import DonutProcessor, StoppingCriteria, StoppingCriteriaList, VisionEncoderDecoderModel
+
+
+def configure_threads(threads: int = 0, interop_threads: int = 0):
+  """0 deja el valor por defecto de torch. Debe llamarse antes de la primera inferencia."""
+  if threads > 0:
+    torch.set_num_threads(threads)
+  if interop_threads > 0:
+    try:
+      torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+      # Solo se puede fijar una vez y antes de cualquier trabajo paralelo
+      print('interop threads already initialized; ignoring --interop-threads', file=sys.stderr)
+
+
+def load_model(model_name: str, cpu_mode: bool = False):
+  processor = DonutProcessor.from_pretrained(model_name, use_fast=True)
+  model = VisionEncoderDecoderModel.from_pretrained(model_name)
+  device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+  model.to(device)
+  model.eval()
+  if cpu_mode and device.type == 'cpu':
+    # El decoder autoregresivo domina el tiempo en CPU y es casi todo Linear;
+    # el encoder (Swin) se deja en fp32
+    model.decoder = torch.quantization.quantize_dynamic(model.decoder, {torch.nn.Linear}, dtype=torch.qint8)
+  return processor, model, device
+
+
+_generation = {'max_length': 1024, 'stop_at_json': False}
+
+
+def set_generation(max_length: Optional[int] = None, stop_at_json: Optional[bool] = None):
+  if max_length is not None:
+    _generation['max_length'] = max_length
+  if stop_at_json is not None:
+    _generation['stop_at_json'] = stop_at_json
+
+
+def generation_settings() -> Dict[str, object]:
+  return dict(_generation)
+
+
+class JsonClosedCriteria(StoppingCriteria):
+  """
+  Detiene cada secuencia cuando las llaves del JSON generado quedan balanceadas
+  (se emitió el '}' de cierre), en lugar de esperar al eos o a max_length.
+  Las llaves dentro de strings JSON no cuentan ({"a": "}"} no corta antes de
+  tiempo): por token se precalculan solo los caracteres relevantes ({ } " \\) y
+  cada llamada recorre únicamente los tokens nuevos de cada secuencia.
+  """
+
+  def __init__(self, tokenizer, device: torch.device):
+    self.pieces = []
+    for token in tokenizer.convert_ids_to_tokens(list(range(len(tokenizer)))):
+      self.pieces.append(''.join(char for char in (token or '') if char in '{}"\\'))
+    self.scanned = 0
+    self.states: List[List] = []
+
+  def _scan(self, state: List, piece: str):
+    """state = [profundidad, dentro de string, escape pendiente, abrió alguna llave]."""
+    for char in piece:
+      if state[2]:
+        state[2] = False
+      elif state[1]:
+        if char == '\\':
+          state[2] = True
+        elif char == '"':
+          state[1] = False
+      elif char == '"':
+        state[1] = True
+      elif char == '{':
+        state[0] += 1
+        state[3] = True
+      elif char == '}':
+        state[0] -= 1
+
+  def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+    length = input_ids.shape[1]
+    if length <= self.scanned or len(self.states) != input_ids.shape[0]:
+      # Nueva llamada a generate: el estado se reinicia
+      self.scanned = 0
+      self.states = [[0, False, False, False] for _ in range(input_ids.shape[0])]
+    for state, row in zip(self.states, input_ids[:, self.scanned:].tolist()):
+      for token_id in row:
+        piece = self.pieces[token_id] if token_id < len(self.pieces) else ''
+        if piece:
+          self._scan(state, piece)
+    self.scanned = length
+    done = [state[3] and state[0] <= 0 and not state[1] for state in self.states]
+    return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+_stop_criteria: Dict[int, JsonClosedCriteria] = {}
+
+
+def json_stop_criteria(processor: DonutProcessor, device: torch.device) -> StoppingCriteriaList:
+  key = id(processor.tokenizer)
+  if key not in _stop_criteria:
+    _stop_criteria[key] = JsonClosedCriteria(processor.tokenizer, device)
+  return StoppingCriteriaList([_stop_criteria[key]])
+
+
+def preprocess(processor: DonutProcessor, image, device: torch.device) -> torch.Tensor:
+  """image puede ser una imagen o una lista (batch)."""
+  return processor(image, return_tensors='pt').pixel_values.to(device)
+
+
+def generate_ids(
+  processor: DonutProcessor,
+  model: VisionEncoderDecoderModel,
+  pixel_values: torch.Tensor,
+  max_length: Optional[int] = None,
+  stop_at_json: Optional[bool] = None,
+) -> torch.Tensor:
+  """None toma max_length / stop_at_json de la configuración global (set_generation)."""
+  if max_length is None:
+    max_length = _generation['max_length']
+  if stop_at_json is None:
+    stop_at_json = _generation['stop_at_json']
+  stopping = json_stop_criteria(processor, pixel_values.device) if stop_at_json else None
+  with torch.inference_mode():
+    return model.generate(
+      pixel_values,
+      max_length=max_length,
+      pad_token_id=processor.tokenizer.pad_token_id,
+      eos_token_id=processor.tokenizer.sep_token_id,
+      stopping_criteria=stopping,
+    )
+
+
+def parse_output(decoded: str, model_version: str) -> Optional[dict]:
+  start = decoded.find('{')
+  end = decoded.rfind('}')
+  if start == -1 or end == -1:
+    return None
+  payload = decoded[start:end + 1]
+  try:
+    data = json.loads(payload)
+  except json.JSONDecodeError:
+    return None
+  document = data.get('document', {})
+  return {
+    'status': 'COMPLETED',
+    'modelVersion': model_version,
+    'fields': document.get('fields', {}),
+    'confidence': document.get('confidence'),
+  }
+
+
+def run_inference(
+  processor: DonutProcessor,
+  model: VisionEncoderDecoderModel,
+  device: torch.device,
+  image: Image.Image,
+  timings: Optional[Dict[str, float]] = None,
+  max_length: Optional[int] = None,
+  stop_at_json: Optional[bool] = None,
+) -> Optional[dict]:
+  """Si se pasa timings, se completa con los ms de preprocess, generate y decode."""
+  started = time.perf_counter()
+  pixel_values = preprocess(processor, image, device)
+  preprocessed = time.perf_counter()
+  generated_ids = generate_ids(processor, model, pixel_values, max_length, stop_at_json)
+  generated = time.perf_counter()
+  decoded = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+  report = parse_output(decoded, model.config.name_or_path)
+  if timings is not None:
+    timings['preprocess'] = round((preprocessed - started) * 1000, 1)
+    timings['generate'] = round((generated - preprocessed) * 1000, 1)
+    timings['decode'] = round((time.perf_counter() - generated) * 1000, 1)
+  return report
+
+
+def run_batch_inference(
+  processor: DonutProcessor,
+  model: VisionEncoderDecoderModel,
+  device: torch.device,
+  images: List[Image.Image],
+  timings: Optional[Dict[str, float]] = None,
+  max_length: Optional[int] = None,
+  stop_at_json: Optional[bool] = None,
+) -> List[Optional[dict]]:
+  """
+  Una sola llamada a generate para varias imágenes. El procesador lleva todas
+  al mismo tamaño (resize + pad), así que pixel_values se apila sin más; las
+  secuencias que terminan antes se rellenan con pad y se decodifican por separado.
+  """
+  started = time.perf_counter()
+  pixel_values = preprocess(processor, images, device)
+  preprocessed = time.perf_counter()
+  generated_ids = generate_ids(processor, model, pixel_values, max_length, stop_at_json)
+  generated = time.perf_counter()
+  decoded = processor.batch_decode(generated_ids, skip_special_tokens=True)
+  reports = [parse_output(text, model.config.name_or_path) for text in decoded]
+  if timings is not None:
+    timings['preprocess'] = round((preprocessed - started) * 1000, 1)
+    timings['generate'] = round((generated - preprocessed) * 1000, 1)
+    timings['decode'] = round((time.perf_counter() - generated) * 1000, 1)
+  return reports
+
+
+def warm_up(processor, model, device) -> float:
+  """Una generación corta sobre una imagen en blanco para inicializar kernels y memoria."""
+  started = time.perf_counter()
+  image = Image.new('RGB', (640, 480), 'white')
+  generate_ids(processor, model, preprocess(processor, image, device), max_length=8)
+  return round((time.perf_counter() - started) * 1000, 1)
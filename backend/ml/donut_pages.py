@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Renderizado de páginas para donut_inference.py.
+
+Las páginas se rasterizan directamente a la resolución de entrada del modelo
+(processor.image_processor.size) en lugar de a 300 DPI para luego reducirlas,
+se entregan de a una (generador) para que un PDF largo no quede entero en
+memoria, y se guardan en una cache en disco por hash del PDF + tamaño destino
+para que las re-ejecuciones no vuelvan a rasterizar.
+
+Con PyMuPDF instalado se renderiza en proceso con el zoom exacto de cada página;
+si no, se usa pdf2image (poppler) página por página con la altura destino.
+"""
+
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from PIL import Image
+
+from result_cache import file_hash
+
+try:
+  # PyMuPDF >= 1.24: 'import fitz' imprime un aviso de deprecación en stdout,
+  # que rompe el JSON (y la línea de ready) que lee el proceso Node
+  import pymupdf as fitz
+except ImportError:
+  try:
+    import fitz  # PyMuPDF < 1.24
+  except ImportError:
+    fitz = None
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_PAGE_CACHE_DIR = SCRIPT_DIR / 'cache' / 'donut-pages'
+DEFAULT_PAGE_CACHE_MB = 512
+
+_cache = {'dir': DEFAULT_PAGE_CACHE_DIR, 'max_mb': DEFAULT_PAGE_CACHE_MB}
+
+
+def set_page_cache(cache_dir: Optional[Path], max_mb: int = DEFAULT_PAGE_CACHE_MB):
+  """cache_dir=None desactiva la cache de páginas."""
+  _cache['dir'] = Path(cache_dir) if cache_dir else None
+  _cache['max_mb'] = max_mb
+
+
+def target_size(processor) -> Optional[Tuple[int, int]]:
+  """(ancho, alto) de entrada del modelo, o None si el procesador no lo expone."""
+  size = getattr(getattr(processor, 'image_processor', None), 'size', None)
+  if isinstance(size, dict):
+    width, height = size.get('width'), size.get('height')
+  else:
+    # Versiones recientes de transformers usan SizeDict (atributos)
+    width, height = getattr(size, 'width', None), getattr(size, 'height', None)
+  if width and height:
+    return int(width), int(height)
+  return None
+
+
+def _fit_zoom(width: float, height: float, target: Optional[Tuple[int, int]], dpi: int) -> float:
+  """Zoom para que la página quepa en target (como el resize del procesador Donut)."""
+  if target is None:
+    return dpi / 72
+  return min(target[0] / width, target[1] / height)
+
+
+class _PymupdfRenderer:
+  """Render en proceso con el zoom exacto de cada página."""
+
+  def __init__(self, file_path: Path, target, dpi: int):
+    self.doc = fitz.open(str(file_path))
+    self.target, self.dpi = target, dpi
+
+  def page_count(self) -> int:
+    return self.doc.page_count
+
+  def render(self, number: int) -> Image.Image:
+    page = self.doc.load_page(number - 1)
+    zoom = _fit_zoom(page.rect.width, page.rect.height, self.target, self.dpi)
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+  def close(self):
+    self.doc.close()
+
+
+class _Pdf2imageRenderer:
+  """Un proceso de poppler por página: solo una página rasterizada en memoria."""
+
+  def __init__(self, file_path: Path, target, dpi: int):
+    self.file_path, self.target, self.dpi = str(file_path), target, dpi
+
+  def page_count(self) -> int:
+    from pdf2image import pdfinfo_from_path
+
+    return int(pdfinfo_from_path(self.file_path).get('Pages', 1))
+
+  def render(self, number: int) -> Image.Image:
+    from pdf2image import convert_from_path
+
+    if self.target is None:
+      pages = convert_from_path(self.file_path, dpi=self.dpi, first_page=number, last_page=number)
+    else:
+      # Sin el tamaño de cada página a mano se fija la altura; si la página es más
+      # ancha que el destino (apaisada) se reduce al ancho, como _fit_zoom en PyMuPDF
+      pages = convert_from_path(self.file_path, size=(None, self.target[1]), first_page=number, last_page=number)
+      page = pages[0]
+      if page.width > self.target[0]:
+        height = max(1, round(page.height * self.target[0] / page.width))
+        return page.resize((self.target[0], height), Image.LANCZOS)
+    return pages[0]
+
+  def close(self):
+    pass
+
+
+def _cache_path(digest: str, target, dpi: int) -> Optional[Path]:
+  if _cache['dir'] is None:
+    return None
+  variant = f'{target[0]}x{target[1]}' if target else f'{dpi}dpi'
+  return _cache['dir'] / digest[:2] / digest / variant
+
+
+def _prune_cache():
+  """Borra las entradas (PDF + tamaño) menos usadas hasta quedar bajo max_mb."""
+  root = _cache['dir']
+  if root is None or not root.is_dir():
+    return
+  entries = []
+  total = 0
+  for variant in root.glob('*/*/*'):
+    if not variant.is_dir():
+      continue
+    size = sum(item.stat().st_size for item in variant.iterdir() if item.is_file())
+    entries.append((variant.stat().st_mtime, size, variant))
+    total += size
+  limit = _cache['max_mb'] * 1024 * 1024
+  for _, size, variant in sorted(entries):
+    if total <= limit:
+      break
+    shutil.rmtree(variant, ignore_errors=True)
+    total -= size
+
+
+def _write_atomic(path: Path, write):
+  """Escribe en un temporal y lo publica con os.replace: otro proceso nunca lee un archivo a medias."""
+  temporary = path.with_name(f'.{path.name}.{os.getpid()}.{time.monotonic_ns()}')
+  try:
+    write(temporary)
+    os.replace(temporary, path)
+  finally:
+    if temporary.exists():
+      temporary.unlink()
+
+
+def iter_pages(
+  file_path: Path,
+  target: Optional[Tuple[int, int]] = None,
+  first_page: int = 1,
+  last_page: Optional[int] = None,
+  dpi: int = 300,
+) -> Iterator[Tuple[int, Image.Image]]:
+  """
+  Genera (número de página, imagen RGB) de a una. Con target las páginas se
+  rasterizan para caber en (ancho, alto); sin target se usa dpi. Las imágenes
+  sueltas (PNG/JPG) producen una sola página. Las páginas ya rasterizadas se
+  leen de la cache; el PDF solo se abre si falta alguna.
+  """
+  if file_path.suffix.lower() != '.pdf':
+    with Image.open(str(file_path)) as image:
+      yield 1, image.convert('RGB')
+    return
+
+  folder = _cache_path(file_hash(file_path), target, dpi)
+  count = None
+  if folder is not None:
+    folder.mkdir(parents=True, exist_ok=True)
+    os.utime(folder)  # uso reciente para el LRU
+    if (folder / 'pages').is_file():
+      count = int((folder / 'pages').read_text().strip())
+
+  renderer = None
+  written = False
+  number = first_page
+  try:
+    while last_page is None or number <= last_page:
+      if count is not None and number > count:
+        break
+      cached = folder / f'page-{number:04d}.png' if folder is not None else None
+      if cached is not None and cached.is_file():
+        with Image.open(cached) as image:
+          yield number, image.convert('RGB')
+        number += 1
+        continue
+
+      if renderer is None:
+        renderer = (_PymupdfRenderer if fitz is not None else _Pdf2imageRenderer)(file_path, target, dpi)
+        if count is None:
+          count = renderer.page_count()
+          if folder is not None:
+            _write_atomic(folder / 'pages', lambda path: path.write_text(str(count)))
+          continue  # volver a comprobar el rango con el total conocido
+      image = renderer.render(number)
+      if cached is not None:
+        _write_atomic(cached, lambda path: image.save(path, format='PNG', compress_level=1))
+        written = True
+      yield number, image
+      number += 1
+  finally:
+    if renderer is not None:
+      renderer.close()
+    if written:
+      _prune_cache()
+
+
+def first_page_image(file_path: Path, target: Optional[Tuple[int, int]] = None, dpi: int = 300) -> Image.Image:
+  for _, image in iter_pages(file_path, target, last_page=1, dpi=dpi):
+    return image
+  raise ValueError(f'PDF sin páginas: {file_path}')
+
+
+if __name__ == '__main__':
+  # Diagnóstico: python donut_pages.py archivo.pdf [ancho alto]
+  source = Path(sys.argv[1])
+  size = (int(sys.argv[2]), int(sys.argv[3])) if len(sys.argv) > 3 else None
+  started = time.perf_counter()
+  for page_number, page_image in iter_pages(source, size):
+    print(f'page {page_number}: {page_image.size} ({(time.perf_counter() - started) * 1000:.1f} ms)')
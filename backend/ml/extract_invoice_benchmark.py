@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark del extractor heurístico de extract_invoice_fields.py.
+
+Compara la extracción de una sola pasada (extract_fields_from_text) contra la
+forma anterior (search_first por campo, cada patrón sobre todo el texto) en
+facturas sintéticas de varias páginas, verifica que ambos devuelvan los mismos
+campos y reporta documentos/s y MB/s.
+
+Uso:
+  python extract_invoice_benchmark.py
+  python extract_invoice_benchmark.py --docs 200 --lines 3000
+"""
+
+import argparse
+import json
+import random
+import time
+
+from extract_invoice_fields import FIELD_PATTERNS, extract_fields_from_text, search_first
+
+WORDS = [
+  "producto", "servicio", "unidad", "cantidad", "precio", "descuento", "kg", "caja",
+  "valor", "unitario", "codigo", "almacen", "lote", "item", "detalle", "descripcion",
+]
+
+
+def legacy_extract(text: str):
+  normalized = (text or "").replace("\u00a0", " ")
+  return {
+    field: search_first(normalized, [pattern for pattern, _ in patterns])
+    for field, patterns in FIELD_PATTERNS
+  }
+
+
+def synthetic_invoice(rng: random.Random, lines: int) -> str:
+  """Cabecera, muchas líneas de detalle y totales al final (el peor caso para varios escaneos)."""
+  header = [
+    "FACTURA ELECTRONICA",
+    f"RUC: 20{rng.randint(100000000, 999999999)}",
+    f"Serie: F{rng.randint(1, 999):03d} - {rng.randint(1, 99999999):08d}",
+    "Fecha de emision: 12/03/2024",
+  ]
+  if rng.random() < 0.3:
+    header = header[:1]  # Cabecera incompleta: los patrones recorren todo el texto sin éxito
+  body = []
+  for number in range(lines):
+    words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8)))
+    body.append(f"{number + 1:04d} {words} {rng.randint(1, 99)} x {rng.uniform(1, 500):.2f}")
+  footer = []
+  if rng.random() < 0.7:
+    subtotal = rng.uniform(100, 10000)
+    footer = [
+      f"Subtotal: S/ {subtotal:,.2f}",
+      f"IGV (18%): S/ {subtotal * 0.18:,.2f}",
+      f"Importe Total: S/ {subtotal * 1.18:,.2f}",
+    ]
+  return "\n".join(header + body + footer)
+
+
+def timed(extract, texts):
+  started = time.perf_counter()
+  results = [extract(text) for text in texts]
+  return results, time.perf_counter() - started
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark del extractor de campos de facturas")
+  parser.add_argument("--docs", type=int, default=100)
+  parser.add_argument("--lines", type=int, default=2000, help="Líneas de detalle por factura")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  texts = [synthetic_invoice(rng, rng.randint(args.lines // 2, args.lines)) for _ in range(args.docs)]
+  megabytes = sum(len(text.encode("utf-8")) for text in texts) / (1024 * 1024)
+
+  legacy_results, legacy_seconds = timed(legacy_extract, texts)
+  results, seconds = timed(extract_fields_from_text, texts)
+  mismatches = sum(1 for a, b in zip(legacy_results, results) if a != b)
+
+  report = {
+    "docs": len(texts),
+    "megabytes": round(megabytes, 2),
+    "mismatches": mismatches,
+    "legacy": {
+      "seconds": round(legacy_seconds, 3),
+      "docsPerSec": round(len(texts) / legacy_seconds, 1),
+      "mbPerSec": round(megabytes / legacy_seconds, 2),
+    },
+    "singlePass": {
+      "seconds": round(seconds, 3),
+      "docsPerSec": round(len(texts) / seconds, 1),
+      "mbPerSec": round(megabytes / seconds, 2),
+    },
+    "speedup": round(legacy_seconds / seconds, 2) if seconds else None,
+  }
+  print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+  main()
@@ -9,65 +9,178 @@ Lee un payload JSON desde stdin con formato:
   "sanitized": bool,
   "originalHash": "..."
 }
+
+Modos adicionales (un payload por línea, con "id" opcional que se devuelve):
+  --server        proceso residente: una respuesta {"id", "result"} por línea de stdin.
+  --batch PATH|-  re-extracción en bloque de un JSONL histórico; reporta docs/s en stderr.
+
+Los campos extraídos se guardan en la cache compartida de resultados
+(result_cache.py) por hash del texto + versión del heurístico: un payload
+re-enviado sin cambios no se vuelve a extraer. --no-cache la desactiva.
 """
 
+import argparse
+import hashlib
 import json
 import re
 import sys
-from typing import Dict, List, Optional
+import time
+from typing import Dict, List, Optional, Tuple
 
+from result_cache import ResultCache, default_cache, text_hash
 
-def search_first(text: str, patterns: List[str]):
-  for pattern in patterns:
-    match = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE)
-    if match:
-      return match.group(1).strip()
-  return None
 
+FLAGS = re.IGNORECASE | re.MULTILINE
 
-def extract_fields_from_text(text: str) -> Dict[str, Optional[str]]:
-  normalized = (text or "").replace("\u00a0", " ")
-  fields: Dict[str, Optional[str]] = {}
-  fields["serie"] = search_first(
-    normalized,
+# Campos en orden de salida; por campo, patrones en orden de prioridad junto con
+# las palabras clave con las que puede empezar cada coincidencia.
+FIELD_PATTERNS: List[Tuple[str, List[Tuple[str, Tuple[str, ...]]]]] = [
+  (
+    "serie",
     [
-      r"serie\s*[:\-]?\s*([A-Z0-9]{1,6})",
-      r"(?:serie\s+y\s+número|serie\s*/\s*número)\s*[:\-]?\s*([A-Z0-9-]+)",
+      (r"serie\s*[:\-]?\s*([A-Z0-9]{1,6})", ("serie",)),
+      (r"(?:serie\s+y\s+número|serie\s*/\s*número)\s*[:\-]?\s*([A-Z0-9-]+)", ("serie",)),
     ],
-  )
-  fields["nroCorrelativo"] = search_first(
-    normalized,
+  ),
+  (
+    "nroCorrelativo",
     [
-      r"(?:correlativo|nro\.?|nº)\s*[:\-]?\s*([0-9]{3,})",
-      r"serie\s*[A-Z0-9-]+\s*[-\s]+([0-9]{3,})",
+      (r"(?:correlativo|nro\.?|nº)\s*[:\-]?\s*([0-9]{3,})", ("correlativo", "nro", "nº")),
+      (r"serie\s*[A-Z0-9-]+\s*[-\s]+([0-9]{3,})", ("serie",)),
     ],
-  )
-  fields["rucEmisor"] = search_first(
-    normalized,
+  ),
+  (
+    "rucEmisor",
     [
-      r"ruc\s*[:\-]?\s*([0-9*]{8,15})",
-      r"emisor\s+([0-9*]{8,15})",
+      (r"ruc\s*[:\-]?\s*([0-9*]{8,15})", ("ruc",)),
+      (r"emisor\s+([0-9*]{8,15})", ("emisor",)),
     ],
-  )
-  fields["total"] = search_first(
-    normalized,
+  ),
+  (
+    "total",
     [
-      r"(?:importe\s+total|total\s+a\s+pagar|total)\s*[:\-]?\s*(?:s\/|s\$|\$)?\s*([0-9.,]+)",
-      r"total\s*([0-9.,]+)",
+      (
+        r"(?:importe\s+total|total\s+a\s+pagar|total)\s*[:\-]?\s*(?:s\/|s\$|\$)?\s*([0-9.,]+)",
+        ("importe", "total"),
+      ),
+      (r"total\s*([0-9.,]+)", ("total",)),
     ],
-  )
-  fields["subtotal"] = search_first(
-    normalized,
+  ),
+  (
+    "subtotal",
     [
-      r"(?:subtotal|valor\s+venta)\s*[:\-]?\s*(?:s\/|s\$|\$)?\s*([0-9.,]+)",
+      (r"(?:subtotal|valor\s+venta)\s*[:\-]?\s*(?:s\/|s\$|\$)?\s*([0-9.,]+)", ("subtotal", "valor")),
     ],
-  )
-  fields["igv"] = search_first(
-    normalized,
+  ),
+  (
+    "igv",
     [
-      r"(?:igv|iva)\s*(?:\(\d+%?\))?\s*[:\-]?\s*(?:s\/|s\$|\$)?\s*([0-9.,]+)",
+      (r"(?:igv|iva)\s*(?:\(\d+%?\))?\s*[:\-]?\s*(?:s\/|s\$|\$)?\s*([0-9.,]+)", ("igv", "iva")),
     ],
-  )
+  ),
+]
+
+# Compilado una sola vez al importar
+COMPILED_FIELDS = [
+  (field, [(re.compile(pattern, FLAGS), keywords) for pattern, keywords in patterns])
+  for field, patterns in FIELD_PATTERNS
+]
+KEYWORDS = sorted({keyword for _, patterns in FIELD_PATTERNS for _, keywords in patterns for keyword in keywords})
+# Lookahead de ancho cero: encuentra TODAS las posiciones donde empieza una palabra
+# clave (incluido "total" dentro de "subtotal"); un grupo por palabra clave.
+# Solo se usa cuando el texto tiene caracteres que impiden buscar sobre text.lower().
+KEYWORD_SCAN = re.compile(
+  "(?=(?:" + "|".join(f"({re.escape(keyword)})" for keyword in KEYWORDS) + "))",
+  FLAGS,
+)
+
+
+def search_first(text: str, patterns: List[str]):
+  for pattern in patterns:
+    match = re.search(pattern, text, flags=FLAGS)
+    if match:
+      return match.group(1).strip()
+  return None
+
+
+def keyword_positions(text: str) -> Dict[str, List[int]]:
+  """Posiciones (ascendentes) de cada palabra clave, sin distinguir mayúsculas."""
+  lowered = text.lower()
+  if len(lowered) != len(text) or "ı" in text or "ſ" in text:
+    # lower() cambia offsets (p. ej. "İ") o IGNORECASE iguala "ı"/"ſ" a "i"/"s":
+    # se usa el escaneo con regex, exacto pero más lento.
+    positions: Dict[str, List[int]] = {keyword: [] for keyword in KEYWORDS}
+    for match in KEYWORD_SCAN.finditer(text):
+      positions[KEYWORDS[match.lastindex - 1]].append(match.start())
+    return positions
+
+  positions = {}
+  for keyword in KEYWORDS:
+    found = []
+    position = lowered.find(keyword)
+    while position != -1:
+      found.append(position)
+      position = lowered.find(keyword, position + 1)
+    positions[keyword] = found
+  return positions
+
+
+def first_match(pattern, candidates: List[int], text: str):
+  for position in candidates:
+    match = pattern.match(text, position)
+    if match:
+      return match.group(1).strip()
+  return None
+
+
+def extract_fields_from_text(text: str) -> Dict[str, Optional[str]]:
+  """
+  Mismo resultado que aplicar search_first a cada campo, pero sin recorrer el
+  texto con cada patrón: toda coincidencia empieza en una palabra clave, así que
+  primero se indexan las posiciones de las palabras clave y cada patrón solo se
+  prueba (anclado) en las de las suyas, en orden; la primera que coincide es la
+  misma que devolvería re.search.
+  """
+  normalized = (text or "").replace("\u00a0", " ")
+  positions = keyword_positions(normalized)
+  fields: Dict[str, Optional[str]] = {}
+  for field, patterns in COMPILED_FIELDS:
+    value = None
+    for pattern, keywords in patterns:
+      if len(keywords) == 1:
+        candidates = positions[keywords[0]]
+      else:
+        candidates = sorted(position for keyword in keywords for position in positions[keyword])
+      value = first_match(pattern, candidates, normalized)
+      if value is not None:
+        break
+    fields[field] = value
+  return fields
+
+
+HEURISTIC_VERSION = "heuristic-v1"
+# Cambiar cualquier patrón invalida las entradas de cache sin tocar HEURISTIC_VERSION
+CACHE_VERSION = "{}:{}".format(
+  HEURISTIC_VERSION,
+  hashlib.sha1(repr(FIELD_PATTERNS).encode("utf-8")).hexdigest()[:12],
+)
+
+_result_cache: Dict[str, Optional[ResultCache]] = {"cache": None}
+
+
+def set_result_cache(cache: Optional[ResultCache]):
+  _result_cache["cache"] = cache
+
+
+def extract_fields_cached(text: str) -> Dict[str, Optional[str]]:
+  cache = _result_cache["cache"]
+  if cache is None:
+    return extract_fields_from_text(text)
+  key = cache.key(text_hash(text), CACHE_VERSION)
+  fields = cache.get(key)
+  if fields is None:
+    fields = extract_fields_from_text(text)
+    cache.put(key, fields)
   return fields
 
 
@@ -80,7 +193,7 @@ def build_response(payload: Dict[str, any], fields: Dict[str, Optional[str]]):
   return {
     "status": status,
     "provider": "python-ml-fallback",
-    "modelVersion": "heuristic-v1",
+    "modelVersion": HEURISTIC_VERSION,
     "confidence": confidence,
     "fields": fields,
     "debug": {
@@ -92,14 +205,111 @@ def build_response(payload: Dict[str, any], fields: Dict[str, Optional[str]]):
   }
 
 
+def extract_payload(payload: Dict[str, any]):
+  if not isinstance(payload, dict):
+    raise ValueError("el payload debe ser un objeto JSON")
+  fields = extract_fields_cached(payload.get("text") or "")
+  return build_response(payload, fields)
+
+
+def process_line(line: str) -> Dict[str, any]:
+  """Procesa una línea JSON (payload + "id" opcional) y arma la respuesta con el id."""
+  request_id = None
+  try:
+    payload = json.loads(line)
+    if isinstance(payload, dict):
+      request_id = payload.get("id")
+    return {"id": request_id, "result": extract_payload(payload)}
+  except json.JSONDecodeError as exc:
+    return {"id": request_id, "error": f"JSON parse error: {exc}"}
+  except Exception as exc:
+    return {"id": request_id, "error": str(exc)}
+
+
+def server_mode():
+  """
+  Modo servidor: un payload JSON por línea en stdin (el mismo que el modo
+  normal, con "id" opcional) y una línea por respuesta en stdout:
+  {"id": "...", "result": {...}}  o  {"id": "...", "error": "..."}
+  Termina con EOF.
+  """
+  print(json.dumps({"status": "ready"}), flush=True)
+  for line in sys.stdin:
+    line = line.strip()
+    if not line:
+      continue
+    print(json.dumps(process_line(line), ensure_ascii=False), flush=True)
+
+
+def batch_mode(source: str):
+  """
+  Re-extrae un histórico en bloque: lee payloads JSON por línea desde un
+  archivo o stdin ('-') y escribe un resultado por línea, en el mismo orden.
+  """
+  stream = sys.stdin if source == "-" else open(source, "r", encoding="utf-8")
+  total = 0
+  failed = 0
+  start = time.perf_counter()
+  write = sys.stdout.write
+  try:
+    for line in stream:
+      line = line.strip()
+      if not line:
+        continue
+      response = process_line(line)
+      total += 1
+      if "error" in response:
+        failed += 1
+      write(json.dumps(response, ensure_ascii=False) + "\n")
+  finally:
+    if stream is not sys.stdin:
+      stream.close()
+    sys.stdout.flush()
+
+  elapsed = time.perf_counter() - start
+  rate = total / elapsed if elapsed > 0 else 0.0
+  cache = _result_cache["cache"]
+  cached = f", {cache.hits} desde cache" if cache is not None else ""
+  print(
+    f"{total} documentos extraídos ({failed} con error{cached}) en {elapsed:.2f}s ({rate:.1f} docs/s)",
+    file=sys.stderr,
+  )
+
+
 def main():
+  parser = argparse.ArgumentParser(description="Extracción heurística de campos de facturas")
+  parser.add_argument(
+    "--server",
+    action="store_true",
+    help="Modo residente: un payload JSON por línea en stdin, una respuesta por línea.",
+  )
+  parser.add_argument(
+    "--batch",
+    metavar="PATH",
+    help="Archivo JSONL de payloads a re-extraer en bloque ('-' para stdin).",
+  )
+  parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="No leer ni escribir la cache de resultados (ML_RESULT_CACHE_DIR).",
+  )
+  args = parser.parse_args()
+  set_result_cache(default_cache(enabled=not args.no_cache))
+
+  if args.server:
+    server_mode()
+    return
+  if args.batch:
+    batch_mode(args.batch)
+    return
+
   try:
     payload = json.load(sys.stdin)
   except json.JSONDecodeError:
     print(json.dumps({"status": "FAILED", "error": "invalid json"}))
     sys.exit(1)
 
-  fields = extract_fields_from_text(payload.get("text") or "")
+  fields = extract_fields_cached(payload.get("text") or "")
   result = build_response(payload, fields)
   print(json.dumps(result, ensure_ascii=False))
 
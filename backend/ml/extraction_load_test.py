@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga del servicio HTTP de extracción (mock_ml_service.py).
+
+Reproduce un corpus de facturas (sintéticas de tamaño variable, o un JSONL con
+payloads) contra POST /extract con N clientes concurrentes y reporta
+peticiones/s, latencias p50/p95/p99 y tasa de error. Como las latencias solo
+cubren peticiones completadas, también reporta las peticiones de cada cliente
+y el tiempo hasta su primera respuesta: un cliente que no consigue servicio
+(p. ej. conexiones keep-alive que acaparan los hilos) aparece ahí. Por defecto
+hay el doble de clientes que --service-workers, para que sobre-suscribir el
+servicio sea el caso probado. Sin --url levanta mock_ml_service.py en un
+puerto libre de localhost y lo detiene al terminar.
+
+Uso:
+  python extraction_load_test.py --concurrency 32 --requests 5000
+  python extraction_load_test.py --url http://127.0.0.1:5055 --duration 30 --no-keep-alive
+  python extraction_load_test.py --corpus samples.jsonl --output load-report.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from extract_invoice_benchmark import synthetic_invoice
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_corpus(size: int, min_lines: int, max_lines: int, seed: int) -> List[bytes]:
+  """Cuerpos JSON ya serializados: el cliente no gasta CPU en json.dumps durante la carga."""
+  rng = random.Random(seed)
+  bodies = []
+  for number in range(size):
+    text = synthetic_invoice(rng, rng.randint(min_lines, max_lines))
+    payload = {"text": text, "metadata": {"sample": number}, "sanitized": True}
+    bodies.append(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+  return bodies
+
+
+def load_corpus(path: str) -> List[bytes]:
+  bodies = []
+  with open(path, "r", encoding="utf-8") as fh:
+    for line in fh:
+      line = line.strip()
+      if line:
+        bodies.append(line.encode("utf-8"))
+  return bodies
+
+
+def free_port() -> int:
+  with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+def start_service(port: int, workers: int) -> subprocess.Popen:
+  proc = subprocess.Popen(
+    [
+      sys.executable, os.path.join(SCRIPT_DIR, "mock_ml_service.py"),
+      "--port", str(port),
+      "--workers", str(workers),
+    ],
+    cwd=SCRIPT_DIR,
+    stdout=subprocess.PIPE,
+    stderr=subprocess.DEVNULL,
+    text=True,
+  )
+  proc.stdout.readline()  # "Mock ML service listening on ..."
+  return proc
+
+
+class Client(threading.Thread):
+  """Un cliente: envía peticiones en serie, reutilizando la conexión si keep_alive."""
+
+  def __init__(self, host, port, path, bodies, keep_alive, started, deadline, budget, lock):
+    super().__init__(daemon=True)
+    self.started = started
+    self.host, self.port, self.path = host, port, path
+    self.bodies = bodies
+    self.keep_alive = keep_alive
+    self.deadline = deadline
+    self.budget = budget
+    self.lock = lock
+    self.latencies: List[float] = []
+    self.errors = 0
+    self.status = {}
+    self.first_response_ms: Optional[float] = None
+
+  def take(self) -> bool:
+    if self.deadline is not None:
+      return time.perf_counter() < self.deadline
+    with self.lock:
+      if self.budget[0] <= 0:
+        return False
+      self.budget[0] -= 1
+      return True
+
+  def run(self):
+    rng = random.Random(id(self))
+    connection: Optional[http.client.HTTPConnection] = None
+    headers = {"Content-Type": "application/json"}
+    if not self.keep_alive:
+      headers["Connection"] = "close"
+    while self.take():
+      body = self.bodies[rng.randrange(len(self.bodies))]
+      started = time.perf_counter()
+      try:
+        if connection is None:
+          connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        connection.request("POST", self.path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+        if not self.keep_alive or response.getheader("Connection", "").lower() == "close":
+          connection.close()
+          connection = None
+      except (OSError, http.client.HTTPException):
+        status = "connection-error"
+        if connection is not None:
+          connection.close()
+        connection = None
+      finished = time.perf_counter()
+      self.latencies.append((finished - started) * 1000)
+      if self.first_response_ms is None and status == 200:
+        self.first_response_ms = (finished - self.started) * 1000
+      self.status[str(status)] = self.status.get(str(status), 0) + 1
+      if status != 200:
+        self.errors += 1
+    if connection is not None:
+      connection.close()
+
+
+def percentile(ordered: List[float], quantile: float) -> Optional[float]:
+  if not ordered:
+    return None
+  return round(ordered[min(len(ordered) - 1, int(quantile * len(ordered)))], 2)
+
+
+def run_load(url: str, bodies: List[bytes], concurrency: int, requests: int, duration: float, keep_alive: bool):
+  parsed = urlparse(url)
+  path = parsed.path.rstrip("/") or ""
+  path = f"{path}/extract" if not path.endswith("/extract") else path
+  lock = threading.Lock()
+  budget = [requests]
+  started = time.perf_counter()
+  deadline = started + duration if duration else None
+  clients = [
+    Client(parsed.hostname, parsed.port or 80, path, bodies, keep_alive, started, deadline, budget, lock)
+    for _ in range(max(concurrency, 1))
+  ]
+  for client in clients:
+    client.start()
+  for client in clients:
+    client.join()
+  elapsed = time.perf_counter() - started
+
+  latencies = sorted(latency for client in clients for latency in client.latencies)
+  errors = sum(client.errors for client in clients)
+  status = {}
+  for client in clients:
+    for code, count in client.status.items():
+      status[code] = status.get(code, 0) + count
+  total = len(latencies)
+  per_client = sorted(len(client.latencies) for client in clients)
+  first_responses = sorted(client.first_response_ms for client in clients if client.first_response_ms is not None)
+  return {
+    "url": url,
+    "concurrency": len(clients),
+    "keepAlive": keep_alive,
+    "corpus": len(bodies),
+    "avgBodyKb": round(sum(len(body) for body in bodies) / len(bodies) / 1024, 1),
+    "requests": total,
+    "seconds": round(elapsed, 2),
+    "requestsPerSec": round(total / elapsed, 1) if elapsed > 0 else None,
+    "latencyMs": {
+      "p50": percentile(latencies, 0.50),
+      "p95": percentile(latencies, 0.95),
+      "p99": percentile(latencies, 0.99),
+      "max": round(latencies[-1], 2) if latencies else None,
+    },
+    "errors": errors,
+    "errorRate": round(errors / total, 4) if total else 0.0,
+    "status": status,
+    "clients": {
+      "requestsMin": per_client[0],
+      "requestsMax": per_client[-1],
+      "requests": [len(client.latencies) for client in clients],
+      "withoutResponse": len(clients) - len(first_responses),
+      "timeToFirstResponseMs": {
+        "p50": percentile(first_responses, 0.50),
+        "max": round(first_responses[-1], 2) if first_responses else None,
+      },
+    },
+  }
+
+
+def fetch_metrics(url: str) -> Optional[dict]:
+  parsed = urlparse(url)
+  try:
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=5)
+    connection.request("GET", "/metrics")
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return json.loads(body) if response.status == 200 else None
+  except (OSError, ValueError, http.client.HTTPException):
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Prueba de carga de POST /extract")
+  parser.add_argument("--url", default=None, help="Servicio a probar (por defecto levanta mock_ml_service.py local)")
+  parser.add_argument(
+    "--service-workers",
+    type=int,
+    default=8,
+    help="--workers del servicio local (con --url, los del servicio probado)",
+  )
+  parser.add_argument(
+    "--concurrency",
+    type=int,
+    default=None,
+    help="Clientes concurrentes (por defecto 2 x --service-workers)",
+  )
+  parser.add_argument("--requests", type=int, default=2000, help="Total de peticiones (si no se usa --duration)")
+  parser.add_argument("--duration", type=float, default=0.0, help="Segundos de carga (en lugar de --requests)")
+  parser.add_argument("--no-keep-alive", action="store_true", help="Abrir una conexión por petición")
+  parser.add_argument("--corpus", default=None, help="JSONL de payloads a reproducir (por defecto sintético)")
+  parser.add_argument("--corpus-size", type=int, default=200)
+  parser.add_argument("--min-lines", type=int, default=10, help="Líneas de detalle mínimas por factura sintética")
+  parser.add_argument("--max-lines", type=int, default=400, help="Líneas de detalle máximas por factura sintética")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", default=None, help="Guardar el reporte JSON (seguimiento de regresiones)")
+  args = parser.parse_args()
+
+  if args.corpus:
+    bodies = load_corpus(args.corpus)
+  else:
+    bodies = build_corpus(args.corpus_size, args.min_lines, args.max_lines, args.seed)
+  if not bodies:
+    print("El corpus está vacío", file=sys.stderr)
+    sys.exit(1)
+
+  service = None
+  url = args.url
+  if url is None:
+    port = free_port()
+    service = start_service(port, args.service_workers)
+    url = f"http://127.0.0.1:{port}"
+  try:
+    concurrency = args.concurrency or 2 * max(args.service_workers, 1)
+    report = run_load(url, bodies, concurrency, args.requests, args.duration, not args.no_keep_alive)
+    report["serviceMetrics"] = fetch_metrics(url)
+  finally:
+    if service is not None:
+      service.terminate()
+      service.wait(timeout=10)
+
+  output = json.dumps(report, indent=2)
+  print(output)
+  if args.output:
+    with open(args.output, "w", encoding="utf-8") as fh:
+      fh.write(output + "\n")
+
+
+if __name__ == "__main__":
+  main()
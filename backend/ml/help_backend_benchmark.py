@@ -0,0 +1,139 @@
+"""
+Benchmark de los backends de inferencia de help_embeddings.py (torch, torch-int8, onnx).
+
+Cada backend corre en un proceso nuevo para medir arranque y memoria de forma
+aislada:
+  - loadSeconds: imports + carga del modelo
+  - rssMb: memoria residente maxima tras codificar la KB (None en Windows)
+  - queryQps: consultas individuales por segundo (como encode-query en el servidor)
+  - batchTextsPerSec: textos por segundo codificando la KB en lotes de 64
+Y se compara cada backend contra torch fp32 sobre help-kb-static.json:
+  - cosine: similitud coseno entre los vectores de la misma entrada (media/min/p5)
+  - top1/top5: coincidencia de los vecinos mas cercanos para las preguntas de la KB
+
+Uso:
+  python help_backend_benchmark.py
+  python help_backend_benchmark.py --backends torch,onnx --queries 100
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_worker(backend: str, kb_path: str, queries: int, output: str):
+    """Se ejecuta en el proceso hijo: carga el backend, codifica y mide."""
+    started = time.perf_counter()
+    import numpy as np
+    import help_embeddings
+    from help_kb_index import entry_text
+
+    help_embeddings.set_backend(backend)
+    model = help_embeddings.get_model()
+    load_seconds = time.perf_counter() - started
+
+    with open(kb_path, 'r', encoding='utf-8') as fh:
+        entries = json.load(fh)
+    texts = [entry_text(entry) for entry in entries]
+    questions = [entry.get('question') or '' for entry in entries][:queries]
+
+    model.encode(questions[:4], show_progress_bar=False, normalize_embeddings=True)  # warmup
+
+    started = time.perf_counter()
+    query_vectors = np.stack([
+        model.encode([question], show_progress_bar=False, normalize_embeddings=True)[0]
+        for question in questions
+    ])
+    query_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    kb_vectors = model.encode(texts, batch_size=64, show_progress_bar=False, normalize_embeddings=True)
+    batch_seconds = time.perf_counter() - started
+
+    np.savez(output, kb=np.asarray(kb_vectors, dtype=np.float32), queries=query_vectors.astype(np.float32))
+    print(json.dumps({
+        'backend': backend,
+        'loadSeconds': round(load_seconds, 2),
+        # Pico de RSS (getrusage); None donde no existe el modulo resource (Windows)
+        'rssMb': help_embeddings.memory_mb().get('peakRssMb'),
+        'queryQps': round(len(questions) / query_seconds, 1) if query_seconds > 0 else None,
+        'batchTextsPerSec': round(len(texts) / batch_seconds, 1) if batch_seconds > 0 else None,
+    }))
+
+
+def agreement(reference: dict, candidate: dict) -> dict:
+    import numpy as np
+
+    cosines = np.sum(reference['kb'] * candidate['kb'], axis=1)
+    ref_top = np.argsort(-(reference['queries'] @ reference['kb'].T), axis=1)[:, :5]
+    cand_top = np.argsort(-(candidate['queries'] @ candidate['kb'].T), axis=1)[:, :5]
+    overlap = [len(np.intersect1d(r, c)) / 5 for r, c in zip(ref_top, cand_top)]
+    return {
+        'cosine': {
+            'mean': round(float(cosines.mean()), 5),
+            'min': round(float(cosines.min()), 5),
+            'p5': round(float(np.percentile(cosines, 5)), 5),
+        },
+        'top1': round(float(np.mean(ref_top[:, 0] == cand_top[:, 0])), 4),
+        'top5': round(float(np.mean(overlap)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de backends de help_embeddings.py')
+    parser.add_argument('--backends', default='torch,torch-int8,onnx', help='Backends separados por coma')
+    parser.add_argument('--kb', default=os.path.join(SCRIPT_DIR, 'help-kb-static.json'))
+    parser.add_argument('--queries', type=int, default=200, help='Preguntas codificadas una a una')
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--output', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.kb, args.queries, args.output)
+        return
+
+    import numpy as np
+
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    report = {'kb': args.kb, 'backends': []}
+    vectors = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in backends:
+            output = os.path.join(tmp_dir, f'{backend}.npz')
+            print(f'Backend {backend}...', file=sys.stderr)
+            proc = subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__),
+                    '--worker', backend,
+                    '--kb', args.kb,
+                    '--queries', str(args.queries),
+                    '--output', output,
+                ],
+                cwd=SCRIPT_DIR,
+                capture_output=True,
+                text=True,
+            )
+            if proc.returncode != 0:
+                error = (proc.stderr.strip().splitlines() or ['unknown error'])[-1]
+                report['backends'].append({'backend': backend, 'error': error})
+                continue
+            report['backends'].append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            with np.load(output) as data:
+                vectors[backend] = {'kb': data['kb'], 'queries': data['queries']}
+
+    reference = vectors.get('torch')
+    for result in report['backends']:
+        backend = result['backend']
+        if reference is not None and backend in vectors and backend != 'torch':
+            result['vsTorch'] = agreement(reference, vectors[backend])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
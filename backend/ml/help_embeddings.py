@@ -6,27 +6,164 @@ Modos de uso:
   encode-batch  — Lee un JSON array de textos por stdin, devuelve array de embeddings.
   encode-query  — Recibe un texto como argumento, devuelve un embedding.
   server        — Modo servidor persistente (lee comandos de stdin, escribe resultados a stdout)
+  build-index   — Codifica (incrementalmente) help-kb-static.json en el indice compacto (ver help_kb_index.py)
+  export-model  — Guarda el modelo en un directorio local (safetensors + tokenizer.json) para arrancar offline
+
+Formato de embeddings (--format en modos one-shot, params.format en server):
+  json  — listas de floats (por defecto).
+  f32 / f16 — {"encoding": "base64", "dtype", "shape", "data"} con los bytes
+              little-endian de la matriz NumPy (sin pasar por texto decimal).
 
 Modelo: paraphrase-multilingual-MiniLM-L12-v2 (384 dims, multilingue)
+
+Backend de inferencia (--backend o HELP_EMBEDDINGS_BACKEND):
+  torch       — SentenceTransformer en PyTorch fp32 (por defecto).
+  torch-int8  — mismos pesos con las capas Linear cuantizadas a int8 (torch.quantization.quantize_dynamic).
+  onnx        — ONNX Runtime (requiere sentence-transformers>=3.2 con optimum[onnxruntime]).
+Ver help_backend_benchmark.py para comparar precision, arranque, RSS y throughput.
+
+Arranque rapido: si existe el directorio local del modelo (export-model; por
+defecto ml/models/help-embeddings/<modelo>, o --model-dir / HELP_EMBEDDINGS_MODEL_DIR)
+se carga desde ahi en modo offline, sin consultar el hub de Hugging Face. Los
+pesos en safetensors se mapean en memoria y el tokenizer.json evita reconstruir
+el vocabulario. Cada modo one-shot escribe sus tiempos de arranque en stderr.
 """
 
 import argparse
+import base64
 import json
+import os
+import queue
 import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+_process_started = time.perf_counter()
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+EMBEDDING_FORMATS = ('json', 'f32', 'f16')
+BACKENDS = ('torch', 'torch-int8', 'onnx')
+DEFAULT_MODEL_DIR = os.path.join(SCRIPT_DIR, 'models', 'help-embeddings', MODEL_NAME)
 
 # Lazy imports para que el script falle rapido si se invoca sin dependencias
 _model = None
+_backend = os.environ.get('HELP_EMBEDDINGS_BACKEND', 'torch')
+_model_dir = os.environ.get('HELP_EMBEDDINGS_MODEL_DIR', DEFAULT_MODEL_DIR)
+_timings = {}
+
+
+def set_backend(backend: str):
+    global _backend, _model
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}')
+    if backend != _backend:
+        _backend = backend
+        _model = None
+
+
+def model_id() -> str:
+    """Identidad de los vectores: los backends cuantizados no comparten cache/indice con fp32."""
+    return MODEL_NAME if _backend == 'torch' else f'{MODEL_NAME}@{_backend}'
+
+
+def set_model_dir(model_dir: str):
+    global _model_dir, _model
+    if model_dir != _model_dir:
+        _model_dir = model_dir
+        _model = None
+
+
+def model_source() -> str:
+    """Directorio local del modelo si fue exportado; si no, el nombre en el hub."""
+    if _model_dir and os.path.exists(os.path.join(_model_dir, 'modules.json')):
+        return _model_dir
+    return MODEL_NAME
+
+
+def load_model(backend: str):
+    source = model_source()
+    if source != MODEL_NAME:
+        # Sin peticiones HEAD al hub: todo sale del directorio local
+        os.environ.setdefault('HF_HUB_OFFLINE', '1')
+        os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+    started = time.perf_counter()
+    from sentence_transformers import SentenceTransformer
+    _timings['imports'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if backend == 'onnx':
+        model = SentenceTransformer(source, backend='onnx', device='cpu')
+    elif backend == 'torch-int8':
+        import torch
+
+        model = SentenceTransformer(source, device='cpu')
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        model = SentenceTransformer(source)
+    _timings['load'] = time.perf_counter() - started
+    _timings['source'] = 'local' if source != MODEL_NAME else 'hub'
+    return model
 
 
 def get_model():
     global _model
     if _model is None:
-        from sentence_transformers import SentenceTransformer
-        _model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+        _model = load_model(_backend)
     return _model
 
 
-def encode_batch():
+def report_timings(stage: str):
+    """Una linea de tiempos de arranque en stderr (stdout queda solo para el JSON)."""
+    parts = [f"{name}={_timings[name]:.3f}s" for name in ('imports', 'load', 'encode') if name in _timings]
+    parts.append(f'total={time.perf_counter() - _process_started:.3f}s')
+    print(
+        f"timings {stage}: {' '.join(parts)} (backend={_backend}, source={_timings.get('source', '-')})",
+        file=sys.stderr,
+    )
+
+
+def export_model(model_dir: str):
+    """Guarda el modelo (safetensors + tokenizer.json) en model_dir para cargarlo offline."""
+    from sentence_transformers import SentenceTransformer
+
+    started = time.perf_counter()
+    SentenceTransformer(MODEL_NAME).save(model_dir, safe_serialization=True)
+    if _backend == 'onnx':
+        # Exporta tambien onnx/model.onnx para no convertir en cada arranque
+        SentenceTransformer(MODEL_NAME, backend='onnx', device='cpu').save(model_dir)
+    print(f'Modelo exportado a {model_dir} en {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    print(json.dumps({'modelDir': model_dir, 'backend': _backend}), end='')
+
+
+def serialize_embeddings(embeddings, fmt: str = 'json'):
+    """
+    Serializa un vector (dim,) o matriz (n, dim) de embeddings. En f32/f16 los
+    bytes salen directo del buffer NumPy (sin copia si ya es float32 contiguo).
+    """
+    if fmt == 'json':
+        return embeddings.tolist()
+
+    import numpy as np
+
+    if fmt == 'f32':
+        dtype, name = '<f4', 'float32'
+    elif fmt == 'f16':
+        dtype, name = '<f2', 'float16'
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    array = np.ascontiguousarray(embeddings, dtype=dtype)
+    return {
+        'encoding': 'base64',
+        'dtype': name,
+        'shape': list(array.shape),
+        'data': base64.b64encode(memoryview(array).cast('B')).decode('ascii'),
+    }
+
+
+def encode_batch(fmt: str = 'json'):
     """Lee JSON array de textos por stdin, devuelve JSON array de embeddings."""
     raw = sys.stdin.read()
     if not raw.strip():
@@ -39,12 +176,14 @@ def encode_batch():
         return
 
     model = get_model()
+    started = time.perf_counter()
     embeddings = model.encode(texts, show_progress_bar=False, normalize_embeddings=True)
-    result = [emb.tolist() for emb in embeddings]
-    print(json.dumps(result), end='')
+    _timings['encode'] = time.perf_counter() - started
+    print(json.dumps(serialize_embeddings(embeddings, fmt)), end='')
+    report_timings('encode-batch')
 
 
-def encode_query(text: str):
+def encode_query(text: str, fmt: str = 'json'):
     """Codifica un texto individual y devuelve su embedding."""
     text = text.strip()
     if not text:
@@ -52,112 +191,1015 @@ def encode_query(text: str):
         return
 
     model = get_model()
+    started = time.perf_counter()
     embedding = model.encode([text], show_progress_bar=False, normalize_embeddings=True)
-    print(json.dumps(embedding[0].tolist()), end='')
+    _timings['encode'] = time.perf_counter() - started
+    print(json.dumps(serialize_embeddings(embedding[0], fmt)), end='')
+    report_timings('encode-query')
+
+
+class ResponseWriter:
+    """Escribe respuestas JSON por linea en stdout desde varios hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def send(self, payload: dict):
+        self.send_line(json.dumps(payload))
+
+    def send_line(self, line: str):
+        """Escribe una linea ya serializada (los workers del pool serializan encode-batch)."""
+        with self._lock:
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+
+
+class QueryCache:
+    """
+    LRU de embeddings de consultas, por texto normalizado + nombre de modelo.
+    La normalizacion solo colapsa espacios y es tambien el texto que se codifica;
+    no pasa a minusculas porque el modelo distingue mayusculas y "Hola" y "hola"
+    tienen vectores distintos. Se usa desde el hilo lector y el batcher, por eso todo
+    va bajo lock.
+    """
+
+    KEY_VERSION = 2  # v1 usaba minusculas: sus entradas guardadas se descartan al cargar
+
+    def __init__(self, capacity: int, model_name: str = None):
+        self.capacity = max(capacity, 0)
+        self.model_name = model_name or model_id()
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(text.split())
+
+    def _key(self, text: str) -> str:
+        return f'{self.model_name}\nv{self.KEY_VERSION}\n{self.normalize(text)}'
+
+    def get(self, text: str):
+        if self.capacity == 0:
+            return None
+        key = self._key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, text: str, vector):
+        if self.capacity == 0:
+            return
+        key = self._key(text)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def load(self, path: str) -> int:
+        """Carga un cache guardado con save(); ignora entradas de otro modelo o formato de clave."""
+        import numpy as np
+
+        if self.capacity == 0 or not os.path.exists(path):
+            return 0
+        with np.load(path, allow_pickle=False) as data:
+            keys = data['keys']
+            vectors = data['vectors']
+        prefix = f'{self.model_name}\nv{self.KEY_VERSION}\n'
+        with self._lock:
+            for key, vector in zip(keys[-self.capacity:], vectors[-self.capacity:]):
+                key = str(key)
+                if key.startswith(prefix):
+                    self._entries[key] = vector
+            return len(self._entries)
+
+    def save(self, path: str) -> int:
+        """Guarda las entradas (de menos a mas recientes) en un .npz de forma atomica."""
+        import numpy as np
+
+        with self._lock:
+            keys = list(self._entries.keys())
+            vectors = list(self._entries.values())
+        if not keys:
+            return 0
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as fh:
+            np.savez(
+                fh,
+                keys=np.array(keys),
+                vectors=np.stack(vectors).astype(np.float32),
+            )
+        os.replace(tmp_path, path)
+        return len(keys)
+
+
+class PendingRequest:
+    __slots__ = ('id', 'command', 'texts', 'format', 'params', 'received_at')
+
+    def __init__(self, request_id, command: str, texts: list, fmt: str = 'json', params: dict = None):
+        self.id = request_id
+        self.command = command
+        self.texts = texts
+        self.format = fmt
+        self.params = params or {}
+        self.received_at = time.perf_counter()
+
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+LATENCY_WINDOW = 1024  # Ultimas latencias para percentiles
+
 
+def _histogram_keys():
+    return [f'<={bound}' for bound in LATENCY_BUCKETS_MS] + [f'>{LATENCY_BUCKETS_MS[-1]}']
 
-def server_mode():
+
+def _bucket(ms: float) -> int:
+    for position, bound in enumerate(LATENCY_BUCKETS_MS):
+        if ms <= bound:
+            return position
+    return len(LATENCY_BUCKETS_MS)
+
+
+def queue_depth(requests) -> int:
+    if requests is None:
+        return 0
+    try:
+        return requests.qsize()
+    except NotImplementedError:  # multiprocessing.Queue en macOS
+        return -1
+
+
+def memory_mb() -> dict:
+    """RSS actual (Linux, /proc) y pico (getrusage) en MB; vacio si la plataforma no lo expone."""
+    result = {}
+    try:
+        with open('/proc/self/statm', 'r') as fh:
+            pages = int(fh.read().split()[1])
+        result['rssMb'] = round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss viene en KB en Linux y en bytes en macOS
+        result['peakRssMb'] = round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+    except ImportError:
+        pass
+    return result
+
+
+class ServerMetrics:
+    """Contadores acumulados del micro-batcher, histogramas de latencia y memoria."""
+
+    def __init__(self, log_batches: bool = False):
+        self.log_batches = log_batches
+        self.started_at = time.time()
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.max_batch_texts = 0
+        self.encode_ms_total = 0.0
+        self.rejected = 0
+        self.cache_served = 0
+        self.errors = 0
+        self._encode_histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._latency_histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._recent_latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def record_batch(self, requests: int, texts: int, wait_ms: float, encode_ms: float):
+        with self._lock:
+            self.requests += requests
+            self.batches += 1
+            self.texts += texts
+            self.max_batch_texts = max(self.max_batch_texts, texts)
+            self.encode_ms_total += encode_ms
+            self._encode_histogram[_bucket(encode_ms)] += 1
+        if self.log_batches:
+            print(
+                f'[batch] requests={requests} texts={texts} '
+                f'wait={wait_ms:.1f}ms encode={encode_ms:.1f}ms',
+                file=sys.stderr,
+                flush=True,
+            )
+
+    def record_response(self, received_at: float, error: bool = False):
+        """Latencia de punta a punta (lectura de la linea -> respuesta escrita)."""
+        latency_ms = (time.perf_counter() - received_at) * 1000
+        with self._lock:
+            self._latency_histogram[_bucket(latency_ms)] += 1
+            self._recent_latencies.append(latency_ms)
+            if error:
+                self.errors += 1
+
+    def _percentiles(self) -> dict:
+        if not self._recent_latencies:
+            return {}
+        ordered = sorted(self._recent_latencies)
+
+        def pick(quantile: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(quantile * len(ordered)))], 2)
+
+        return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': round(ordered[-1], 2)}
+
+    def snapshot(self, cache: QueryCache, requests: queue.Queue = None) -> dict:
+        keys = _histogram_keys()
+        with self._lock:
+            snapshot = {
+                'uptimeSec': round(time.time() - self.started_at, 1),
+                'requests': self.requests + self.cache_served,
+                'batches': self.batches,
+                'texts': self.texts,
+                'avgBatchTexts': round(self.texts / self.batches, 2) if self.batches else 0.0,
+                'maxBatchTexts': self.max_batch_texts,
+                'avgEncodeMs': round(self.encode_ms_total / self.batches, 2) if self.batches else 0.0,
+                'encodeMsHistogram': dict(zip(keys, self._encode_histogram)),
+                'latencyMs': self._percentiles(),
+                'latencyMsHistogram': dict(zip(keys, self._latency_histogram)),
+                'rejected': self.rejected,
+                'errors': self.errors,
+            }
+        snapshot['queueDepth'] = queue_depth(requests)
+        snapshot['cache'] = cache.stats()
+        snapshot['memory'] = memory_mb()
+        return snapshot
+
+
+def query_result(command: str, vector, params: dict, fmt: str, index_holder):
+    """Resultado de encode-query (el embedding) o search (top-k del indice de la KB)."""
+    if command == 'search':
+        index = index_holder.get() if index_holder is not None else None
+        if index is None:
+            raise ValueError('KB index not available: run help_embeddings.py build-index')
+        return index.search(
+            vector,
+            k=int(params.get('k', 5)),
+            section=params.get('section'),
+            exact=bool(params.get('exact', False)),
+            nprobe=params.get('nprobe'),
+        )
+    return serialize_embeddings(vector, fmt)
+
+
+SHUTDOWN = object()  # parse_request -> el lector deja de leer y el batcher termina lo pendiente
+
+
+def reply(writer: ResponseWriter, metrics: ServerMetrics, received_at: float, request_id, result=None, error=None):
+    if error is not None:
+        writer.send({"id": request_id, "error": error})
+    else:
+        writer.send({"id": request_id, "result": result})
+    metrics.record_response(received_at, error=error is not None)
+
+
+def parse_request(
+    line: str,
+    writer: ResponseWriter,
+    cache: QueryCache,
+    metrics: ServerMetrics,
+    index_holder=None,
+    requests: queue.Queue = None,
+):
+    """
+    Convierte una linea en PendingRequest, o responde directamente si no hay
+    nada que codificar. Devuelve SHUTDOWN si se pidio terminar el servidor.
+    """
+    received_at = time.perf_counter()
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        reply(writer, metrics, received_at, "unknown", error=f"JSON parse error: {str(e)}")
+        return None
+
+    request_id = request.get('id', 'unknown')
+    command = request.get('command')
+    params = request.get('params') or {}
+
+    if command == 'ping':
+        result = {
+            'status': 'ok',
+            'uptimeSec': round(time.time() - metrics.started_at, 1),
+            'queueDepth': queue_depth(requests),
+        }
+        reply(writer, metrics, received_at, request_id, result)
+        return None
+    if command == 'stats':
+        reply(writer, metrics, received_at, request_id, metrics.snapshot(cache, requests))
+        return None
+    if command == 'shutdown':
+        reply(writer, metrics, received_at, request_id, {'status': 'shutting-down'})
+        return SHUTDOWN
+
+    fmt = params.get('format') or 'json'
+    if fmt not in EMBEDDING_FORMATS:
+        reply(writer, metrics, received_at, request_id, error=f"Unknown format: {fmt}")
+        return None
+
+    if command in ('encode-query', 'search'):
+        # El encoder recibe el mismo texto que forma la clave del cache
+        text = QueryCache.normalize(params.get('text') or '')
+        texts = [text] if text else []
+        if text:
+            cached = cache.get(text)
+            if cached is not None:
+                # Respuesta inmediata desde el hilo lector, sin pasar por el batcher
+                metrics.cache_served += 1
+                try:
+                    result = query_result(command, cached, params, fmt, index_holder)
+                except Exception as e:
+                    reply(writer, metrics, received_at, request_id, error=str(e))
+                    return None
+                reply(writer, metrics, received_at, request_id, result)
+                return None
+    elif command == 'encode-batch':
+        texts = params.get('texts', [])
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            # Rechazar aqui: un texto invalido no debe llegar al batch compartido
+            reply(writer, metrics, received_at, request_id, error="texts must be a list of strings")
+            return None
+    else:
+        reply(writer, metrics, received_at, request_id, error=f"Unknown command: {command}")
+        return None
+
+    if not texts:
+        reply(writer, metrics, received_at, request_id, [])
+        return None
+    pending = PendingRequest(request_id, command, texts, fmt, params)
+    pending.received_at = received_at
+    return pending
+
+
+def reader_loop(
+    requests: queue.Queue,
+    writer: ResponseWriter,
+    cache: QueryCache,
+    metrics: ServerMetrics,
+    index_holder=None,
+    consumers: int = 1,
+):
+    """
+    Hilo lector: parsea stdin y encola; si la cola esta llena rechaza la peticion.
+    Termina en EOF o con el comando shutdown (un None por consumidor de la cola).
+    """
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                pending = parse_request(line, writer, cache, metrics, index_holder, requests)
+                if pending is SHUTDOWN:
+                    break
+                if pending is None:
+                    continue
+                requests.put_nowait(pending)
+            except queue.Full:
+                metrics.rejected += 1
+                reply(writer, metrics, pending.received_at, pending.id, error="Server overloaded: request queue full")
+            except Exception as e:
+                writer.send({"id": "unknown", "error": f"Unexpected error: {str(e)}"})
+    finally:
+        # EOF o shutdown - avisar al batcher para que termine lo pendiente y salga
+        for _ in range(consumers):
+            requests.put(None)
+
+
+def collect_batch(requests: queue.Queue, max_batch_texts: int, max_wait_s: float):
+    """
+    Espera la primera peticion y agrupa las que lleguen durante max_wait_s o
+    hasta juntar max_batch_texts textos. Devuelve (batch, eof).
+    """
+    first = requests.get()
+    if first is None:
+        return [], True
+
+    batch = [first]
+    n_texts = len(first.texts)
+    deadline = time.perf_counter() + max_wait_s
+    while n_texts < max_batch_texts:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            item = requests.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is None:
+            return batch, True
+        batch.append(item)
+        n_texts += len(item.texts)
+    return batch, False
+
+
+def _encode(model, texts: list, batch_size: int):
+    return model.encode(
+        texts,
+        batch_size=batch_size,
+        show_progress_bar=False,
+        normalize_embeddings=True,
+    )
+
+
+def encode_pending(model, batch: list, batch_size: int) -> list:
+    """
+    Codifica los textos de todas las peticiones en una llamada y devuelve
+    [(pending, embeddings, error)]. Cada forward pass lleva a lo sumo batch_size
+    textos (--max-batch): un encode-batch con toda la KB no se convierte en un
+    unico batch gigante con padding. Si la llamada conjunta falla se reintenta
+    cada peticion por separado, para que el error quede solo en la que lo causa.
+    """
+    texts = [text for pending in batch for text in pending.texts]
+    try:
+        embeddings = _encode(model, texts, batch_size)
+    except Exception as e:
+        if len(batch) == 1:
+            return [(batch[0], None, str(e))]
+        encoded = []
+        for pending in batch:
+            try:
+                encoded.append((pending, _encode(model, pending.texts, batch_size), None))
+            except Exception as single_error:
+                encoded.append((pending, None, str(single_error)))
+        return encoded
+
+    encoded = []
+    offset = 0
+    for pending in batch:
+        encoded.append((pending, embeddings[offset:offset + len(pending.texts)], None))
+        offset += len(pending.texts)
+    return encoded
+
+
+def process_batch(
+    model,
+    batch: list,
+    writer: ResponseWriter,
+    cache: QueryCache,
+    metrics: ServerMetrics,
+    index_holder=None,
+    max_batch_texts: int = 32,
+):
+    """Codifica todos los textos del batch en una sola llamada a encode y reparte por id."""
+    texts = [text for pending in batch for text in pending.texts]
+    started = time.perf_counter()
+    wait_ms = (started - min(p.received_at for p in batch)) * 1000
+    encoded = encode_pending(model, batch, max_batch_texts)
+    encode_ms = (time.perf_counter() - started) * 1000
+
+    for pending, chunk, error in encoded:
+        if error is not None:
+            reply(writer, metrics, pending.received_at, pending.id, error=error)
+            continue
+        try:
+            if pending.command == 'encode-batch':
+                result = serialize_embeddings(chunk, pending.format)
+            else:
+                cache.put(pending.texts[0], chunk[0])
+                result = query_result(pending.command, chunk[0], pending.params, pending.format, index_holder)
+        except Exception as e:
+            reply(writer, metrics, pending.received_at, pending.id, error=str(e))
+            continue
+        reply(writer, metrics, pending.received_at, pending.id, result)
+
+    metrics.record_batch(len(batch), len(texts), wait_ms, encode_ms)
+
+
+def encode_for_pool(model, batch: list, results, max_batch_texts: int = 32):
+    """Version de process_batch para los workers del pool: devuelve todo por la cola de resultados."""
+    texts = [text for pending in batch for text in pending.texts]
+    started = time.perf_counter()
+    wait_ms = (started - min(p.received_at for p in batch)) * 1000
+    encoded = encode_pending(model, batch, max_batch_texts)
+    encode_ms = (time.perf_counter() - started) * 1000
+
+    for pending, chunk, error in encoded:
+        if error is not None:
+            results.put(('error', pending.id, pending.received_at, error))
+            continue
+        if pending.command == 'encode-batch':
+            # Serializar aqui para no cargar al proceso frontal con el JSON de lotes grandes
+            try:
+                line = json.dumps({"id": pending.id, "result": serialize_embeddings(chunk, pending.format)})
+            except Exception as e:
+                results.put(('error', pending.id, pending.received_at, str(e)))
+                continue
+            results.put(('line', pending.id, pending.received_at, line))
+        else:
+            # Cache y busqueda en la KB viven en el proceso frontal
+            results.put(('vector', pending, chunk[0]))
+
+    results.put(('batch', len(batch), len(texts), wait_ms, encode_ms))
+
+
+def pool_worker(tasks, results, max_batch_texts: int, max_wait_s: float, threads: int):
+    """Proceso worker: usa el modelo heredado del fork (paginas compartidas copy-on-write)."""
+    if threads and 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+    model = get_model()
+    try:
+        while True:
+            batch, eof = collect_batch(tasks, max_batch_texts, max_wait_s)
+            if batch:
+                encode_for_pool(model, batch, results, max_batch_texts)
+            if eof:
+                break
+    finally:
+        results.put(('exit', os.getpid()))
+
+
+def pool_results_loop(
+    results,
+    processes: list,
+    writer: ResponseWriter,
+    cache: QueryCache,
+    metrics: ServerMetrics,
+    index_holder=None,
+):
+    """Proceso frontal: escribe las respuestas de los workers hasta que todos terminan."""
+    remaining = len(processes)
+    while remaining:
+        try:
+            message = results.get(timeout=1.0)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                print('Pool: todos los workers terminaron sin avisar', file=sys.stderr)
+                break
+            continue
+
+        kind = message[0]
+        if kind == 'exit':
+            remaining -= 1
+        elif kind == 'batch':
+            metrics.record_batch(*message[1:])
+        elif kind == 'line':
+            writer.send_line(message[3])
+            metrics.record_response(message[2])
+        elif kind == 'error':
+            reply(writer, metrics, message[2], message[1], error=message[3])
+        elif kind == 'vector':
+            pending, vector = message[1], message[2]
+            cache.put(pending.texts[0], vector)
+            try:
+                result = query_result(pending.command, vector, pending.params, pending.format, index_holder)
+            except Exception as e:
+                reply(writer, metrics, pending.received_at, pending.id, error=str(e))
+                continue
+            reply(writer, metrics, pending.received_at, pending.id, result)
+
+
+def start_pool(workers: int, max_queue: int, max_batch_texts: int, max_wait_s: float):
+    """
+    Arranca N workers con fork despues de cargar el modelo, para que compartan
+    sus pesos. Devuelve (tasks, results, processes) o None si no hay fork (Windows).
+    """
+    import multiprocessing
+
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        print('Pool: fork no disponible en esta plataforma, se usa un solo proceso', file=sys.stderr)
+        return None
+
+    tasks = context.Queue(maxsize=max(max_queue, 1))
+    results = context.Queue()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    processes = []
+    for number in range(workers):
+        process = context.Process(
+            target=pool_worker,
+            args=(tasks, results, max_batch_texts, max_wait_s, threads),
+            name=f'help-embeddings-worker-{number}',
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+    print(f'Pool: {workers} workers ({threads} hilos cada uno)', file=sys.stderr)
+    return tasks, results, processes
+
+
+def report_loop(
+    interval_s: float,
+    stop: threading.Event,
+    writer: ResponseWriter,
+    cache: QueryCache,
+    metrics: ServerMetrics,
+    requests: queue.Queue,
+):
+    """Escribe periodicamente {"event": "report", "result": stats} en stdout."""
+    while not stop.wait(interval_s):
+        writer.send({"event": "report", "result": metrics.snapshot(cache, requests)})
+
+
+def server_mode(
+    max_batch_texts: int = 32,
+    max_wait_ms: float = 5.0,
+    max_queue: int = 256,
+    log_batches: bool = False,
+    cache_size: int = 2048,
+    cache_file: str = None,
+    index_prefix: str = None,
+    report_interval: float = 0.0,
+    workers: int = 1,
+):
     """
     Modo servidor: mantiene el modelo cargado en memoria y procesa comandos desde stdin.
-    
+
+    Un hilo lector parsea stdin y encola las peticiones; el hilo principal junta
+    las que llegan en una ventana de max_wait_ms (o hasta max_batch_texts textos)
+    y las codifica en un solo forward pass. Las respuestas pueden salir en otro
+    orden que las peticiones: el cliente debe emparejarlas por id. Si hay mas de
+    max_queue peticiones pendientes, las nuevas se rechazan con error.
+
+    Las consultas (encode-query) se guardan en un LRU de cache_size entradas;
+    un acierto se responde de inmediato. Con cache_file el LRU se carga al
+    iniciar y se guarda al terminar (EOF o shutdown).
+
     Formato de comando (una línea JSON por comando):
     {"id": "uuid", "command": "encode-query", "params": {"text": "..."}}
     {"id": "uuid", "command": "encode-batch", "params": {"texts": [...]}}
-    
+    {"id": "uuid", "command": "search", "params": {"text": "...", "k": 5, "section": "..."}}
+    {"id": "uuid", "command": "ping"}      -> {"status": "ok", "uptimeSec", "queueDepth"}
+    {"id": "uuid", "command": "stats"}     -> contadores, tamanos de batch, histogramas de
+                                              latencia (encode y punta a punta), cola, RSS y cache
+    {"id": "uuid", "command": "shutdown"}  -> deja de leer, responde lo pendiente y sale
+    encode-query/encode-batch aceptan "format": "json" | "f32" | "f16" en params.
+    search devuelve [{sourceId, sourceType, section, question, answer, similarity}]
+    usando el indice de index_prefix (se recarga si se reconstruye). En KBs con
+    IVF la busqueda es aproximada; params acepta "nprobe" y "exact": true.
+
     Formato de respuesta (una línea JSON por respuesta):
     {"id": "uuid", "result": [...]}
     {"id": "uuid", "error": "mensaje de error"}
+
+    Con workers > 1 el proceso frontal (lector, cache, indice) reparte los
+    batches entre N procesos creados con fork despues de cargar el modelo, de
+    modo que los pesos se comparten copy-on-write en vez de duplicarse.
+
+    Con report_interval > 0 se escribe ademas cada report_interval segundos una
+    linea sin id: {"event": "report", "result": {...stats...}}.
     """
+    from help_kb_index import KBIndexHolder
+
     # Pre-cargar el modelo una sola vez
     model = get_model()
-    
-    # Escribir mensaje de ready para indicar que el servidor está listo
-    print(json.dumps({"status": "ready"}), flush=True)
-    
-    while True:
+    report_timings('server')
+
+    writer = ResponseWriter()
+    metrics = ServerMetrics(log_batches=log_batches)
+    cache = QueryCache(cache_size)
+    index_holder = KBIndexHolder(index_prefix) if index_prefix else None
+    if index_holder is not None:
+        index_holder.get()
+    if cache_file:
         try:
-            line = sys.stdin.readline()
-            if not line:
-                # EOF - salir del servidor
+            loaded = cache.load(cache_file)
+            print(f'Query cache: {loaded} entradas cargadas de {cache_file}', file=sys.stderr)
+        except Exception as e:
+            print(f'Query cache: no se pudo cargar {cache_file}: {e}', file=sys.stderr)
+    max_wait_s = max(max_wait_ms, 0.0) / 1000
+    max_batch_texts = max(max_batch_texts, 1)
+    # El pool se crea antes de arrancar hilos: fork con hilos vivos no es seguro
+    pool = start_pool(workers, max_queue, max_batch_texts, max_wait_s) if workers > 1 else None
+    if pool is not None:
+        requests, results, processes = pool
+    else:
+        requests = queue.Queue(maxsize=max(max_queue, 1))
+
+    # Escribir mensaje de ready para indicar que el servidor está listo
+    writer.send({"status": "ready", "backend": _backend})
+
+    reader = threading.Thread(
+        target=reader_loop,
+        args=(requests, writer, cache, metrics, index_holder, len(processes) if pool else 1),
+        name='help-embeddings-reader',
+        daemon=True,
+    )
+    reader.start()
+
+    stop_reporting = threading.Event()
+    if report_interval > 0:
+        threading.Thread(
+            target=report_loop,
+            args=(report_interval, stop_reporting, writer, cache, metrics, requests),
+            name='help-embeddings-report',
+            daemon=True,
+        ).start()
+
+    if pool is not None:
+        pool_results_loop(results, processes, writer, cache, metrics, index_holder)
+        for process in processes:
+            process.join(timeout=5)
+    else:
+        while True:
+            batch, eof = collect_batch(requests, max_batch_texts, max_wait_s)
+            if batch:
+                process_batch(model, batch, writer, cache, metrics, index_holder, max_batch_texts)
+            if eof:
                 break
-            
-            line = line.strip()
-            if not line:
-                continue
-            
-            request = json.loads(line)
-            request_id = request.get('id', 'unknown')
-            command = request.get('command')
-            params = request.get('params', {})
-            
-            result = None
-            error = None
-            
-            try:
-                if command == 'encode-query':
-                    text = params.get('text', '').strip()
-                    if not text:
-                        result = []
-                    else:
-                        embedding = model.encode([text], show_progress_bar=False, normalize_embeddings=True)
-                        result = embedding[0].tolist()
-                
-                elif command == 'encode-batch':
-                    texts = params.get('texts', [])
-                    if not isinstance(texts, list) or len(texts) == 0:
-                        result = []
-                    else:
-                        embeddings = model.encode(texts, show_progress_bar=False, normalize_embeddings=True)
-                        result = [emb.tolist() for emb in embeddings]
-                
-                else:
-                    error = f"Unknown command: {command}"
-            
-            except Exception as e:
-                error = str(e)
-            
-            # Enviar respuesta
-            if error:
-                response = {"id": request_id, "error": error}
-            else:
-                response = {"id": request_id, "result": result}
-            
-            print(json.dumps(response), flush=True)
-        
-        except json.JSONDecodeError as e:
-            # Error al parsear el comando - enviar respuesta de error
-            error_response = {"id": "unknown", "error": f"JSON parse error: {str(e)}"}
-            print(json.dumps(error_response), flush=True)
-        
+    stop_reporting.set()
+
+    if cache_file:
+        try:
+            saved = cache.save(cache_file)
+            print(f'Query cache: {saved} entradas guardadas en {cache_file}', file=sys.stderr)
         except Exception as e:
-            # Error inesperado - loggear y continuar
-            error_response = {"id": "unknown", "error": f"Unexpected error: {str(e)}"}
-            print(json.dumps(error_response), flush=True)
+            print(f'Query cache: no se pudo guardar {cache_file}: {e}', file=sys.stderr)
+
+
+def build_index(
+    kb_path: str,
+    index_prefix: str,
+    dtype: str,
+    force: bool = False,
+    ann_min_entries: int = None,
+    ann_lists: int = 0,
+):
+    """
+    Construye el indice compacto de forma incremental: reutiliza los vectores
+    del indice anterior cuyas entradas no cambiaron (mismo hash de modelo +
+    sourceId + texto), codifica solo las nuevas o modificadas y descarta las
+    eliminadas. Si solo cambiaron metadatos (respuesta, seccion) se reescribe
+    el meta.json sin tocar los vectores. Con force se vuelve a codificar todo. Si la KB tiene al menos
+    ann_min_entries entradas se construye tambien el IVF para busqueda aproximada.
+    """
+    import numpy as np
+    from help_kb_index import (
+        ANN_MIN_ENTRIES,
+        KBIndex,
+        content_hash,
+        entry_hash,
+        entry_text,
+        meta_entries,
+        metadata_hash,
+        write_index,
+        write_meta,
+    )
+
+    if ann_min_entries is None:
+        ann_min_entries = ANN_MIN_ENTRIES
+
+    with open(kb_path, 'r', encoding='utf-8') as fh:
+        entries = json.load(fh)
+    texts = [entry_text(entry) for entry in entries]
+    hashes = [entry_hash(entry, text, model_id()) for entry, text in zip(entries, texts)]
+    digest = content_hash(texts, entries, model_id(), dtype)
+
+    previous = None if force else KBIndex.load(index_prefix)
+    if previous is not None and previous.meta.get('dtype') == 'int8' and dtype != 'int8':
+        # Los vectores int8 ya perdieron precision: no se reutilizan para un indice float16
+        previous = None
+    previous_rows = {}
+    if previous is not None:
+        for row, entry in enumerate(previous.entries):
+            if entry.get('hash'):
+                previous_rows[entry['hash']] = row
+
+    summary = {
+        'entries': len(entries),
+        'reused': 0,
+        'encoded': 0,
+        'dropped': 0,
+        'contentHash': digest,
+    }
+    if previous is not None:
+        current = set(hashes)
+        summary['dropped'] = sum(1 for h in previous_rows if h not in current)
+        wants_ann = len(entries) >= ann_min_entries > 0
+        if previous.meta.get('contentHash') == digest and bool(previous.meta.get('ann')) == wants_ann:
+            summary['reused'] = len(entries)
+            summary['ann'] = previous.meta.get('ann')
+            meta_digest = metadata_hash(entries)
+            if previous.meta.get('metaHash') != meta_digest:
+                # Mismos textos y orden: los vectores valen, solo cambian respuestas/secciones
+                write_meta(index_prefix, {**previous.meta, 'metaHash': meta_digest, 'entries': meta_entries(entries, hashes)})
+                summary['metadataUpdated'] = True
+                print(f'KB index: metadatos actualizados ({len(entries)} entradas)', file=sys.stderr)
+            else:
+                print(f'KB index al dia ({len(entries)} entradas)', file=sys.stderr)
+            print(json.dumps(summary), end='')
+            return
+
+    reuse = [previous_rows.get(h) for h in hashes]
+    missing = [i for i, row in enumerate(reuse) if row is None]
+
+    started = time.perf_counter()
+    encoded = None
+    if missing:
+        model = get_model()
+        encoded = np.asarray(
+            model.encode(
+                [texts[i] for i in missing],
+                batch_size=64,
+                show_progress_bar=False,
+                normalize_embeddings=True,
+            ),
+            dtype=np.float32,
+        )
+
+    if encoded is not None:
+        dim = encoded.shape[1]
+    else:
+        # KB vacia sin indice anterior: matriz (0, 0)
+        dim = previous.matrix.shape[1] if previous is not None else 0
+    embeddings = np.zeros((len(entries), dim), dtype=np.float32)
+    reused_positions = [i for i, row in enumerate(reuse) if row is not None]
+    if reused_positions:
+        embeddings[reused_positions] = previous.matrix[[reuse[i] for i in reused_positions]]
+    if missing:
+        embeddings[missing] = encoded
+    meta = write_index(
+        index_prefix,
+        entries,
+        embeddings,
+        model_id(),
+        dtype,
+        digest,
+        hashes,
+        ann_min_entries=ann_min_entries,
+        ann_lists=ann_lists,
+    )
+    elapsed = time.perf_counter() - started
+    summary['ann'] = meta['ann']
+
+    summary['reused'] = len(reused_positions)
+    summary['encoded'] = len(missing)
+    size = os.path.getsize(f'{index_prefix}.npy')
+    print(
+        f"KB index: {summary['reused']} reutilizadas, {summary['encoded']} codificadas, "
+        f"{summary['dropped']} eliminadas en {elapsed:.1f}s "
+        f'({dtype}, {size / 1024:.1f} KB) -> {index_prefix}.npy',
+        file=sys.stderr,
+    )
+    print(json.dumps(summary), end='')
 
 
 def main():
     parser = argparse.ArgumentParser(description='Help embeddings para ADSLab')
     parser.add_argument(
         'mode',
-        choices=['encode-batch', 'encode-query', 'server'],
+        choices=['encode-batch', 'encode-query', 'server', 'build-index', 'export-model'],
         help='Modo de operacion',
     )
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default=None,
+        help='Backend de inferencia (por defecto HELP_EMBEDDINGS_BACKEND o torch)',
+    )
+    parser.add_argument(
+        '--model-dir',
+        default=None,
+        help='Directorio local del modelo (export-model / carga offline). '
+             'Por defecto HELP_EMBEDDINGS_MODEL_DIR o ml/models/help-embeddings/<modelo>',
+    )
     parser.add_argument(
         '--text',
         default='',
         help='Texto a codificar (solo para encode-query)',
     )
+    parser.add_argument(
+        '--format',
+        choices=EMBEDDING_FORMATS,
+        default='json',
+        help='Formato de salida de los embeddings (encode-batch / encode-query)',
+    )
+    parser.add_argument(
+        '--kb',
+        default=None,
+        help='JSON de la KB estatica (build-index). Por defecto help-kb-static.json',
+    )
+    parser.add_argument(
+        '--index',
+        default=None,
+        help='Prefijo del indice compacto (build-index / search). Por defecto ml/help-index',
+    )
+    parser.add_argument(
+        '--index-dtype',
+        choices=['float16', 'int8'],
+        default='float16',
+        help='Precision de la matriz del indice (build-index)',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Volver a codificar todas las entradas en vez de reutilizar las que no cambiaron',
+    )
+    parser.add_argument(
+        '--ann-min-entries',
+        type=int,
+        default=None,
+        help='Entradas minimas para construir el indice IVF (build-index). 0 lo desactiva',
+    )
+    parser.add_argument(
+        '--ann-lists',
+        type=int,
+        default=0,
+        help='Numero de listas del IVF (build-index). Por defecto ~sqrt(entradas)',
+    )
+    parser.add_argument(
+        '--max-batch',
+        type=int,
+        default=32,
+        help='Maximo de textos por forward pass en modo server',
+    )
+    parser.add_argument(
+        '--max-wait-ms',
+        type=float,
+        default=5.0,
+        help='Ventana para agrupar peticiones en modo server',
+    )
+    parser.add_argument(
+        '--max-queue',
+        type=int,
+        default=256,
+        help='Peticiones pendientes antes de rechazar nuevas en modo server',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Procesos worker del servidor (fork con el modelo compartido). 1 = un solo proceso',
+    )
+    parser.add_argument(
+        '--report-interval',
+        type=float,
+        default=0.0,
+        help='Segundos entre lineas {"event": "report"} con las metricas del servidor (0 = desactivado)',
+    )
+    parser.add_argument(
+        '--log-batches',
+        action='store_true',
+        help='Escribir latencia de cada batch en stderr (modo server)',
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=2048,
+        help='Entradas del LRU de consultas en modo server (0 = desactivado)',
+    )
+    parser.add_argument(
+        '--cache-file',
+        default=None,
+        help='Archivo .npz donde persistir el LRU de consultas entre reinicios',
+    )
     args = parser.parse_args()
+    set_backend(args.backend or _backend)
+    if args.model_dir:
+        set_model_dir(args.model_dir)
 
     if args.mode == 'encode-batch':
-        encode_batch()
+        encode_batch(args.format)
     elif args.mode == 'encode-query':
         if not args.text:
             print(json.dumps([]), end='')
             return
-        encode_query(args.text)
+        encode_query(args.text, args.format)
+    elif args.mode == 'export-model':
+        export_model(_model_dir)
+    elif args.mode == 'build-index':
+        from help_kb_index import DEFAULT_INDEX_PREFIX, DEFAULT_KB_PATH
+
+        build_index(
+            args.kb or DEFAULT_KB_PATH,
+            args.index or DEFAULT_INDEX_PREFIX,
+            args.index_dtype,
+            force=args.force,
+            ann_min_entries=args.ann_min_entries,
+            ann_lists=args.ann_lists,
+        )
     elif args.mode == 'server':
-        server_mode()
+        from help_kb_index import DEFAULT_INDEX_PREFIX
+
+        server_mode(
+            max_batch_texts=args.max_batch,
+            max_wait_ms=args.max_wait_ms,
+            max_queue=args.max_queue,
+            log_batches=args.log_batches,
+            cache_size=args.cache_size,
+            cache_file=args.cache_file,
+            index_prefix=args.index or DEFAULT_INDEX_PREFIX,
+            report_interval=args.report_interval,
+            workers=args.workers,
+        )
 
 
 if __name__ == '__main__':
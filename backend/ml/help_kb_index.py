@@ -0,0 +1,344 @@
+"""
+Indice compacto de la base de conocimiento del asistente de ayuda.
+
+Reemplaza help-embeddings-cache.json (vectores como listas de decimales) por:
+  <prefijo>.npy          — matriz (n, dim) de embeddings normalizados en float16 o int8
+  <prefijo>.scales.npy   — escala por fila (solo int8)
+  <prefijo>.meta.json    — modelo, dtype, hash de contenido y metadatos de cada entrada
+  <prefijo>.ivf.npz      — indice IVF (solo para KBs grandes, ver build_ivf)
+
+El hash de contenido cubre modelo, dtype y el texto de cada entrada, asi que
+sirve para saber si los vectores estan desactualizados respecto a la KB; el hash
+de metadatos cubre lo que se guarda de cada entrada (seccion, respuesta...) y
+basta con reescribir el meta.json cuando solo cambia ese. Ademas cada entrada
+guarda su propio hash (modelo + sourceId + texto) para que una reconstruccion
+solo codifique las entradas nuevas o modificadas.
+La busqueda top-k es un solo producto matriz-vector sobre la matriz en memoria;
+a partir de ANN_MIN_ENTRIES entradas se construye ademas un IVF (k-means sobre
+los vectores normalizados) y la busqueda solo recorre las listas mas cercanas.
+
+Se construye con: python help_embeddings.py build-index
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_KB_PATH = os.path.join(SCRIPT_DIR, 'help-kb-static.json')
+DEFAULT_INDEX_PREFIX = os.path.join(SCRIPT_DIR, 'help-index')
+
+INDEX_DTYPES = ('float16', 'int8')
+SECTION_BOOST = 0.05  # Igual que HelpEmbeddingService.searchSimilar
+
+ANN_MIN_ENTRIES = 20000  # Por debajo, la fuerza bruta es igual de rapida y exacta
+ANN_KMEANS_ITERATIONS = 10
+ANN_TRAIN_PER_LIST = 64  # Muestra de entrenamiento del k-means por lista
+ANN_PROBE_FRACTION = 0.05  # Fraccion de listas recorridas por defecto
+
+
+def entry_text(entry: dict) -> str:
+    """Texto a codificar por entrada (pregunta + aliases), igual que el servicio Node."""
+    parts = [entry.get('question') or '']
+    aliases = entry.get('aliases') or []
+    if aliases:
+        parts.append(', '.join(aliases))
+    return ' — '.join(parts)
+
+
+def content_hash(texts: list, entries: list, model_name: str, dtype: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(f'{model_name}\n{dtype}\n'.encode('utf-8'))
+    for entry, text in zip(entries, texts):
+        digest.update(f"{entry.get('sourceType')}:{entry.get('sourceId')}\n{text}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def meta_entries(entries: list, hashes: list = None) -> list:
+    """Metadatos por entrada que se guardan en el meta.json junto al vector."""
+    return [
+        {
+            'sourceId': entry.get('sourceId'),
+            'sourceType': entry.get('sourceType'),
+            'section': entry.get('section'),
+            'question': entry.get('question'),
+            'answer': entry.get('answer'),
+            'hash': hashes[position] if hashes else None,
+        }
+        for position, entry in enumerate(entries)
+    ]
+
+
+def metadata_hash(entries: list) -> str:
+    """Hash de los metadatos guardados: si cambia sin que cambie content_hash, basta con reescribir el meta.json."""
+    payload = json.dumps(meta_entries(entries), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def entry_hash(entry: dict, text: str, model_name: str) -> str:
+    """Hash por entrada: si no cambia, su vector se puede reutilizar del indice anterior."""
+    key = f"{model_name}\n{entry.get('sourceType')}:{entry.get('sourceId')}\n{text}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def quantize(embeddings: np.ndarray, dtype: str):
+    """Devuelve (matriz, escalas); las escalas solo existen para int8 (simetrico por fila)."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    if dtype == 'int8':
+        scales = np.abs(embeddings).max(axis=1, initial=0.0) / 127.0
+        scales[scales == 0] = 1.0
+        matrix = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return matrix, scales.astype(np.float32)
+    raise ValueError(f'Unknown index dtype: {dtype}')
+
+
+def _save_npy(path: str, array: np.ndarray):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        np.save(fh, array)
+    os.replace(tmp_path, path)
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        assignment[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return assignment
+
+
+def build_ivf(matrix: np.ndarray, n_lists: int = 0, seed: int = 0) -> dict:
+    """
+    IVF sobre vectores normalizados: k-means esferico (producto punto) entrenado
+    sobre una muestra, y las filas ordenadas por lista para que cada lista sea
+    un bloque contiguo de la matriz.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    n = len(matrix)
+    n_lists = int(n_lists) or max(1, int(round(np.sqrt(n))))
+    n_lists = min(n_lists, n)
+    rng = np.random.default_rng(seed)
+
+    train_size = min(n, n_lists * ANN_TRAIN_PER_LIST)
+    train = matrix[rng.choice(n, train_size, replace=False)]
+    centroids = train[rng.choice(train_size, n_lists, replace=False)].copy()
+    for _ in range(ANN_KMEANS_ITERATIONS):
+        assignment = _nearest_centroids(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, train)
+        counts = np.bincount(assignment, minlength=n_lists)
+        empty = counts == 0
+        if empty.any():
+            # Reiniciar listas vacias con puntos al azar de la muestra
+            sums[empty] = train[rng.choice(train_size, int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+
+    assignment = _nearest_centroids(matrix, centroids)
+    order = np.argsort(assignment, kind='stable').astype(np.int32)
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+    return {
+        'centroids': centroids.astype(np.float32),
+        'order': order,
+        'offsets': offsets,
+        'nprobe': max(1, int(np.ceil(n_lists * ANN_PROBE_FRACTION))),
+    }
+
+
+def read_meta(prefix: str):
+    meta_path = f'{prefix}.meta.json'
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def write_index(
+    prefix: str,
+    entries: list,
+    embeddings: np.ndarray,
+    model_name: str,
+    dtype: str,
+    digest: str,
+    hashes: list = None,
+    ann_min_entries: int = ANN_MIN_ENTRIES,
+    ann_lists: int = 0,
+) -> dict:
+    """Escribe matriz, escalas, IVF y metadatos; el meta.json va al final para que los lectores no vean un indice a medias."""
+    matrix, scales = quantize(embeddings, dtype)
+    _save_npy(f'{prefix}.npy', matrix)
+    scales_path = f'{prefix}.scales.npy'
+    if scales is not None:
+        _save_npy(scales_path, scales)
+    elif os.path.exists(scales_path):
+        os.remove(scales_path)
+
+    ann = None
+    ivf_path = f'{prefix}.ivf.npz'
+    if len(entries) >= ann_min_entries > 0:
+        ivf = build_ivf(embeddings, ann_lists)
+        tmp_path = f'{ivf_path}.tmp'
+        with open(tmp_path, 'wb') as fh:
+            np.savez(fh, centroids=ivf['centroids'], order=ivf['order'], offsets=ivf['offsets'])
+        os.replace(tmp_path, ivf_path)
+        ann = {'type': 'ivf', 'lists': int(len(ivf['centroids'])), 'nprobe': ivf['nprobe']}
+    elif os.path.exists(ivf_path):
+        os.remove(ivf_path)
+
+    meta = {
+        'model': model_name,
+        'dtype': dtype,
+        'count': int(matrix.shape[0]),
+        'dim': int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        'contentHash': digest,
+        'metaHash': metadata_hash(entries),
+        'ann': ann,
+        'entries': meta_entries(entries, hashes),
+    }
+    write_meta(prefix, meta)
+    return meta
+
+
+def write_meta(prefix: str, meta: dict):
+    meta_path = f'{prefix}.meta.json'
+    tmp_path = f'{meta_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(meta, fh, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+
+
+class KBIndex:
+    """
+    Indice cargado en memoria (matriz float32 des-cuantizada) con busqueda top-k.
+    Si el indice trae IVF, la busqueda aproximada recorre solo las nprobe listas
+    cuyos centroides son mas cercanos a la consulta (exact=True fuerza fuerza bruta).
+    """
+
+    def __init__(self, meta: dict, matrix: np.ndarray, ivf: dict = None):
+        self.meta = meta
+        self.entries = meta['entries']
+        self.matrix = matrix
+        self.sections = np.array([entry.get('section') or '' for entry in self.entries], dtype=object)
+        self.ivf = ivf
+        if ivf is not None:
+            # Copia de la matriz ordenada por lista: cada lista es un bloque contiguo
+            self.ivf_matrix = matrix[ivf['order']]
+            self.ivf_sections = self.sections[ivf['order']]
+
+    @classmethod
+    def load(cls, prefix: str):
+        meta = read_meta(prefix)
+        if meta is None:
+            return None
+        matrix = np.load(f'{prefix}.npy', mmap_mode='r')
+        if meta['dtype'] == 'int8':
+            scales = np.load(f'{prefix}.scales.npy')
+            matrix = matrix.astype(np.float32) * scales[:, None]
+        else:
+            matrix = matrix.astype(np.float32)
+        ivf = None
+        if meta.get('ann'):
+            with np.load(f'{prefix}.ivf.npz') as data:
+                ivf = {name: data[name] for name in ('centroids', 'order', 'offsets')}
+            ivf['nprobe'] = meta['ann'].get('nprobe', 1)
+        return cls(meta, matrix, ivf)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 5,
+        section: str = None,
+        exact: bool = False,
+        nprobe: int = None,
+    ) -> list:
+        positions, scores = self.top_k(query, k, section, exact, nprobe)
+        return [self._result(int(i), float(s)) for i, s in zip(positions, scores)]
+
+    def top_k(
+        self,
+        query: np.ndarray,
+        k: int,
+        section: str = None,
+        exact: bool = False,
+        nprobe: int = None,
+    ):
+        """Devuelve (posiciones, scores) de las k entradas mas similares, en orden descendente."""
+        if len(self.entries) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        if self.ivf is not None and not exact:
+            rows, scores = self._search_ivf(query, section, nprobe or self.ivf['nprobe'])
+        else:
+            rows = None
+            scores = self._boost(self.matrix @ query, self.sections, section)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return (top if rows is None else rows[top]), scores[top]
+
+    def _search_ivf(self, query: np.ndarray, section: str, nprobe: int):
+        centroids = self.ivf['centroids']
+        offsets = self.ivf['offsets']
+        nprobe = min(max(1, int(nprobe)), len(centroids))
+        probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        ranges = [(offsets[l], offsets[l + 1]) for l in np.sort(probe)]
+        slots = np.concatenate([np.arange(start, end) for start, end in ranges])
+        scores = np.concatenate([self.ivf_matrix[start:end] @ query for start, end in ranges])
+        scores = self._boost(scores, self.ivf_sections[slots], section)
+        return self.ivf['order'][slots], scores
+
+    @staticmethod
+    def _boost(scores: np.ndarray, sections: np.ndarray, section: str) -> np.ndarray:
+        if not section:
+            return scores
+        return np.where(sections == section, np.minimum(scores + SECTION_BOOST, 1.0), scores)
+
+    def _result(self, position: int, score: float) -> dict:
+        entry = self.entries[position]
+        return {
+            'sourceId': entry.get('sourceId'),
+            'sourceType': entry.get('sourceType'),
+            'section': entry.get('section'),
+            'question': entry.get('question'),
+            'answer': entry.get('answer'),
+            'similarity': score,
+        }
+
+
+class KBIndexHolder:
+    """Mantiene el indice cargado y lo recarga cuando cambia su meta.json."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.index = None
+        self.mtime = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(f'{self.prefix}.meta.json').st_mtime_ns
+        except FileNotFoundError:
+            return self.index
+        if mtime != self.mtime:
+            try:
+                self.index = KBIndex.load(self.prefix)
+                self.mtime = mtime
+                print(f'KB index: {len(self.index)} entradas cargadas de {self.prefix}', file=sys.stderr)
+            except Exception as e:
+                print(f'KB index: no se pudo cargar {self.prefix}: {e}', file=sys.stderr)
+        return self.index
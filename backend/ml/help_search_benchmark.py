@@ -0,0 +1,114 @@
+"""
+Benchmark de la busqueda semantica de ayuda: fuerza bruta vs IVF.
+
+Mide recall@k del IVF contra la fuerza bruta exacta y las consultas por segundo
+de ambos modos para varios valores de nprobe.
+
+Uso:
+  python help_search_benchmark.py                         # KB sintetica de 200k entradas
+  python help_search_benchmark.py --entries 500000 --k 5
+  python help_search_benchmark.py --index help-index      # indice real (help_embeddings.py build-index)
+
+Las consultas son vectores del indice con ruido gaussiano (re-normalizados), asi
+que no hace falta cargar el modelo de embeddings.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from help_kb_index import KBIndex, build_ivf
+
+
+def synthetic_matrix(entries: int, dim: int, clusters: int, noise: float, rng) -> np.ndarray:
+    """Vectores normalizados agrupados en temas, parecido a una KB real de preguntas."""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, entries)
+    matrix = centers[labels] + noise * rng.standard_normal((entries, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def make_queries(matrix: np.ndarray, count: int, noise: float, rng) -> np.ndarray:
+    queries = matrix[rng.integers(0, len(matrix), count)]
+    queries = queries + noise * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(matrix.shape[1])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries.astype(np.float32)
+
+
+def timed_search(index: KBIndex, queries: np.ndarray, k: int, **kwargs):
+    started = time.perf_counter()
+    results = [index.top_k(query, k, **kwargs)[0] for query in queries]
+    elapsed = time.perf_counter() - started
+    return results, len(queries) / elapsed if elapsed > 0 else 0.0
+
+
+def run_benchmark(index: KBIndex, queries: np.ndarray, k: int, nprobes: list) -> dict:
+    exact, exact_qps = timed_search(index, queries, k, exact=True)
+    offsets = index.ivf['offsets']
+    list_sizes = np.diff(offsets)
+
+    report = {
+        'entries': len(index),
+        'queries': len(queries),
+        'k': k,
+        'lists': int(len(index.ivf['centroids'])),
+        'defaultNprobe': int(index.ivf['nprobe']),
+        'bruteForce': {'qps': round(exact_qps, 1)},
+        'ivf': [],
+    }
+    for nprobe in nprobes:
+        approx, qps = timed_search(index, queries, k, nprobe=nprobe)
+        hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx, exact))
+        report['ivf'].append({
+            'nprobe': nprobe,
+            f'recall@{k}': round(hits / (k * len(queries)), 4),
+            'qps': round(qps, 1),
+            'speedup': round(qps / exact_qps, 2) if exact_qps else None,
+            # Fraccion esperada de la KB recorrida (listas de tamano medio)
+            'scanned': round(min(1.0, nprobe * float(list_sizes.mean()) / len(index)), 4),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de busqueda de ayuda (fuerza bruta vs IVF)')
+    parser.add_argument('--index', default=None, help='Prefijo de un indice existente (si no, KB sintetica)')
+    parser.add_argument('--entries', type=int, default=200000, help='Entradas de la KB sintetica')
+    parser.add_argument('--dim', type=int, default=384, help='Dimension de la KB sintetica')
+    parser.add_argument('--clusters', type=int, default=2000, help='Temas de la KB sintetica')
+    parser.add_argument('--lists', type=int, default=0, help='Listas del IVF (por defecto ~sqrt(entradas))')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', default='1,2,4,8,16,32,64', help='Valores de nprobe separados por coma')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.index:
+        index = KBIndex.load(args.index)
+        if index is None:
+            print(f'No existe el indice {args.index}', file=sys.stderr)
+            sys.exit(1)
+        meta, matrix = index.meta, index.matrix
+    else:
+        matrix = synthetic_matrix(args.entries, args.dim, args.clusters, 1.0, rng)
+        meta = {'entries': [{} for _ in range(len(matrix))]}
+
+    started = time.perf_counter()
+    ivf = build_ivf(matrix, args.lists, seed=args.seed)
+    build_seconds = time.perf_counter() - started
+    index = KBIndex(meta, matrix, ivf)
+
+    nprobes = sorted({min(int(n), len(ivf['centroids'])) for n in args.nprobe.split(',') if n.strip()})
+    queries = make_queries(matrix, args.queries, 0.5, rng)
+    report = run_benchmark(index, queries, args.k, nprobes)
+    report['ivfBuildSeconds'] = round(build_seconds, 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Benchmark de carga del servidor de help_embeddings.py segun el numero de workers.
+
+Para cada valor de --workers arranca `help_embeddings.py server --workers N`
+(sin cache de consultas, para medir codificacion real), envia --requests
+consultas encode-query unicas manteniendo --concurrency peticiones en vuelo, y
+reporta consultas/s, latencias y memoria. En Linux la memoria total se mide
+como PSS (paginas compartidas repartidas entre procesos) del proceso frontal +
+workers, que es lo que muestra si los pesos del modelo se comparten o se duplican.
+
+Uso:
+  python help_server_benchmark.py
+  python help_server_benchmark.py --workers 1,2,4 --requests 2000 --concurrency 64
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def proc_memory_mb(pid: int) -> dict:
+    """RSS y PSS (MB) de un proceso y sus hijos, leidos de /proc (solo Linux)."""
+    pids = [pid]
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children', 'r') as fh:
+                pids.extend(int(child) for child in fh.read().split())
+    except OSError:
+        return {}
+
+    totals = {'rssMb': 0.0, 'pssMb': 0.0}
+    for process_id in pids:
+        try:
+            with open(f'/proc/{process_id}/smaps_rollup', 'r') as fh:
+                for line in fh:
+                    name, _, value = line.partition(':')
+                    if name == 'Rss':
+                        totals['rssMb'] += int(value.split()[0]) / 1024
+                    elif name == 'Pss':
+                        totals['pssMb'] += int(value.split()[0]) / 1024
+        except OSError:
+            continue
+    totals = {name: round(value, 1) for name, value in totals.items()}
+    totals['processes'] = len(pids)
+    return totals
+
+
+def run_load(workers: int, requests: int, concurrency: int, server_args: list, timeout: float = 60.0) -> dict:
+    """
+    Si el servidor termina o pasa timeout segundos sin responder, se corta la
+    carga y el resultado trae 'failed' con el motivo (y las metricas parciales).
+    """
+    proc = subprocess.Popen(
+        [
+            sys.executable, os.path.join(SCRIPT_DIR, 'help_embeddings.py'), 'server',
+            '--workers', str(workers),
+            '--cache-size', '0',
+            *server_args,
+        ],
+        cwd=SCRIPT_DIR,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        bufsize=1,
+    )
+    line = proc.stdout.readline()
+    if not line:
+        raise RuntimeError(f'El servidor termino al arrancar (codigo {proc.wait()})')
+    ready = json.loads(line)
+    if ready.get('status') != 'ready':
+        raise RuntimeError(f'Servidor no listo: {ready}')
+
+    in_flight = threading.Semaphore(concurrency)
+    sent_at = {}
+    latencies = []
+    errors = [0]
+    last_response = [time.perf_counter()]
+    done = threading.Event()
+
+    def read_responses():
+        received = 0
+        for line in proc.stdout:
+            message = json.loads(line)
+            request_id = message.get('id')
+            if request_id not in sent_at:
+                continue  # stats / reports
+            last_response[0] = time.perf_counter()
+            latencies.append((last_response[0] - sent_at.pop(request_id)) * 1000)
+            if 'error' in message:
+                errors[0] += 1
+            in_flight.release()
+            received += 1
+            if received == requests:
+                break
+        done.set()  # todas las respuestas, o EOF si el servidor termino
+
+    def failure():
+        """Motivo para abortar la carga, o None si el servidor sigue respondiendo."""
+        if proc.poll() is not None or (done.is_set() and len(latencies) < requests):
+            return f'el servidor termino (codigo {proc.poll()}) tras {len(latencies)} respuestas'
+        if sent_at and time.perf_counter() - last_response[0] > timeout:
+            return f'sin respuestas en {timeout:.0f}s ({len(latencies)} de {requests} recibidas)'
+        return None
+
+    reader = threading.Thread(target=read_responses, daemon=True)
+    reader.start()
+
+    failed = None
+    started = time.perf_counter()
+    for number in range(requests):
+        while failed is None and not in_flight.acquire(timeout=1.0):
+            failed = failure()
+        if failed is not None:
+            break
+        request_id = f'q{number}'
+        sent_at[request_id] = time.perf_counter()
+        text = f'como registro la venta numero {number} con descuento'
+        try:
+            proc.stdin.write(json.dumps({'id': request_id, 'command': 'encode-query', 'params': {'text': text}}) + '\n')
+            proc.stdin.flush()
+        except OSError:
+            failed = failure() or 'el servidor cerro stdin'
+            break
+    while failed is None and not done.wait(1.0):
+        failed = failure()
+    if failed is None and len(latencies) < requests:
+        failed = failure()
+    elapsed = time.perf_counter() - started
+
+    memory = proc_memory_mb(proc.pid)
+    try:
+        proc.stdin.write(json.dumps({'id': 'bye', 'command': 'shutdown'}) + '\n')
+        proc.stdin.flush()
+        proc.wait(timeout=30 if failed is None else 5)
+    except (OSError, subprocess.TimeoutExpired):
+        proc.kill()
+        proc.wait()
+
+    latencies.sort()
+
+    def pick(quantile: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(quantile * len(latencies)))], 2) if latencies else None
+
+    result = {
+        'workers': workers,
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'qps': round(len(latencies) / elapsed, 1) if elapsed > 0 and failed is None else None,
+        'latencyMs': {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)},
+        'errors': errors[0],
+        'memory': memory,
+    }
+    if failed is not None:
+        result['failed'] = failed
+        print(f'workers={workers}: {failed}', file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de carga de help_embeddings.py server')
+    parser.add_argument('--workers', default='1,2,4', help='Numero de workers a probar, separados por coma')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32, help='Peticiones en vuelo')
+    parser.add_argument('--max-batch', type=int, default=32, help='--max-batch del servidor')
+    parser.add_argument('--backend', default=None, help='--backend del servidor')
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=60.0,
+        help='Segundos sin respuestas tras los que se aborta la carga de un servidor',
+    )
+    args = parser.parse_args()
+
+    server_args = ['--max-batch', str(args.max_batch)]
+    if args.backend:
+        server_args += ['--backend', args.backend]
+
+    report = []
+    for workers in [int(n) for n in args.workers.split(',') if n.strip()]:
+        print(f'workers={workers}...', file=sys.stderr)
+        report.append(run_load(workers, args.requests, args.concurrency, server_args, args.timeout))
+    baseline = report[0]['qps'] if report and report[0]['qps'] else None
+    for result in report:
+        result['speedup'] = round(result['qps'] / baseline, 2) if baseline and result['qps'] else None
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
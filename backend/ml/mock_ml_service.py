@@ -1,45 +1,237 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-HTTP service wrapper around extract_invoice_fields.py for local testing.
+HTTP service wrapper around extract_invoice_fields.py.
 
 Usage:
-  python backend/ml/mock_ml_service.py --port 5055
+  python backend/ml/mock_ml_service.py --port 5055 --workers 8
 
-It accepts POST /extract with the same payload que MlExtractionService envía.
+Endpoints:
+  POST /extract        mismo payload que MlExtractionService envía -> respuesta del heurístico
+  POST /extract/batch  {"items": [payload, ...]} (o un array) -> {"results": [...]} en el mismo orden
+  GET  /metrics        contadores por endpoint/estado, histogramas de latencia y documentos
+  GET  /health         {"status": "ok"}
+
+Usa HTTP/1.1 con keep-alive. Cada conexión tiene su propio hilo (liviano, casi
+siempre bloqueado esperando la siguiente petición) y se cierra tras --keep-alive
+segundos sin peticiones; la extracción en sí queda acotada a --workers
+peticiones simultáneas, así que una conexión inactiva nunca ocupa un cupo.
+Los cuerpos mayores a --max-body-bytes se rechazan con 413 sin leerlos.
 """
 
 import argparse
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Optional
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
 
 from extract_invoice_fields import (
   build_response,
   extract_fields_from_text,
 )
 
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class ServiceMetrics:
+  """Contadores e histogramas de latencia por endpoint, compartidos entre hilos."""
+
+  def __init__(self):
+    self.started_at = time.time()
+    self.in_flight = 0
+    self.connections = 0
+    self.open_connections = 0
+    self.documents = 0
+    self.bytes_in = 0
+    self._endpoints: Dict[str, Dict[str, any]] = {}
+    self._lock = threading.Lock()
+
+  def _endpoint(self, path: str) -> Dict[str, any]:
+    endpoint = self._endpoints.get(path)
+    if endpoint is None:
+      endpoint = {
+        "requests": 0,
+        "status": {},
+        "latencyMsTotal": 0.0,
+        "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+      }
+      self._endpoints[path] = endpoint
+    return endpoint
+
+  def begin(self):
+    with self._lock:
+      self.in_flight += 1
+
+  def record(self, path: str, status: int, latency_ms: float, documents: int = 0, bytes_in: int = 0):
+    bucket = len(LATENCY_BUCKETS_MS)
+    for position, bound in enumerate(LATENCY_BUCKETS_MS):
+      if latency_ms <= bound:
+        bucket = position
+        break
+    with self._lock:
+      self.in_flight -= 1
+      self.documents += documents
+      self.bytes_in += bytes_in
+      endpoint = self._endpoint(path)
+      endpoint["requests"] += 1
+      endpoint["status"][str(status)] = endpoint["status"].get(str(status), 0) + 1
+      endpoint["latencyMsTotal"] += latency_ms
+      endpoint["histogram"][bucket] += 1
+
+  def connection_opened(self):
+    with self._lock:
+      self.connections += 1
+      self.open_connections += 1
+
+  def connection_closed(self):
+    with self._lock:
+      self.open_connections -= 1
+
+  def snapshot(self) -> dict:
+    keys = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+    with self._lock:
+      endpoints = {
+        path: {
+          "requests": data["requests"],
+          "status": dict(data["status"]),
+          "avgLatencyMs": round(data["latencyMsTotal"] / data["requests"], 3) if data["requests"] else 0.0,
+          "latencyMsHistogram": dict(zip(keys, data["histogram"])),
+        }
+        for path, data in self._endpoints.items()
+      }
+      return {
+        "uptimeSec": round(time.time() - self.started_at, 1),
+        "inFlight": self.in_flight,
+        "connections": self.connections,
+        "openConnections": self.open_connections,
+        "documents": self.documents,
+        "bytesIn": self.bytes_in,
+        "endpoints": endpoints,
+      }
+
+
+def extract_payload(payload: dict) -> dict:
+  fields = extract_fields_from_text(payload.get("text") or "")
+  return build_response(payload, fields)
+
+
+def extract_item(item) -> dict:
+  """Un item de /extract/batch: sus errores quedan en su resultado, no tumban el lote."""
+  if not isinstance(item, dict):
+    return {"status": "FAILED", "error": "cada item debe ser un objeto JSON"}
+  try:
+    return extract_payload(item)
+  except Exception as exc:
+    return {"status": "FAILED", "error": str(exc)}
+
+
+class RequestError(Exception):
+  def __init__(self, status: int, message: str):
+    super().__init__(message)
+    self.status = status
+
 
 class ExtractionHandler(BaseHTTPRequestHandler):
-  server_version = "MockInvoiceExtractor/0.1"
+  server_version = "MockInvoiceExtractor/0.2"
+  protocol_version = "HTTP/1.1"  # keep-alive
+  # Cabeceras y cuerpo salen en dos write(): sin TCP_NODELAY, Nagle + delayed ACK
+  # del cliente agregan ~40 ms por respuesta en conexiones keep-alive
+  disable_nagle_algorithm = True
+
+  def setup(self):
+    # Tiempo máximo esperando la siguiente petición en una conexión keep-alive
+    self.timeout = self.server.keep_alive
+    super().setup()
+    self.server.metrics.connection_opened()
+
+  def finish(self):
+    try:
+      super().finish()
+    finally:
+      self.server.metrics.connection_closed()
+
+  def do_GET(self):  # noqa: N802
+    self.handle_request(self.route_get)
 
   def do_POST(self):  # noqa: N802
-    if self.path not in ("/", "/extract"):
-      self.send_error(404, "not found")
-      return
+    self.handle_request(self.route_post)
+
+  def handle_request(self, route):
+    metrics: ServiceMetrics = self.server.metrics
+    path = self.path.split("?", 1)[0].rstrip("/") or "/"
+    started = time.perf_counter()
+    metrics.begin()
+    status, documents, bytes_in = 500, 0, 0
+    try:
+      status, payload, documents, bytes_in = route(path)
+    except RequestError as exc:
+      status, payload = exc.status, {"status": "FAILED", "error": str(exc)}
+    except Exception as exc:
+      payload = {"status": "FAILED", "error": str(exc)}
+    try:
+      self.send_json(payload, status)
+    finally:
+      known = path if path in ("/", "/extract", "/extract/batch", "/metrics", "/health") else "other"
+      metrics.record(known, status, (time.perf_counter() - started) * 1000, documents, bytes_in)
+
+  def route_get(self, path: str):
+    if path == "/metrics":
+      return 200, self.server.metrics.snapshot(), 0, 0
+    if path == "/health":
+      return 200, {"status": "ok"}, 0, 0
+    raise RequestError(404, "not found")
 
-    content_length = int(self.headers.get("Content-Length") or 0)
-    raw_body = self.rfile.read(content_length)
+  def route_post(self, path: str):
+    if path not in ("/", "/extract", "/extract/batch"):
+      # El cuerpo no se lee: cerrar para no dejar bytes en la conexión
+      self.close_connection = True
+      raise RequestError(404, "not found")
 
+    raw_body = self.read_body()
     try:
       payload = json.loads(raw_body.decode("utf-8"))
-    except json.JSONDecodeError:
-      self.send_json({"status": "FAILED", "error": "invalid json"}, status=400)
-      return
+    except (UnicodeDecodeError, json.JSONDecodeError):
+      raise RequestError(400, "invalid json")
 
-    fields = extract_fields_from_text(payload.get("text") or "")
-    result = build_response(payload, fields)
-    self.send_json(result)
+    if path == "/extract/batch":
+      items = payload.get("items") if isinstance(payload, dict) else payload
+      if not isinstance(items, list):
+        raise RequestError(400, "items debe ser una lista")
+      if len(items) > self.server.max_batch_items:
+        raise RequestError(413, f"batch demasiado grande (máximo {self.server.max_batch_items} items)")
+      with self.server.slots:
+        results: List[dict] = [extract_item(item) for item in items]
+      return 200, {"results": results}, len(items), len(raw_body)
+
+    if not isinstance(payload, dict):
+      raise RequestError(400, "el payload debe ser un objeto JSON")
+    with self.server.slots:
+      return 200, extract_payload(payload), 1, len(raw_body)
+
+  def read_body(self) -> bytes:
+    if self.headers.get("Transfer-Encoding"):
+      self.close_connection = True
+      raise RequestError(411, "Content-Length requerido (chunked no soportado)")
+    length_header = self.headers.get("Content-Length")
+    if length_header is None:
+      self.close_connection = True
+      raise RequestError(411, "Content-Length requerido")
+    try:
+      content_length = int(length_header)
+    except ValueError:
+      self.close_connection = True
+      raise RequestError(400, "Content-Length inválido")
+    if content_length < 0:
+      self.close_connection = True
+      raise RequestError(400, "Content-Length inválido")
+    if content_length > self.server.max_body_bytes:
+      # No se lee el cuerpo: la conexión se cierra después de responder
+      self.close_connection = True
+      raise RequestError(413, f"cuerpo demasiado grande (máximo {self.server.max_body_bytes} bytes)")
+    return self.rfile.read(content_length)
 
   def log_message(self, format, *args):  # noqa: A003
     return  # silence default logging
@@ -49,13 +241,62 @@ class ExtractionHandler(BaseHTTPRequestHandler):
     self.send_response(status)
     self.send_header("Content-Type", "application/json; charset=utf-8")
     self.send_header("Content-Length", str(len(body)))
+    if self.close_connection:
+      self.send_header("Connection", "close")
     self.end_headers()
     self.wfile.write(body)
 
 
-def run(host: str, port: int):
-  server = HTTPServer((host, port), ExtractionHandler)
-  print(f"Mock ML service listening on http://{host}:{port}")
+class ExtractionHTTPServer(ThreadingHTTPServer):
+  """
+  Un hilo por conexión (las conexiones keep-alive inactivas solo esperan en
+  recv) y un semáforo de --workers cupos alrededor de la extracción: una
+  conexión ociosa no bloquea a las demás y la CPU no se sobre-suscribe.
+  """
+
+  daemon_threads = True
+  request_queue_size = 128
+
+  def __init__(
+    self,
+    address,
+    handler,
+    workers: int,
+    max_body_bytes: int,
+    max_batch_items: int,
+    keep_alive: float,
+  ):
+    super().__init__(address, handler)
+    self.workers = max(workers, 1)
+    self.max_body_bytes = max_body_bytes
+    self.max_batch_items = max_batch_items
+    self.keep_alive = keep_alive
+    self.metrics = ServiceMetrics()
+    self.slots = threading.BoundedSemaphore(self.workers)
+
+  def handle_error(self, request, client_address):
+    if isinstance(sys.exc_info()[1], (socket.timeout, ConnectionError)):
+      return  # keep-alive vencido o cliente desconectado
+    super().handle_error(request, client_address)
+
+
+def run(
+  host: str,
+  port: int,
+  workers: int = 8,
+  max_body_bytes: int = 10 * 1024 * 1024,
+  max_batch_items: int = 500,
+  keep_alive: float = 5.0,
+):
+  server = ExtractionHTTPServer(
+    (host, port),
+    ExtractionHandler,
+    workers=workers,
+    max_body_bytes=max_body_bytes,
+    max_batch_items=max_batch_items,
+    keep_alive=keep_alive,
+  )
+  print(f"Mock ML service listening on http://{host}:{server.server_address[1]} ({server.workers} workers)", flush=True)
   try:
     server.serve_forever()
   except KeyboardInterrupt:
@@ -68,8 +309,29 @@ def main():
   parser = argparse.ArgumentParser(description="Mock ML extraction service")
   parser.add_argument("--host", default="127.0.0.1")
   parser.add_argument("--port", type=int, default=5055)
+  parser.add_argument("--workers", type=int, default=8, help="Extracciones simultáneas")
+  parser.add_argument(
+    "--max-body-bytes",
+    type=int,
+    default=10 * 1024 * 1024,
+    help="Tamaño máximo del cuerpo de una petición (413 si se supera)",
+  )
+  parser.add_argument("--max-batch-items", type=int, default=500, help="Máximo de payloads en /extract/batch")
+  parser.add_argument(
+    "--keep-alive",
+    type=float,
+    default=5.0,
+    help="Segundos sin peticiones tras los que se cierra una conexión keep-alive",
+  )
   args = parser.parse_args()
-  run(args.host, args.port)
+  run(
+    args.host,
+    args.port,
+    workers=args.workers,
+    max_body_bytes=args.max_body_bytes,
+    max_batch_items=args.max_batch_items,
+    keep_alive=args.keep_alive,
+  )
 
 
 if __name__ == "__main__":
@@ -1,19 +1,335 @@
 #!/usr/bin/env python
 """
 CLI para predecir la plantilla de una factura usando el modelo entrenado.
+
+Modos de uso:
+  --text     — Predice una sola factura y termina.
+  --batch    — Reclasifica en bloque registros JSON por línea desde un
+               archivo o stdin ('-') y emite un resultado por línea.
+  --server   — Modo servidor persistente: carga el modelo una vez y procesa
+               comandos JSON por stdin (una línea por comando). El modelo se
+               recarga automáticamente si cambia el mtime del archivo joblib.
+
+Con --shards-dir (generado por train_template_classifier.py) cada predicción
+usa el modelo de su organización/compañía, cargado bajo demanda en un LRU
+acotado por memoria; si el tenant no tiene shard se usa el modelo global.
 """
 
 import argparse
 import json
+import os
 import pathlib
 import sys
+import time
+from collections import OrderedDict
+
 import joblib
+import numpy as np
+
+from template_tenants import shard_key
+
+
+class TemplateModel:
+  """Mantiene el pipeline cargado y lo recarga cuando el archivo cambia."""
+
+  def __init__(self, model_path: pathlib.Path):
+    self.model_path = model_path
+    self.pipeline = None
+    self.mtime = None
+
+  def get(self):
+    try:
+      mtime = os.stat(self.model_path).st_mtime_ns
+    except FileNotFoundError:
+      return self.pipeline
+
+    if mtime != self.mtime:
+      start = time.perf_counter()
+      try:
+        self.pipeline = joblib.load(self.model_path)
+      except Exception as exc:
+        # Puede estar a medio escribir por el entrenamiento: conservar el anterior.
+        print(f'No se pudo cargar {self.model_path}: {exc}', file=sys.stderr)
+        return self.pipeline
+      self.mtime = mtime
+      elapsed = (time.perf_counter() - start) * 1000
+      print(f'Modelo cargado desde {self.model_path} ({elapsed:.0f} ms)', file=sys.stderr)
+    return self.pipeline
+
+
+class ShardedTemplateModel:
+  """
+  Modelo global + modelos por tenant cargados bajo demanda. Los shards cargados
+  se mantienen en un LRU acotado por max_bytes (tamaño del joblib en disco como
+  estimación de memoria); el shard recién usado nunca se descarta.
+  """
+
+  def __init__(self, global_model: TemplateModel, shards_dir=None, max_bytes: int = 0):
+    self.global_model = global_model
+    self.shards_dir = pathlib.Path(shards_dir) if shards_dir else None
+    self.max_bytes = max_bytes
+    self.index = {}
+    self.index_mtime = None
+    self.shards = OrderedDict()
+    self.shard_sizes = {}
+
+  def get(self, organization_id=None, company_id=None):
+    if self.shards_dir is not None:
+      self._refresh_index()
+      key = shard_key(organization_id, company_id)
+      entry = self.index.get(key)
+      if entry:
+        pipeline = self._get_shard(key, entry)
+        if pipeline is not None:
+          return pipeline
+    return self.global_model.get()
+
+  def _refresh_index(self):
+    index_path = self.shards_dir / 'index.json'
+    try:
+      mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+      self.index = {}
+      self.index_mtime = None
+      return
+    if mtime == self.index_mtime:
+      return
+    try:
+      with index_path.open('r', encoding='utf-8') as fh:
+        self.index = json.load(fh).get('shards', {})
+      self.index_mtime = mtime
+    except (OSError, ValueError) as exc:
+      print(f'No se pudo leer {index_path}: {exc}', file=sys.stderr)
+
+  def _get_shard(self, key: str, entry: dict):
+    shard_path = self.shards_dir / entry['file']
+    model = self.shards.get(key)
+    if model is None or model.model_path != shard_path:
+      if not shard_path.exists():
+        return None
+      model = TemplateModel(shard_path)
+      self.shards[key] = model
+    self.shards.move_to_end(key)
+
+    pipeline = model.get()
+    try:
+      self.shard_sizes[key] = os.path.getsize(shard_path)
+    except OSError:
+      self.shard_sizes[key] = 0
+    self._evict()
+    return pipeline
+
+  def _evict(self):
+    while len(self.shards) > 1 and sum(self.shard_sizes.values()) > self.max_bytes:
+      key, _ = self.shards.popitem(last=False)
+      self.shard_sizes.pop(key, None)
+
+
+def select_templates(classes, probs, candidates_list: list, threshold: float) -> list:
+  """
+  Elige la mejor plantilla por fila enmascarando con NumPy las clases que no
+  están entre los candidatos de cada factura (lista vacía = todas).
+  """
+  class_index = {str(c): j for j, c in enumerate(classes)}
+  mask = np.ones(probs.shape, dtype=bool)
+  rows = []
+  cols = []
+  for row, candidates in enumerate(candidates_list):
+    if not candidates:
+      continue
+    mask[row] = False
+    for candidate in candidates:
+      col = class_index.get(str(candidate))
+      if col is not None:
+        rows.append(row)
+        cols.append(col)
+  if rows:
+    mask[rows, cols] = True
+
+  masked = np.where(mask, probs, 0.0)
+  best = masked.argmax(axis=1)
+  scores = masked[np.arange(len(best)), best]
+  accepted = (scores > 0) & (scores >= threshold)
+
+  template_nums = []
+  for template_id in classes:
+    try:
+      template_nums.append(int(template_id))
+    except ValueError:
+      template_nums.append(None)
+
+  return [
+    {'templateId': template_nums[col], 'score': float(score)} if ok else {}
+    for col, score, ok in zip(best, scores, accepted)
+  ]
+
+
+def predict_many(pipeline, items: list, threshold: float) -> list:
+  """
+  Predice varias facturas con una sola llamada a predict_proba.
+  Cada item es {"text": str, "candidates": [int, ...]}.
+  """
+  results = [{} for _ in items]
+  if pipeline is None:
+    return results
+
+  texts = []
+  positions = []
+  for index, item in enumerate(items):
+    text = (item.get('text') or '').strip()
+    if text:
+      texts.append(text)
+      positions.append(index)
+  if not texts:
+    return results
+
+  probs = pipeline.predict_proba(texts)
+  selected = select_templates(
+    pipeline.classes_,
+    probs,
+    [items[position].get('candidates') or [] for position in positions],
+    threshold,
+  )
+  for position, result in zip(positions, selected):
+    results[position] = result
+  return results
+
+
+def predict_routed(model: ShardedTemplateModel, items: list, threshold: float) -> list:
+  """Agrupa los items por el modelo de su tenant y predice cada grupo en bloque."""
+  results = [{} for _ in items]
+  pipelines = {}
+  groups = {}
+  for index, item in enumerate(items):
+    tenant = (item.get('organizationId'), item.get('companyId'))
+    if tenant not in pipelines:
+      pipelines[tenant] = model.get(*tenant)
+    pipeline = pipelines[tenant]
+    groups.setdefault(id(pipeline), (pipeline, []))[1].append(index)
+
+  for pipeline, indices in groups.values():
+    predictions = predict_many(pipeline, [items[i] for i in indices], threshold)
+    for index, result in zip(indices, predictions):
+      results[index] = result
+  return results
+
+
+def read_records(stream):
+  for line in stream:
+    line = line.strip()
+    if not line:
+      continue
+    try:
+      record = json.loads(line)
+      if not isinstance(record, dict):
+        raise ValueError('cada registro debe ser un objeto JSON')
+      yield record, None
+    except ValueError as exc:
+      yield None, str(exc)
+
+
+def batch_mode(model: ShardedTemplateModel, source: str, threshold: float, batch_size: int):
+  """
+  Reclasifica muchas facturas en bloque. Lee registros JSON por línea
+  ({"id", "text", "candidates", "organizationId"?, "companyId"?}) desde un archivo o stdin
+  ('-') y escribe un resultado por línea ({"id": ..., "result": {...}}) a
+  medida que se procesa cada bloque de batch_size registros.
+  """
+  stream = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
+  model.global_model.get()
+  total = 0
+  start = time.perf_counter()
+
+  def flush(entries):
+    records = [record for record, error in entries if error is None]
+    results = iter(predict_routed(model, records, threshold))
+    for record, error in entries:
+      if error is not None:
+        response = {'id': None, 'error': f'JSON invalido: {error}'}
+      else:
+        response = {'id': record.get('id'), 'result': next(results)}
+      sys.stdout.write(json.dumps(response) + '\n')
+    sys.stdout.flush()
+
+  try:
+    pending = []
+    for record, error in read_records(stream):
+      pending.append((record, error))
+      if error is None:
+        total += 1
+      if len(pending) >= batch_size:
+        flush(pending)
+        pending = []
+    if pending:
+      flush(pending)
+  finally:
+    if stream is not sys.stdin:
+      stream.close()
+
+  elapsed = time.perf_counter() - start
+  rate = total / elapsed if elapsed > 0 else 0.0
+  print(
+    f'{total} documentos clasificados en {elapsed:.2f} s ({rate:.1f} docs/s)',
+    file=sys.stderr,
+  )
+
+
+def server_mode(model: ShardedTemplateModel, default_threshold: float):
+  """
+  Modo servidor: mantiene el modelo en memoria y procesa comandos desde stdin.
+
+  Formato de comando (una línea JSON por comando):
+  {"id": "uuid", "command": "predict", "params": {"text": "...", "candidates": [1, 2]}}
+  {"id": "uuid", "command": "predict-batch", "params": {"items": [{"text": "...", "candidates": [...]}]}}
+  Ambos aceptan "threshold" opcional en params; cada texto/item puede traer
+  "organizationId" y "companyId" para usar el shard de su tenant.
+
+  Formato de respuesta (una línea JSON por respuesta):
+  {"id": "uuid", "result": {"templateId": 1, "score": 0.78}}   ({} si no hay coincidencia)
+  {"id": "uuid", "result": [{...}, {...}]}                      (predict-batch)
+  {"id": "uuid", "error": "mensaje de error"}
+  """
+  model.global_model.get()
+  print(
+    json.dumps({'status': 'ready', 'modelLoaded': model.global_model.pipeline is not None}),
+    flush=True,
+  )
+
+  for line in sys.stdin:
+    line = line.strip()
+    if not line:
+      continue
+
+    request_id = 'unknown'
+    try:
+      request = json.loads(line)
+      request_id = request.get('id', 'unknown')
+      command = request.get('command')
+      params = request.get('params') or {}
+      threshold = float(params.get('threshold', default_threshold))
+
+      if command == 'predict':
+        result = predict_routed(model, [params], threshold)[0]
+      elif command == 'predict-batch':
+        items = params.get('items') or []
+        if not isinstance(items, list):
+          raise ValueError('items debe ser una lista')
+        result = predict_routed(model, items, threshold)
+      else:
+        raise ValueError(f'Unknown command: {command}')
+      response = {'id': request_id, 'result': result}
+    except json.JSONDecodeError as exc:
+      response = {'id': request_id, 'error': f'JSON parse error: {exc}'}
+    except Exception as exc:
+      response = {'id': request_id, 'error': str(exc)}
+
+    print(json.dumps(response), flush=True)
 
 
 def main():
   parser = argparse.ArgumentParser(description='Predecir plantilla de factura.')
   parser.add_argument('--model', required=True, help='Ruta al modelo joblib.')
-  parser.add_argument('--text', required=True, help='Texto plano del comprobante.')
+  parser.add_argument('--text', help='Texto plano del comprobante.')
   parser.add_argument(
     '--candidate',
     action='append',
@@ -27,51 +343,72 @@ def main():
     default=0.35,
     help='Umbral mínimo de confianza para aceptar la predicción.',
   )
+  parser.add_argument(
+    '--server',
+    action='store_true',
+    help='Modo servidor persistente (JSON por linea en stdin/stdout).',
+  )
+  parser.add_argument(
+    '--batch',
+    metavar='PATH',
+    help="Archivo JSONL con {id, text, candidates} por linea ('-' para stdin).",
+  )
+  parser.add_argument(
+    '--batch-size',
+    type=int,
+    default=256,
+    help='Registros por llamada a predict_proba en modo --batch.',
+  )
+  parser.add_argument(
+    '--shards-dir',
+    help='Directorio con modelos por tenant (index.json de train_template_classifier.py).',
+  )
+  parser.add_argument(
+    '--shard-cache-mb',
+    type=float,
+    default=256,
+    help='Memoria maxima (MB) para shards cargados antes de descartar los menos usados.',
+  )
+  parser.add_argument('--organization-id', type=int, help='Organizacion de la factura.')
+  parser.add_argument('--company-id', type=int, help='Compañia de la factura.')
   args = parser.parse_args()
 
   model_path = pathlib.Path(args.model)
+  model = ShardedTemplateModel(
+    TemplateModel(model_path),
+    args.shards_dir,
+    int(args.shard_cache_mb * 1024 * 1024),
+  )
+  if args.server:
+    server_mode(model, args.threshold)
+    return
+
+  if args.batch:
+    if not model_path.exists():
+      raise SystemExit(f'Modelo no encontrado: {model_path}')
+    batch_mode(model, args.batch, args.threshold, max(args.batch_size, 1))
+    return
+
+  if args.text is None:
+    parser.error('--text es obligatorio salvo en modo --server o --batch')
+
   if not model_path.exists():
     print(json.dumps({}), end='')
     sys.exit(0)
 
-  pipeline = joblib.load(model_path)
   text = args.text.strip()
   if not text:
     print(json.dumps({}), end='')
     sys.exit(0)
 
-  classes = pipeline.classes_
-  probs = pipeline.predict_proba([text])[0]
-
-  candidates = set(str(c) for c in args.candidate) if args.candidate else set(classes)
-  best_template = None
-  best_score = 0.0
-
-  for template_id, prob in zip(classes, probs):
-    if str(template_id) not in candidates:
-      continue
-    if prob > best_score:
-      best_template = template_id
-      best_score = prob
-
-  if best_template is None or best_score < args.threshold:
-    print(json.dumps({}), end='')
-    return
-
-  try:
-    template_num = int(best_template)
-  except ValueError:
-    template_num = None
-
-  print(
-    json.dumps(
-      {
-        'templateId': template_num,
-        'score': float(best_score),
-      }
-    ),
-    end='',
-  )
+  item = {
+    'text': text,
+    'candidates': args.candidate,
+    'organizationId': args.organization_id,
+    'companyId': args.company_id,
+  }
+  result = predict_routed(model, [item], args.threshold)[0]
+  print(json.dumps(result), end='')
 
 
 if __name__ == '__main__':
@@ -2,35 +2,107 @@
 # -*- coding: utf-8 -*-
 """
 Redacts sensitive numeric sequences inside a PDF by overlaying white rectangles.
+
+The redacted PDF is stored in the shared result cache (result_cache.py) keyed by
+the source PDF hash and the redaction pattern, so re-submitting the same file
+copies the cached output instead of redacting again (--no-cache disables it).
+
+With --json the same single pass also emits, as JSON on stdout, the redacted
+plain text (the input extract_invoice_fields.py expects) and per-page word boxes,
+so callers do not have to open and parse the redacted PDF again:
+
+  {"output": "...", "redactions": 3, "redactedHash": "...", "cached": false,
+   "text": "...", "pages": [{"number": 1, "width": 595.0, "height": 842.0,
+                             "text": "...", "words": [[x0, y0, x1, y1, "word"], ...]}]}
 """
 
 import argparse
+import hashlib
+import json
 import re
+import shutil
 from pathlib import Path
+from typing import Any, Dict, Optional
 
 try:
-    import fitz  # PyMuPDF
-except ImportError as exc:
-    raise SystemExit("PyMuPDF is required: pip install pymupdf") from exc
+    # PyMuPDF >= 1.24 prints a deprecation notice to stdout on 'import fitz'
+    import pymupdf as fitz
+except ImportError:
+    try:
+        import fitz  # PyMuPDF < 1.24
+    except ImportError as exc:
+        raise SystemExit("PyMuPDF is required: pip install pymupdf") from exc
 
+from result_cache import ResultCache, default_cache, file_hash
 
 PATTERN = re.compile(r"\b\d{8,}\b")
+REDACTION_VERSION = f"redact-v3:{PATTERN.pattern}"
 
 
-def redact_pdf(input_path: Path, output_path: Path) -> None:
+def redact_document(input_path: Path, output_path: Path, cache: Optional[ResultCache] = None) -> Dict[str, Any]:
+    """
+    Open the PDF once and produce the redacted PDF plus its plain text and
+    per-page word boxes. Text and words are read back from each page after
+    apply_redactions(), so they are exactly what an extractor would get from the
+    redacted file (apply_redactions also drops neighbouring glyphs whose boxes
+    touch a redaction rect, and the line layout changes around removed words).
+    """
+    key = None
+    if cache is not None:
+        key = cache.key(file_hash(input_path), REDACTION_VERSION)
+        cached = cache.get(key)
+        blob = cache.get_blob(key) if cached is not None else None
+        if blob is not None:
+            try:
+                shutil.copyfile(blob, output_path)
+                return dict(cached, output=str(output_path), cached=True)
+            except OSError:
+                pass  # evicted between get and copy: redact again
+
+    pages = []
+    redactions = 0
     doc = fitz.open(input_path)
     for page in doc:
         words = page.get_text("words")  # list of tuples (x0, y0, x1, y1, word, block_no, line_no, word_no)
-        rects = []
-        for word in words:
-            if PATTERN.search(word[4]):
-                rect = fitz.Rect(word[0], word[1], word[2], word[3])
-                rects.append(rect)
+        rects = [
+            fitz.Rect(word[0], word[1], word[2], word[3])
+            for word in words
+            if PATTERN.search(word[4])
+        ]
         if rects:
+            redactions += len(rects)
             for rect in rects:
                 page.add_redact_annot(rect, fill=(1, 1, 1))
             page.apply_redactions()
-    doc.save(output_path, deflate=True)
+            words = page.get_text("words")  # re-read: the redaction changed the page content
+        pages.append({
+            "number": page.number + 1,
+            "width": round(page.rect.width, 2),
+            "height": round(page.rect.height, 2),
+            "text": page.get_text(),
+            "words": [
+                [round(word[0], 2), round(word[1], 2), round(word[2], 2), round(word[3], 2), word[4]]
+                for word in words
+            ],
+        })
+    pdf_bytes = doc.tobytes(deflate=True)
+    doc.close()
+    with open(output_path, "wb") as fh:
+        fh.write(pdf_bytes)
+
+    result = {
+        "redactions": redactions,
+        "redactedHash": hashlib.sha256(pdf_bytes).hexdigest(),
+        "text": "\n\n".join(page["text"] for page in pages),
+        "pages": pages,
+    }
+    if key is not None:
+        cache.put(key, result, blob=pdf_bytes)
+    return dict(result, output=str(output_path), cached=False)
+
+
+def redact_pdf(input_path: Path, output_path: Path, cache: Optional[ResultCache] = None) -> None:
+    redact_document(input_path, output_path, cache)
 
 
 def main():
@@ -41,6 +113,16 @@ def main():
         "-o",
         help="Destination path for the redacted PDF (defaults to <tmpdir>/<name>.redacted.pdf)",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the shared result cache (ML_RESULT_CACHE_DIR)",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print redacted text and word boxes as JSON instead of only the output path",
+    )
     args = parser.parse_args()
 
     input_path = Path(args.input)
@@ -54,7 +136,13 @@ def main():
         base = input_path.stem
         output_path = input_path.parent / f"{base}.redacted{suffix}"
 
-    redact_pdf(input_path, output_path)
+    cache = default_cache(enabled=not args.no_cache)
+    if args.json:
+        result = redact_document(input_path, output_path, cache)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    redact_pdf(input_path, output_path, cache)
     print(str(output_path))
 
 
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cache en disco de resultados compartida por los scripts de extracción
+(extract_invoice_fields.py, donut_inference.py, redact_pdf.py).
+
+La clave es hash del contenido + versión del modelo/heurístico, así que un
+documento re-enviado sin cambios devuelve el resultado guardado y cualquier
+cambio de versión invalida las entradas viejas sin borrarlas a mano. Cada
+entrada es un JSON (y opcionalmente un blob, p. ej. el PDF redactado):
+
+  <dir>/<ab>/<clave>.json
+  <dir>/<ab>/<clave>.bin
+
+Es segura entre procesos: se escribe en un temporal y se publica con
+os.replace (nadie lee un archivo a medias) y una lectura que falla cuenta como
+miss. El tamaño total se acota con desalojo LRU por mtime (cada hit lo
+actualiza); el recorte lo hace un solo proceso a la vez (flock en POSIX) y a
+lo sumo cada PRUNE_INTERVAL_SECONDS entre todos los procesos: la hora del
+último recorte es el mtime de <dir>/.last-prune, así un proceso por factura no
+recorre el árbol entero en cada escritura.
+
+Variables de entorno:
+  ML_RESULT_CACHE_DIR  directorio (por defecto backend/ml/cache/results)
+  ML_RESULT_CACHE_MB   tamaño máximo en MB (por defecto 256)
+  ML_RESULT_CACHE      "0"/"off" desactiva la cache
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+  import fcntl
+except ImportError:  # Windows: el recorte no se serializa entre procesos
+  fcntl = None
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_CACHE_DIR = SCRIPT_DIR / "cache" / "results"
+DEFAULT_CACHE_MB = 256
+PRUNE_INTERVAL_SECONDS = 60
+
+
+def text_hash(text: str) -> str:
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(file_path: Path) -> str:
+  digest = hashlib.sha256()
+  with open(file_path, "rb") as fh:
+    for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _write_atomic(path: Path, data: bytes):
+  temporary = path.with_name(f".{path.name}.{os.getpid()}.{time.monotonic_ns()}")
+  try:
+    with open(temporary, "wb") as fh:
+      fh.write(data)
+    os.replace(temporary, path)
+  finally:
+    if temporary.exists():
+      temporary.unlink()
+
+
+class ResultCache:
+  def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_mb: int = DEFAULT_CACHE_MB):
+    self.root = Path(cache_dir)
+    self.max_bytes = max_mb * 1024 * 1024
+    self.hits = 0
+    self.misses = 0
+    self._written = 0
+    self._checked_at: Optional[float] = None
+
+  @staticmethod
+  def key(content_hash: str, version: str) -> str:
+    return hashlib.sha256(f"{content_hash}\n{version}".encode("utf-8")).hexdigest()
+
+  def _path(self, key: str, suffix: str) -> Path:
+    return self.root / key[:2] / f"{key}{suffix}"
+
+  def get(self, key: str) -> Optional[Dict[str, Any]]:
+    path = self._path(key, ".json")
+    try:
+      with open(path, "rb") as fh:
+        value = json.loads(fh.read())
+      os.utime(path)  # uso reciente para el LRU
+    except (OSError, ValueError):
+      self.misses += 1
+      return None
+    self.hits += 1
+    return value
+
+  def get_blob(self, key: str) -> Optional[Path]:
+    """Ruta del blob de la entrada, si existe (copiarlo antes de usarlo: puede desalojarse)."""
+    path = self._path(key, ".bin")
+    return path if path.is_file() else None
+
+  def put(self, key: str, value: Dict[str, Any], blob: Optional[bytes] = None):
+    path = self._path(key, ".json")
+    try:
+      path.parent.mkdir(parents=True, exist_ok=True)
+      data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+      # El blob va primero: quien ve el JSON encuentra el blob completo
+      if blob is not None:
+        _write_atomic(self._path(key, ".bin"), blob)
+      _write_atomic(path, data)
+    except OSError:
+      return  # la cache nunca debe romper la extracción
+    self._written += len(data) + len(blob or b"")
+    if self._written > self.max_bytes // 20 or self._prune_due():
+      self.prune()
+
+  def _prune_due(self) -> bool:
+    """Si pasó PRUNE_INTERVAL_SECONDS desde el último recorte de cualquier proceso (un stat por intervalo)."""
+    now = time.monotonic()
+    if self._checked_at is not None and now - self._checked_at < PRUNE_INTERVAL_SECONDS:
+      return False
+    self._checked_at = now
+    try:
+      last_prune = (self.root / ".last-prune").stat().st_mtime
+    except OSError:
+      last_prune = 0.0  # nunca se recortó
+    return time.time() - last_prune > PRUNE_INTERVAL_SECONDS
+
+  def prune(self):
+    """Borra las entradas menos usadas hasta quedar bajo max_bytes."""
+    self._checked_at = time.monotonic()
+    self._written = 0
+    if not self.root.is_dir():
+      return
+    lock = None
+    try:
+      if fcntl is not None:
+        lock = open(self.root / ".prune.lock", "w")
+        try:
+          fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+          return  # otro proceso está recortando
+      # Marca antes de recorrer: los demás procesos no vuelven a recortar en este intervalo
+      try:
+        (self.root / ".last-prune").touch()
+      except OSError:
+        pass
+      entries = {}
+      total = 0
+      for folder in self.root.iterdir():
+        if not folder.is_dir():
+          continue
+        for item in os.scandir(folder):
+          if item.name.startswith("."):
+            continue
+          try:
+            stat = item.stat()
+          except OSError:
+            continue
+          stem = item.name.rsplit(".", 1)[0]
+          mtime, size, paths = entries.get(stem, (0.0, 0, []))
+          if item.name.endswith(".json"):
+            mtime = stat.st_mtime
+          entries[stem] = (mtime, size + stat.st_size, paths + [item.path])
+          total += stat.st_size
+      for _, size, paths in sorted(entries.values()):
+        if total <= self.max_bytes:
+          break
+        for path in sorted(paths, key=lambda item: not item.endswith(".json")):
+          try:
+            os.unlink(path)  # primero el JSON: la entrada deja de existir antes que su blob
+          except OSError:
+            pass
+        total -= size
+    finally:
+      if lock is not None:
+        lock.close()
+
+  def stats(self) -> Dict[str, Any]:
+    return {"dir": str(self.root), "hits": self.hits, "misses": self.misses}
+
+
+def default_cache(enabled: bool = True) -> Optional[ResultCache]:
+  """La cache configurada por entorno, o None si está desactivada."""
+  if not enabled or os.environ.get("ML_RESULT_CACHE", "").lower() in ("0", "off", "false", "no"):
+    return None
+  cache_dir = os.environ.get("ML_RESULT_CACHE_DIR") or DEFAULT_CACHE_DIR
+  try:
+    max_mb = int(os.environ.get("ML_RESULT_CACHE_MB") or DEFAULT_CACHE_MB)
+  except ValueError:
+    max_mb = DEFAULT_CACHE_MB
+  return ResultCache(Path(cache_dir), max_mb)
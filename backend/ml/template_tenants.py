@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+"""
+Clave de tenant (organización/compañía) compartida por train_template_classifier.py
+(métricas por tenant y nombres de shard en index.json) y predict_template.py
+(ruteo de cada predicción a su shard).
+"""
+
+from typing import Tuple
+
+
+def tenant_parts(organization_id, company_id) -> Tuple[str, str]:
+  org = 'null' if organization_id is None else str(organization_id)
+  comp = 'null' if company_id is None else str(company_id)
+  return f'org:{org}', f'comp:{comp}'
+
+
+def shard_key(organization_id, company_id) -> str:
+  return '|'.join(tenant_parts(organization_id, company_id))
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 """
 Train a TF-IDF + Logistic Regression classifier for invoice templates.
+
+With --shards-dir it also trains one model per organization/company (when the
+tenant has enough samples and at least two templates) plus an index.json that
+predict_template.py uses to route each prediction to its tenant shard, keeping
+the global model as fallback.
 """
 
 import argparse
@@ -16,6 +21,8 @@ from sklearn.metrics import accuracy_score, classification_report
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
 
+from template_tenants import shard_key, tenant_parts
+
 
 def load_dataset(path: pathlib.Path) -> List[dict]:
   with path.open('r', encoding='utf-8') as fh:
@@ -48,6 +55,17 @@ def main():
     default=0.2,
     help='Proporcion del dataset usada para pruebas.',
   )
+  parser.add_argument(
+    '--shards-dir',
+    default=None,
+    help='Directorio donde guardar modelos por organizacion/compañia (opcional).',
+  )
+  parser.add_argument(
+    '--min-shard-samples',
+    type=int,
+    default=20,
+    help='Muestras minimas de un tenant para entrenar su propio modelo.',
+  )
   args = parser.parse_args()
 
   dataset_path = pathlib.Path(args.dataset)
@@ -73,26 +91,7 @@ def main():
   X_train = [texts[i] for i in train_idx]
   X_test = [texts[i] for i in test_idx]
 
-  pipeline = Pipeline(
-    steps=[
-      (
-        'tfidf',
-        TfidfVectorizer(
-          lowercase=True,
-          strip_accents='unicode',
-          token_pattern=r'(?u)\b\w+\b',
-        ),
-      ),
-      (
-        'clf',
-        LogisticRegression(
-          max_iter=1000,
-          multi_class='auto',
-        ),
-      ),
-    ]
-  )
-
+  pipeline = build_pipeline()
   pipeline.fit(X_train, y_train)
   preds = pipeline.predict(X_test)
 
@@ -113,6 +112,17 @@ def main():
     'dataset_distribution': build_tenant_distribution(samples),
   }
 
+  if args.shards_dir:
+    metrics['shards'] = train_shards(
+      samples,
+      texts,
+      labels,
+      train_idx,
+      test_idx,
+      pathlib.Path(args.shards_dir),
+      args.min_shard_samples,
+    )
+
   metrics_path.parent.mkdir(parents=True, exist_ok=True)
   with metrics_path.open('w', encoding='utf-8') as fh:
     json.dump(metrics, fh, indent=2, ensure_ascii=False)
@@ -121,14 +131,93 @@ def main():
   print(f'Precision: {accuracy:.4f}')
   print(f'Modelo guardado en: {output_path}')
   print(f'Metricas guardadas en: {metrics_path}')
+  if args.shards_dir:
+    print(f'Modelos por tenant: {len(metrics["shards"])} en {args.shards_dir}')
+
+
+def build_pipeline() -> Pipeline:
+  return Pipeline(
+    steps=[
+      (
+        'tfidf',
+        TfidfVectorizer(
+          lowercase=True,
+          strip_accents='unicode',
+          token_pattern=r'(?u)\b\w+\b',
+        ),
+      ),
+      (
+        'clf',
+        LogisticRegression(
+          max_iter=1000,
+          multi_class='auto',
+        ),
+      ),
+    ]
+  )
+
+
+def train_shards(
+  samples: List[dict],
+  texts: List[str],
+  labels: List[str],
+  train_idx: List[int],
+  test_idx: List[int],
+  shards_dir: pathlib.Path,
+  min_samples: int,
+) -> List[dict]:
+  """
+  Entrena un modelo por tenant con el mismo split train/test que el modelo
+  global y escribe index.json. Los tenants sin datos suficientes usan el global.
+  """
+  by_tenant: dict[str, dict] = defaultdict(lambda: {'train': [], 'test': []})
+  for split, indices in (('train', train_idx), ('test', test_idx)):
+    for index in indices:
+      sample = samples[index]
+      key = shard_key(sample.get('organizationId'), sample.get('companyId'))
+      by_tenant[key][split].append(index)
+
+  shards_dir.mkdir(parents=True, exist_ok=True)
+  index: dict[str, dict] = {}
+  results: List[dict] = []
+  for key, split in sorted(by_tenant.items()):
+    train_labels = [labels[i] for i in split['train']]
+    if len(split['train']) + len(split['test']) < min_samples or len(set(train_labels)) < 2:
+      continue
+
+    shard = build_pipeline()
+    shard.fit([texts[i] for i in split['train']], train_labels)
+    accuracy = None
+    if split['test']:
+      preds = shard.predict([texts[i] for i in split['test']])
+      accuracy = accuracy_score([labels[i] for i in split['test']], preds)
+
+    sample = samples[split['train'][0]]
+    file_name = key.replace(':', '-').replace('|', '_') + '.joblib'
+    joblib.dump(shard, shards_dir / file_name)
+    entry = {
+      'organizationId': sample.get('organizationId'),
+      'companyId': sample.get('companyId'),
+      'file': file_name,
+      'templates': sorted(set(train_labels)),
+      'train_size': len(split['train']),
+      'test_size': len(split['test']),
+      'accuracy': accuracy,
+    }
+    index[key] = entry
+    results.append(entry)
+
+  # index.json se escribe al final para que el predictor no vea shards a medias.
+  index_path = shards_dir / 'index.json'
+  tmp_path = shards_dir / 'index.json.tmp'
+  with tmp_path.open('w', encoding='utf-8') as fh:
+    json.dump({'shards': index}, fh, indent=2, ensure_ascii=False)
+  tmp_path.replace(index_path)
+  return results
 
 
 def tenant_key(sample: dict) -> Tuple[str, str]:
-  org = sample.get('organizationId')
-  company = sample.get('companyId')
-  org_part = 'org:' + (str(org) if org is not None else 'null')
-  comp_part = 'comp:' + (str(company) if company is not None else 'null')
-  return org_part, comp_part
+  return tenant_parts(sample.get('organizationId'), sample.get('companyId'))
 
 
 def build_tenant_distribution(samples: List[dict]) -> List[dict]:
@@ -3,10 +3,13 @@ B.4 - Product Category Classifier
 Auto-suggests category when creating a new product.
 
 Uses TF-IDF + LinearSVC pipeline (scikit-learn, CPU).
+Product names are tokenized once (cached on disk by text hash between runs)
+and the resulting term counts are shared by cross-validation and the final fit.
 
 Input: exports/products/products_categories.csv
 Output: models/products/category_classifier.pkl
         models/products/category_map.json
+Cache: cache/products/tokens-<config>.joblib
 
 Usage: python train_product_classifier.py
 """
@@ -14,19 +17,32 @@ Usage: python train_product_classifier.py
 import os
 import sys
 import json
+import hashlib
 
 import pandas as pd
 import numpy as np
 import joblib
+from sklearn.base import BaseEstimator, TransformerMixin
 
 SCRIPT_DIR = os.path.dirname(__file__)
 EXPORTS_DIR = os.path.join(SCRIPT_DIR, "..", "exports", "products")
 MODELS_DIR = os.path.join(SCRIPT_DIR, "..", "models", "products")
+CACHE_DIR = os.path.join(SCRIPT_DIR, "..", "cache", "products")
 
 os.makedirs(MODELS_DIR, exist_ok=True)
 
 MIN_CATEGORY_SAMPLES = 3  # Minimum products per category to include
 
+# Common noise words in Spanish product names
+NOISE_TOKENS = ["unid", "und", "pza", "paq", "cja", "x "]
+
+TFIDF_PARAMS = {
+    "ngram_range": (1, 2),
+    "sublinear_tf": True,
+    "strip_accents": "unicode",
+}
+MAX_FEATURES = 5000
+
 
 def load_data() -> pd.DataFrame:
     path = os.path.join(EXPORTS_DIR, "products_categories.csv")
@@ -41,15 +57,126 @@ def preprocess_text(text: str) -> str:
     if pd.isna(text):
         return ""
     text = str(text).lower().strip()
-    # Remove common noise words in Spanish product names
-    for noise in ["unid", "und", "pza", "paq", "cja", "x "]:
+    for noise in NOISE_TOKENS:
         text = text.replace(noise, " ")
     return " ".join(text.split())
 
 
+def preprocess_series(names: pd.Series) -> pd.Series:
+    """Vectorized preprocess_text over a whole column (same output per row)."""
+    text = names.fillna("").astype(str).str.lower().str.strip()
+    for noise in NOISE_TOKENS:
+        text = text.str.replace(noise, " ", regex=False)
+    return text.str.split().str.join(" ")
+
+
+def _identity(tokens):
+    return tokens
+
+
+def tokenize_cached(texts) -> list:
+    """
+    Run the TF-IDF analyzer (accent stripping, lowercasing, 1-2 grams) once per
+    distinct text, memoized on disk by text hash so unchanged products are not
+    re-tokenized on the next run. Only the current texts are kept in the cache.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(**TFIDF_PARAMS)
+    analyzer = vectorizer.build_analyzer()
+    config = json.dumps(
+        {
+            "ngram_range": vectorizer.ngram_range,
+            "strip_accents": vectorizer.strip_accents,
+            "lowercase": vectorizer.lowercase,
+            "token_pattern": vectorizer.token_pattern,
+        },
+        sort_keys=True,
+    )
+    config_key = hashlib.sha1(config.encode("utf-8")).hexdigest()[:12]
+    cache_path = os.path.join(CACHE_DIR, f"tokens-{config_key}.joblib")
+
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            cache = joblib.load(cache_path)
+        except Exception as e:
+            print(f"WARNING: Ignoring unreadable token cache ({e})")
+
+    keys = [hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts]
+    tokens = {}
+    misses = 0
+    for key, text in zip(keys, texts):
+        if key in tokens:
+            continue
+        if key in cache:
+            tokens[key] = cache[key]
+        else:
+            tokens[key] = analyzer(text)
+            misses += 1
+
+    print(f"Token cache: {len(tokens) - misses} hits, {misses} misses")
+    if misses or len(cache) != len(tokens):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        joblib.dump(tokens, cache_path)
+
+    return [tokens[key] for key in keys]
+
+
+def build_count_matrix(tokens: list):
+    """Term counts over the full corpus (columns in sorted vocabulary order)."""
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    counter = CountVectorizer(analyzer=_identity)
+    X = counter.fit_transform(tokens)
+    return X, counter.get_feature_names_out()
+
+
+class TopTermsSelector(BaseEstimator, TransformerMixin):
+    """
+    Keep the max_features most frequent terms present in the fitted rows.
+
+    Applied to the shared corpus count matrix this reproduces what
+    TfidfVectorizer(max_features=...) would select on the same rows, so each
+    CV fold gets its own vocabulary without re-tokenizing.
+    """
+
+    def __init__(self, max_features: int = MAX_FEATURES):
+        self.max_features = max_features
+
+    def fit(self, X, y=None):
+        tfs = np.asarray(X.sum(axis=0)).ravel()
+        present = np.where(tfs > 0)[0]
+        if len(present) > self.max_features:
+            top = (-tfs[present]).argsort()[: self.max_features]
+            present = np.sort(present[top])
+        self.kept_ = present
+        return self
+
+    def transform(self, X):
+        return X[:, self.kept_]
+
+
+def to_text_pipeline(count_pipeline, feature_names):
+    """Rebuild the fitted count-space pipeline as TfidfVectorizer + LinearSVC."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.pipeline import Pipeline
+
+    kept = count_pipeline.named_steps["select"].kept_
+    vectorizer = TfidfVectorizer(
+        **TFIDF_PARAMS,
+        vocabulary={feature_names[i]: j for j, i in enumerate(kept)},
+    )
+    vectorizer.idf_ = count_pipeline.named_steps["tfidf"].idf_
+    return Pipeline([
+        ("tfidf", vectorizer),
+        ("clf", count_pipeline.named_steps["clf"]),
+    ])
+
+
 def train_classifier(df: pd.DataFrame):
     """Train TF-IDF + SVM pipeline."""
-    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.feature_extraction.text import TfidfTransformer
     from sklearn.svm import LinearSVC
     from sklearn.pipeline import Pipeline
     from sklearn.model_selection import cross_val_score
@@ -67,23 +194,21 @@ def train_classifier(df: pd.DataFrame):
         return None, None
 
     # Preprocess
-    df_filtered["text"] = df_filtered["product_name"].apply(preprocess_text)
+    df_filtered["text"] = preprocess_series(df_filtered["product_name"])
 
     # Add description if available
     if "description" in df_filtered.columns:
         df_filtered["text"] = df_filtered["text"] + " " + df_filtered["description"].fillna("")
 
-    X = df_filtered["text"].values
+    # Tokenize once; CV folds and the final fit share the count matrix
+    tokens = tokenize_cached(df_filtered["text"].tolist())
+    X, feature_names = build_count_matrix(tokens)
     y = df_filtered["categoryId"].values
 
     # Build pipeline
     pipeline = Pipeline([
-        ("tfidf", TfidfVectorizer(
-            ngram_range=(1, 2),
-            max_features=5000,
-            sublinear_tf=True,
-            strip_accents="unicode",
-        )),
+        ("select", TopTermsSelector(MAX_FEATURES)),
+        ("tfidf", TfidfTransformer(sublinear_tf=TFIDF_PARAMS["sublinear_tf"])),
         ("clf", LinearSVC(C=1.0, max_iter=10000)),
     ])
 
@@ -97,6 +222,7 @@ def train_classifier(df: pd.DataFrame):
 
     # Train on full data
     pipeline.fit(X, y)
+    pipeline = to_text_pipeline(pipeline, feature_names)
 
     # Build category ID -> name map
     category_map = (
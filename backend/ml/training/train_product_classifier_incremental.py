@@ -0,0 +1,411 @@
+"""
+B.4 - Product Category Classifier (incremental variant)
+Folds newly categorized products into the category model without a full retrain.
+
+Uses a stateless HashingVectorizer + SGDClassifier (partial_fit), so an update
+only costs hashing the new names and one online step. A full retrain is only run
+when drift is detected:
+  - the update brings a category the model has never seen that now has at least
+    MIN_CATEGORY_SAMPLES products (smaller ones are kept until they do), or
+  - the prequential accuracy over the last DRIFT_WINDOW updated products drops
+    more than DRIFT_TOLERANCE below the holdout accuracy of the last full retrain.
+
+Input: exports/products/products_categories.csv (full retrain / benchmark)
+       CSV with product_name, categoryId[, category_name, description] (--update)
+Every --update file is appended to exports/products/products_category_updates.csv
+and full retrains train on the export plus those rows, so updated products survive
+a retrain even before the next export.
+
+Output: models/products/category_classifier_incremental.pkl
+        models/products/category_incremental_state.json
+        models/products/category_incremental_benchmark.json (--benchmark)
+
+Usage:
+    python train_product_classifier_incremental.py                    # full retrain
+    python train_product_classifier_incremental.py --update new.csv   # online update
+    python train_product_classifier_incremental.py --benchmark        # compare vs B.4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import pandas as pd
+import numpy as np
+import joblib
+
+from train_product_classifier import (
+    EXPORTS_DIR,
+    MIN_CATEGORY_SAMPLES,
+    MODELS_DIR,
+    load_data,
+    preprocess_series,
+    train_classifier,
+)
+
+MODEL_PATH = os.path.join(MODELS_DIR, "category_classifier_incremental.pkl")
+STATE_PATH = os.path.join(MODELS_DIR, "category_incremental_state.json")
+BENCHMARK_PATH = os.path.join(MODELS_DIR, "category_incremental_benchmark.json")
+UPDATES_PATH = os.path.join(EXPORTS_DIR, "products_category_updates.csv")
+
+HASH_FEATURES = 2 ** 16  # coef_ is (classes, HASH_FEATURES): keep it small, --update rewrites it
+DRIFT_WINDOW = 200  # Most recent updated products used for prequential accuracy
+DRIFT_MIN_SAMPLES = 50  # Don't judge drift on fewer updated products than this
+DRIFT_TOLERANCE = 0.10  # Allowed accuracy drop vs. last full retrain
+
+
+def build_texts(df: pd.DataFrame) -> np.ndarray:
+    """Same text representation as the TF-IDF classifier."""
+    text = preprocess_series(df["product_name"])
+    if "description" in df.columns:
+        text = text + " " + df["description"].fillna("")
+    return text.values
+
+
+def build_pipeline():
+    """HashingVectorizer + linear SVM trained by SGD (supports partial_fit)."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+
+    return Pipeline([
+        ("hash", HashingVectorizer(
+            ngram_range=(1, 2),
+            n_features=HASH_FEATURES,
+            alternate_sign=False,
+            strip_accents="unicode",
+        )),
+        ("clf", SGDClassifier(
+            loss="hinge",
+            alpha=1e-5,
+            max_iter=50,
+            tol=1e-4,
+            random_state=42,
+        )),
+    ])
+
+
+def stratify_labels(y, test_size: float):
+    """
+    Labels for a stratified split, or None when stratifying would fail: a class
+    with a single product, or fewer test rows than classes (many small categories).
+    """
+    counts = pd.Series(y).value_counts()
+    n_test = int(np.ceil(len(y) * test_size))
+    if counts.min() < 2 or n_test < len(counts) or len(y) - n_test < len(counts):
+        return None
+    return y
+
+
+def save_updates(df_new: pd.DataFrame):
+    """Append the update rows so later full retrains include them."""
+    os.makedirs(EXPORTS_DIR, exist_ok=True)
+    write_header = not os.path.exists(UPDATES_PATH)
+    df_new.to_csv(UPDATES_PATH, mode="a", header=write_header, index=False)
+
+
+def load_training_data() -> pd.DataFrame:
+    """Export + every saved update (the latest row wins per product_id)."""
+    df = load_data()
+    if os.path.exists(UPDATES_PATH):
+        df = pd.concat([df, pd.read_csv(UPDATES_PATH)], ignore_index=True)
+        if "product_id" in df.columns:
+            df = df.drop_duplicates("product_id", keep="last")
+    return df
+
+
+def filter_categories(df: pd.DataFrame) -> pd.DataFrame:
+    category_counts = df["categoryId"].value_counts()
+    valid_categories = category_counts[category_counts >= MIN_CATEGORY_SAMPLES].index
+    return df[df["categoryId"].isin(valid_categories)].copy()
+
+
+def train_full(df: pd.DataFrame):
+    """Full retrain: holdout accuracy as drift baseline, then fit on everything."""
+    from sklearn.model_selection import train_test_split
+
+    df_filtered = filter_categories(df)
+    n_categories = df_filtered["categoryId"].nunique()
+    print(f"Categories with >= {MIN_CATEGORY_SAMPLES} products: {n_categories}")
+    print(f"Products in training set: {len(df_filtered)}")
+
+    if n_categories < 2:
+        print("ERROR: Need at least 2 categories with enough products")
+        return None, None
+
+    X = build_texts(df_filtered)
+    y = df_filtered["categoryId"].values
+
+    baseline_accuracy = None
+    if len(df_filtered) >= 10:
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42, stratify=stratify_labels(y, 0.2),
+        )
+        holdout = build_pipeline().fit(X_train, y_train)
+        baseline_accuracy = float((holdout.predict(X_test) == y_test).mean())
+        print(f"\nHoldout accuracy: {baseline_accuracy:.3f}")
+    else:
+        print("\nToo few samples for a holdout estimate")
+
+    start = time.perf_counter()
+    pipeline = build_pipeline().fit(X, y)
+    elapsed = time.perf_counter() - start
+    print(f"Full fit time: {elapsed:.2f}s")
+
+    state = {
+        "trained_at": time.time(),
+        "n_samples": int(len(df_filtered)),
+        "baseline_accuracy": baseline_accuracy,
+        "recent_correct": [],
+        "updates_since_retrain": 0,
+        "category_map": {
+            str(k): v
+            for k, v in df_filtered.drop_duplicates("categoryId")
+            .set_index("categoryId")["category_name"]
+            .to_dict()
+            .items()
+        },
+    }
+    return pipeline, state
+
+
+def update_model(pipeline, state: dict, df_new: pd.DataFrame, category_counts=None) -> dict:
+    """
+    Fold newly categorized products into the model with partial_fit.
+
+    Every product is predicted before it is learned (prequential evaluation) so
+    the rolling accuracy reflects how well the model handles unseen products.
+    Returns a summary with the detected drift reason, if any.
+
+    category_counts ({str(categoryId): total products}) limits the "new category"
+    drift to categories a full retrain would keep (>= MIN_CATEGORY_SAMPLES);
+    without it every unseen category counts.
+    """
+    vectorizer = pipeline.named_steps["hash"]
+    clf = pipeline.named_steps["clf"]
+
+    start = time.perf_counter()
+    X = vectorizer.transform(build_texts(df_new))
+    y = df_new["categoryId"].values
+
+    known = np.isin(y, clf.classes_)
+    unseen = sorted({str(c) for c in y[~known]})
+
+    if known.any():
+        correct = clf.predict(X[known]) == y[known]
+        state["recent_correct"] = (
+            state["recent_correct"] + correct.astype(int).tolist()
+        )[-DRIFT_WINDOW:]
+        clf.partial_fit(X[known], y[known])
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    state["updates_since_retrain"] += int(known.sum())
+    if "category_name" in df_new.columns:
+        for category_id, name in zip(df_new["categoryId"], df_new["category_name"]):
+            state["category_map"].setdefault(str(category_id), name)
+
+    recent = state["recent_correct"]
+    rolling_accuracy = float(np.mean(recent)) if recent else None
+    baseline = state.get("baseline_accuracy")
+
+    trainable = [
+        c for c in unseen
+        if category_counts is None or category_counts.get(c, 0) >= MIN_CATEGORY_SAMPLES
+    ]
+
+    drift = None
+    if trainable:
+        drift = f"new categories: {', '.join(trainable)}"
+    elif (
+        baseline is not None
+        and len(recent) >= DRIFT_MIN_SAMPLES
+        and rolling_accuracy < baseline - DRIFT_TOLERANCE
+    ):
+        drift = f"rolling accuracy {rolling_accuracy:.3f} < baseline {baseline:.3f}"
+
+    return {
+        "learned": int(known.sum()),
+        "skipped": int((~known).sum()),
+        "pending_categories": [c for c in unseen if c not in trainable],
+        "elapsed_ms": round(elapsed_ms, 2),
+        "rolling_accuracy": rolling_accuracy,
+        "drift": drift,
+    }
+
+
+def save(pipeline, state: dict):
+    # Hash buckets never seen keep a zero weight: stored sparse, the pickle holds
+    # only the seen features instead of classes x HASH_FEATURES floats
+    clf = pipeline.named_steps["clf"]
+    clf.sparsify()
+    try:
+        joblib.dump(pipeline, MODEL_PATH)
+    finally:
+        clf.densify()
+    with open(STATE_PATH, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    print(f"\nModel saved to: {MODEL_PATH}")
+    print(f"State saved to: {STATE_PATH}")
+
+
+def run_full():
+    df = load_training_data()
+    print(f"Total products with categories: {len(df)}")
+    pipeline, state = train_full(df)
+    if pipeline is None:
+        print("\nTraining failed - not enough data")
+        return
+    save(pipeline, state)
+
+
+def run_update(update_path: str):
+    if not os.path.exists(update_path):
+        print(f"ERROR: Update file not found: {update_path}")
+        sys.exit(1)
+    df_new = pd.read_csv(update_path)
+    print(f"New categorized products: {len(df_new)}")
+    save_updates(df_new)
+
+    if not (os.path.exists(MODEL_PATH) and os.path.exists(STATE_PATH)):
+        print("No incremental model yet - running full retrain")
+        run_full()
+        return
+
+    pipeline = joblib.load(MODEL_PATH)
+    pipeline.named_steps["clf"].densify()  # partial_fit needs a dense coef_
+    with open(STATE_PATH, "r", encoding="utf-8") as f:
+        state = json.load(f)
+
+    df = load_training_data()
+    category_counts = df["categoryId"].astype(str).value_counts().to_dict()
+    summary = update_model(pipeline, state, df_new, category_counts)
+    print(
+        f"Learned {summary['learned']} products in {summary['elapsed_ms']:.1f} ms "
+        f"({summary['skipped']} skipped)"
+    )
+    if summary["rolling_accuracy"] is not None:
+        print(f"Rolling accuracy: {summary['rolling_accuracy']:.3f}")
+    if summary["pending_categories"]:
+        print(
+            f"New categories below {MIN_CATEGORY_SAMPLES} products (waiting): "
+            f"{', '.join(summary['pending_categories'])}"
+        )
+
+    if summary["drift"]:
+        print(f"\nDrift detected ({summary['drift']}) - running full retrain")
+        pipeline, state = train_full(df)
+        if pipeline is None:
+            print("\nTraining failed - not enough data")
+            return
+
+    save(pipeline, state)
+
+
+def run_benchmark():
+    """Compare accuracy and (re)train time against the TF-IDF + LinearSVC pipeline."""
+    from sklearn.model_selection import train_test_split
+
+    df = filter_categories(load_data())
+    df_train, df_test = train_test_split(
+        df, test_size=0.2, random_state=42, stratify=stratify_labels(df["categoryId"], 0.2),
+    )
+    X_test = build_texts(df_test)
+    y_test = df_test["categoryId"].values
+    print(f"Train: {len(df_train)} products, test: {len(df_test)} products")
+
+    # Current pipeline: TF-IDF + LinearSVC with 5-fold CV, as run by train_all.py
+    print("\n--- TF-IDF + LinearSVC (train_product_classifier.py) ---")
+    start = time.perf_counter()
+    baseline, _ = train_classifier(df_train)
+    baseline_seconds = time.perf_counter() - start
+    if baseline is None:
+        print("\nBenchmark failed - not enough data")
+        return
+    baseline_accuracy = float((baseline.predict(X_test) == y_test).mean())
+
+    # Incremental: full fit on the train split
+    X_train = build_texts(df_train)
+    y_train = df_train["categoryId"].values
+    start = time.perf_counter()
+    incremental = build_pipeline().fit(X_train, y_train)
+    full_seconds = time.perf_counter() - start
+    full_accuracy = float((incremental.predict(X_test) == y_test).mean())
+
+    # Incremental: fit on 90% of the train split, then stream the remaining
+    # 10% one product at a time as if they were newly categorized.
+    df_initial, df_stream = train_test_split(
+        df_train, test_size=0.1, random_state=42, stratify=stratify_labels(df_train["categoryId"], 0.1),
+    )
+    streamed = build_pipeline().fit(build_texts(df_initial), df_initial["categoryId"].values)
+    state = {"recent_correct": [], "updates_since_retrain": 0, "category_map": {}}
+    update_ms = []
+    for i in range(len(df_stream)):
+        summary = update_model(streamed, state, df_stream.iloc[i:i + 1])
+        update_ms.append(summary["elapsed_ms"])
+    stream_accuracy = float((streamed.predict(X_test) == y_test).mean())
+
+    results = {
+        "train_size": int(len(df_train)),
+        "test_size": int(len(df_test)),
+        "tfidf_linearsvc": {
+            "accuracy": round(baseline_accuracy, 4),
+            "retrain_seconds": round(baseline_seconds, 3),
+        },
+        "hashing_sgd_full": {
+            "accuracy": round(full_accuracy, 4),
+            "retrain_seconds": round(full_seconds, 3),
+        },
+        "hashing_sgd_streamed": {
+            "accuracy": round(stream_accuracy, 4),
+            "updates": len(update_ms),
+            "update_ms_mean": round(float(np.mean(update_ms)), 3) if update_ms else None,
+            "update_ms_p95": round(float(np.percentile(update_ms, 95)), 3) if update_ms else None,
+        },
+    }
+
+    print("\nBenchmark results:")
+    print(f"  {'model':<24}{'accuracy':>10}{'time':>14}")
+    print(f"  {'TF-IDF + LinearSVC':<24}{baseline_accuracy:>10.3f}{baseline_seconds:>13.2f}s")
+    print(f"  {'Hashing + SGD (full)':<24}{full_accuracy:>10.3f}{full_seconds:>13.2f}s")
+    if update_ms:
+        print(
+            f"  {'Hashing + SGD (stream)':<24}{stream_accuracy:>10.3f}"
+            f"{np.mean(update_ms):>11.2f}ms/product"
+        )
+
+    with open(BENCHMARK_PATH, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nBenchmark saved to: {BENCHMARK_PATH}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental product category classifier")
+    parser.add_argument(
+        "--update",
+        type=str,
+        default=None,
+        help="CSV with newly categorized products to fold into the model",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Compare accuracy and retrain time against train_product_classifier.py",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("B.4 - Product Category Classifier (incremental)")
+    print("=" * 60)
+
+    if args.benchmark:
+        run_benchmark()
+    elif args.update:
+        run_update(args.update)
+    else:
+        run_full()
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,12 @@ interface ExtractionMetadata {
   entryId?: number | null;
 }
 
+interface RedactionResult {
+  path: string;
+  hash: string | null;
+  text: string | null;
+}
+
 interface ScriptPayload {
   text: string;
   metadata: ExtractionMetadata;
@@ -71,7 +77,7 @@ export class MlExtractionService {
     metadata: ExtractionMetadata,
     options?: { filePath?: string },
   ): Promise<ExtractionResultPayload | null> {
-    let redactedForPdf: { path: string; hash: string | null } | null = null;
+    let redactedForPdf: RedactionResult | null = null;
     if (options?.filePath) {
       redactedForPdf = this.redactPdf(options.filePath);
       const inferencePath = redactedForPdf?.path ?? options.filePath;
@@ -106,16 +112,21 @@ export class MlExtractionService {
       }
     }
 
-    if (!text?.trim()) {
+    // Sin texto de entrada se usa el que redact_pdf.py extrajo al abrir el PDF
+    const sourceText = text?.trim() ? text : (redactedForPdf?.text ?? '');
+    if (!sourceText.trim()) {
       return null;
     }
 
-    const sanitized = this.sanitizeText(text);
+    const sanitized = this.sanitizeText(sourceText);
     const payload: ScriptPayload = {
       text: sanitized.text,
       metadata,
       sanitized: sanitized.masked,
-      originalHash: crypto.createHash('sha256').update(text).digest('hex'),
+      originalHash: crypto
+        .createHash('sha256')
+        .update(sourceText)
+        .digest('hex'),
     };
 
     this.ensureComplianceMetadata();
@@ -149,7 +160,7 @@ export class MlExtractionService {
     };
   }
 
-  private redactPdf(filePath: string) {
+  private redactPdf(filePath: string): RedactionResult | null {
     if (!existsSync(this.redactionScript)) {
       if (!this.redactionWarningShown) {
         this.logger.warn(
@@ -163,10 +174,18 @@ export class MlExtractionService {
       os.tmpdir(),
       `redacted-${Date.now()}-${path.basename(filePath)}`,
     );
+    // --json: un solo proceso abre el PDF y devuelve ruta, hash y texto redactado
     const proc = spawnSync(
       this.redactionBin,
-      ['--input', filePath, '--output', tempPath],
-      { encoding: 'utf-8', maxBuffer: 10 * 1024 * 1024 },
+      [
+        this.redactionScript,
+        '--input',
+        filePath,
+        '--output',
+        tempPath,
+        '--json',
+      ],
+      { encoding: 'utf-8', maxBuffer: 32 * 1024 * 1024 },
     );
     if (proc.error) {
       this.logger.warn(
@@ -180,18 +199,29 @@ export class MlExtractionService {
       );
       return null;
     }
-    const output =
-      proc.stdout?.trim() && proc.stdout?.trim() !== tempPath
-        ? proc.stdout?.trim()
-        : tempPath;
+    let result: { output?: string; redactedHash?: string; text?: string };
+    try {
+      result = JSON.parse(proc.stdout?.trim() || '{}');
+    } catch (error) {
+      this.logger.warn(
+        `Salida no válida del script de redacción: ${
+          (error as Error)?.message ?? error
+        }`,
+      );
+      return null;
+    }
+    const output = result.output || tempPath;
     if (!existsSync(output)) {
       this.logger.warn(
         `El script de redacción no generó un archivo válido: ${output}`,
       );
       return null;
     }
-    const hash = this.computeFileHash(output);
-    return { path: output, hash };
+    return {
+      path: output,
+      hash: result.redactedHash ?? this.computeFileHash(output),
+      text: typeof result.text === 'string' ? result.text : null,
+    };
   }
 
   private cleanupTempFile(filePath?: string) {